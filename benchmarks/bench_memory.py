@@ -0,0 +1,303 @@
+"""Measure the memory used by ConText and check it against a baseline.
+
+Memory is measured with tracemalloc, which counts the bytes allocated by Python and by spaCy's
+Cython code, and by sampling the RSS of the process. The metrics are:
+
+    doc_peak_bytes            Mean peak memory while tokenizing and running ConText on a Doc.
+    doc_retained_bytes        Mean memory still held by a processed Doc.
+    doc_retained_lean_bytes   The same in lean mode, where only a CompactConTextGraph is stored.
+    tag_object_bytes          Mean size of a TagObject, including its scope Span.
+    context_graph_bytes       Mean size of a ConTextGraph, including its TagObjects.
+    user_data_bytes           Mean growth of Doc.user_data from Span._.modifiers and the assertion attributes.
+    user_data_bytes_per_edge  user_data_bytes divided by the number of edges.
+    component_bytes_<n>       Size of a ConTextComponent with n rules.
+    rule_set_bytes_<n>        Size of a ConTextRuleSet with n rules.
+    rss_peak_kb               Peak RSS sampled while processing the corpus. Not checked against the baseline.
+
+The results are written as JSON with sorted keys, so that they can be diffed and compared between runs:
+
+    $ python benchmarks/bench_memory.py --output baseline.json
+    $ python benchmarks/bench_memory.py --baseline baseline.json --tolerance 0.1
+
+With --baseline, the script exits with status 1 if any metric grew by more than the tolerance.
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+from spacy.tokens import Span
+
+from cycontext import ConTextComponent, ConTextItem
+from cycontext.cli import build_pipeline
+from cycontext.rule_set import ConTextRuleSet
+from cycontext.tag_object import TagObject
+
+# The version of the output format
+FORMAT_VERSION = 1
+
+SENTENCES = [
+    "There is no evidence of pneumonia.",
+    "History of afib and chf.",
+    "Possible cough, but no fever.",
+    "Patient denies chest pain.",
+    "Mother has a history of diabetes.",
+    "Pneumonia is ruled out.",
+]
+TARGET_WORDS = {"pneumonia", "afib", "chf", "cough", "fever", "pain", "diabetes"}
+
+RULE_COUNTS = (10, 100, 1000)
+
+
+def make_corpus(num_docs, sentences_per_doc=6):
+    return [
+        " ".join(
+            SENTENCES[(i + j) % len(SENTENCES)] for j in range(sentences_per_doc)
+        )
+        for i in range(num_docs)
+    ]
+
+
+def make_doc(nlp, text):
+    doc = nlp(text)
+    doc.ents = [
+        Span(doc, token.i, token.i + 1, label="PROBLEM")
+        for token in doc
+        if token.lower_ in TARGET_WORDS
+    ]
+    return doc
+
+
+class RSSSampler:
+    """Sample the RSS of this process in a background thread and keep the peak, in kB."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def rss():
+        try:
+            with open("/proc/self/statm") as f:
+                pages = int(f.read().split()[1])
+            return pages * os.sysconf("SC_PAGE_SIZE") // 1024
+        except (OSError, ValueError):
+            import resource
+
+            # ru_maxrss is already the peak, in kB on Linux
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.rss())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.peak = self.rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.rss())
+
+
+def _traced():
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def measure_docs(nlp, context, texts):
+    """Returns the mean peak and retained bytes per Doc. The Docs are kept until all are measured."""
+    docs = []
+    peaks = []
+    retained = []
+    for text in texts:
+        before = _traced()
+        tracemalloc.reset_peak()
+        doc = context(make_doc(nlp, text))
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        retained.append(_traced() - before)
+        docs.append(doc)
+    return sum(peaks) // len(peaks), sum(retained) // len(retained)
+
+
+def measure_graph_parts(nlp, context, texts):
+    """Returns the mean bytes of each TagObject, of each ConTextGraph, and of the user_data
+    written for the targets of each Doc, and the mean user_data bytes per edge.
+    This repeats the steps of ConTextComponent._process so that each can be measured alone.
+    """
+    keep = []
+    tag_bytes = 0
+    num_tags = 0
+    graph_bytes = 0
+    user_data_bytes = 0
+    num_edges = 0
+    for text in texts:
+        doc = make_doc(nlp, text)
+        matches = context._rules.match(doc)
+
+        before = _traced()
+        tags = [TagObject(item, start, end, doc) for (item, start, end) in matches]
+        tag_bytes += _traced() - before
+        num_tags += len(tags)
+        keep.append(tags)
+
+        before = _traced()
+        graph = context._build_graph(doc, doc.ents, matches)
+        graph_bytes += _traced() - before
+        keep.append(graph)
+
+        before = _traced()
+        if context.add_attrs:
+            context.set_context_attributes(graph.edges)
+        for (target, modifier) in graph.edges:
+            target._.modifiers += (modifier,)
+        user_data_bytes += _traced() - before
+        num_edges += len(graph.edges)
+        keep.append(doc)
+    return (
+        tag_bytes // max(num_tags, 1),
+        graph_bytes // len(texts),
+        user_data_bytes // len(texts),
+        user_data_bytes // max(num_edges, 1),
+    )
+
+
+def make_rules(num_rules):
+    return [
+        ConTextItem(
+            "modifier phrase {0}".format(i),
+            "NEGATED_EXISTENCE" if i % 2 else "HISTORICAL",
+            rule="FORWARD",
+        )
+        for i in range(num_rules)
+    ]
+
+
+def measure_rules(nlp, num_rules):
+    """Returns the bytes of a ConTextComponent and of a ConTextRuleSet with num_rules rules."""
+    item_data = make_rules(num_rules)
+    before = _traced()
+    context = ConTextComponent(nlp, rules=None)
+    context.add(item_data)
+    component_bytes = _traced() - before
+    del context
+
+    item_data = make_rules(num_rules)
+    before = _traced()
+    rules = ConTextRuleSet(nlp)
+    rules.add(item_data)
+    rule_set_bytes = _traced() - before
+    del rules
+    return component_bytes, rule_set_bytes
+
+
+def run_benchmarks(num_docs=200, model=None, rule_counts=RULE_COUNTS):
+    """Run all of the benchmarks and return a dict of results in the output format."""
+    nlp, context = build_pipeline(model=model)
+    lean_context = ConTextComponent(nlp, lean=True)
+    texts = make_corpus(num_docs)
+    # Process a Doc first so that lexemes and rule tables created on first use aren't counted
+    context(make_doc(nlp, texts[0]))
+    lean_context(make_doc(nlp, texts[0]))
+
+    metrics = {}
+    with RSSSampler() as sampler:
+        tracemalloc.start()
+        try:
+            metrics["doc_peak_bytes"], metrics["doc_retained_bytes"] = measure_docs(
+                nlp, context, texts
+            )
+            _, metrics["doc_retained_lean_bytes"] = measure_docs(nlp, lean_context, texts)
+            (
+                metrics["tag_object_bytes"],
+                metrics["context_graph_bytes"],
+                metrics["user_data_bytes"],
+                metrics["user_data_bytes_per_edge"],
+            ) = measure_graph_parts(nlp, context, texts)
+            for num_rules in rule_counts:
+                (
+                    metrics["component_bytes_{0}".format(num_rules)],
+                    metrics["rule_set_bytes_{0}".format(num_rules)],
+                ) = measure_rules(nlp, num_rules)
+        finally:
+            tracemalloc.stop()
+    metrics["rss_peak_kb"] = sampler.peak
+    return {
+        "version": FORMAT_VERSION,
+        "config": {
+            "num_docs": num_docs,
+            "model": model,
+            "rule_counts": list(rule_counts),
+        },
+        "metrics": metrics,
+    }
+
+
+def compare(results, baseline, tolerance=0.1):
+    """Returns a list of (metric, baseline_value, value) for each metric which grew by more than
+    tolerance relative to the baseline, and (metric, baseline_value, None) for each metric of the
+    baseline which is missing from the results. RSS metrics are not compared, since they depend on the machine.
+
+    Raises:
+        ValueError: if the results were created with a different format version or configuration.
+    """
+    if results["version"] != baseline["version"] or results["config"] != baseline["config"]:
+        raise ValueError(
+            "Cannot compare results with a different version or configuration: {0} and {1}".format(
+                (results["version"], results["config"]),
+                (baseline["version"], baseline["config"]),
+            )
+        )
+    regressions = []
+    for (name, baseline_value) in sorted(baseline["metrics"].items()):
+        if name.startswith("rss_"):
+            continue
+        value = results["metrics"].get(name)
+        if value is None or value > baseline_value * (1 + tolerance):
+            regressions.append((name, baseline_value, value))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--docs", type=int, default=200)
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--output", default=None, help="Write the results as JSON to this file.")
+    parser.add_argument(
+        "--baseline", default=None, help="Compare the results against a previous output file."
+    )
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(num_docs=args.docs, model=args.model)
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for (name, baseline_value, value) in regressions:
+            if value is None:
+                print("{0}: {1} -> missing".format(name, baseline_value), file=sys.stderr)
+            else:
+                print("{0}: {1} -> {2}".format(name, baseline_value, value), file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Compare a prefork worker pool against workers which each build their own pipeline.
+
+For each mode, reports the time from starting the pool until the first document is returned,
+and the memory of each worker after processing a corpus: RSS, PSS (which divides shared pages
+between the processes sharing them) and USS (the pages which only belong to that worker).
+Memory is read from /proc, so it is only reported on Linux.
+
+Example:
+    $ python benchmarks/bench_prefork.py --workers 4 --model en_core_web_sm --docs 2000
+"""
+import argparse
+import multiprocessing
+import time
+
+from cycontext import cli
+
+RECORD = {
+    "id": 0,
+    "text": "There is no evidence of pneumonia. History of afib. Possible cough, but no fever.",
+    "ents": [[24, 33, "PROBLEM"], [46, 50, "PROBLEM"], [61, 66, "PROBLEM"], [75, 80, "PROBLEM"]],
+}
+
+
+def process_memory(pid):
+    """Returns a dict of the rss, pss and uss of a process in kB, or None if it can't be read."""
+    try:
+        with open("/proc/{0}/smaps_rollup".format(pid)) as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    fields = {}
+    for line in lines:
+        parts = line.split()
+        if len(parts) == 3 and parts[2] == "kB":
+            fields[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "uss": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def _start_pool(mode, workers, pipeline_kwargs):
+    if mode == "prefork":
+        return cli.prefork_pool(workers, pipeline_kwargs)
+    return multiprocessing.get_context(mode).Pool(
+        workers, initializer=cli._init_worker, initargs=(pipeline_kwargs,)
+    )
+
+
+def bench(mode, workers, pipeline_kwargs, num_docs, batch_size):
+    """Start a pool, process num_docs copies of RECORD and measure it.
+
+    Args:
+        mode (str): "prefork", or a multiprocessing start method such as "spawn" or "fork"
+            for workers which build their own pipeline.
+
+    Returns:
+        result: a dict with the time to the first document in seconds, the total time,
+            and the memory of each worker.
+    """
+    start = time.perf_counter()
+    pool = _start_pool(mode, workers, pipeline_kwargs)
+    with pool:
+        pool.apply(cli._process_batch_in_worker, ([RECORD],))
+        first_doc = time.perf_counter() - start
+        batches = [[RECORD] * batch_size] * max(num_docs // batch_size, workers)
+        # chunksize=1 spreads the batches across all of the workers
+        pool.map(cli._process_batch_in_worker, batches, chunksize=1)
+        total = time.perf_counter() - start
+        # Pool has no public list of its worker processes
+        memory = [process_memory(process.pid) for process in pool._pool]
+    return {"mode": mode, "first_doc": first_doc, "total": total, "memory": memory}
+
+
+def format_result(result):
+    lines = [
+        "{0}: first document {1:.3f}s, total {2:.3f}s".format(
+            result["mode"], result["first_doc"], result["total"]
+        )
+    ]
+    for (i, memory) in enumerate(result["memory"]):
+        if memory is None:
+            lines.append("  worker {0}: memory unavailable".format(i))
+        else:
+            lines.append(
+                "  worker {0}: rss {1} kB, pss {2} kB, uss {3} kB".format(
+                    i, memory["rss"], memory["pss"], memory["uss"]
+                )
+            )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--rules", default=None)
+    parser.add_argument("--docs", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument(
+        "--modes",
+        default="spawn,prefork",
+        help="Comma-separated modes to compare. Default 'spawn,prefork'.",
+    )
+    args = parser.parse_args(argv)
+    pipeline_kwargs = {"model": args.model, "rules": args.rules}
+    for mode in args.modes.split(","):
+        result = bench(mode, args.workers, pipeline_kwargs, args.docs, args.batch_size)
+        print(format_result(result), flush=True)
+
+
+if __name__ == "__main__":
+    main()
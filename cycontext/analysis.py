@@ -0,0 +1,299 @@
+"""Static analysis of ConTextItems to find rules which overlap or are redundant.
+
+Many rules can match inside another rule: for example, "history of" inside "no history of".
+Both match at runtime, and pruning then throws away the shorter one. `analyze_rules` finds these
+pairs ahead of time. The resulting suppression table is used by ConTextRuleSet.match to drop
+redundant sub-matches before TagObjects are created, and the overlaps are reported so that
+duplicate or shadowed rules can be cleaned up in the rule file.
+"""
+from collections import namedtuple
+
+# A token which can match any string
+ANY = None
+
+# The pattern attributes which compare the (lowercased) text of a token
+_TEXT_ATTRS = {"LOWER", "ORTH", "TEXT", "NORM"}
+
+RuleOverlap = namedtuple("RuleOverlap", ["kind", "rule", "other"])
+RuleOverlap.__doc__ = """An overlap between two rules found by `analyze_rules`.
+
+kind (str): One of:
+    - "duplicate": Both rules match the same text with the same category and rule.
+    - "conflict": Both rules match the same text but with a different category or rule.
+    - "pseudo_shadowed": rule can match inside a longer PSEUDO rule, which will prevent it from modifying targets.
+    - "subsumed": rule can match inside a longer rule, which will be kept instead when pruning.
+rule (int): The index of the first or shorter rule.
+other (int): The index of the second or longer rule.
+"""
+
+
+class RuleAnalysis:
+    """The results of `analyze_rules`."""
+
+    def __init__(self, item_data, suppression_table, overlaps):
+        """Create a new RuleAnalysis.
+
+        Args:
+            item_data: The list of ConTextItems which were analyzed.
+            suppression_table: A dict mapping the index of a rule to a frozenset of the indices of
+                the strictly shorter rules which can match inside it.
+            overlaps: A list of RuleOverlap tuples.
+        """
+        self.item_data = item_data
+        self.suppression_table = suppression_table
+        self.overlaps = overlaps
+
+    def filter(self, kind):
+        """Returns the overlaps of a single kind."""
+        return [overlap for overlap in self.overlaps if overlap.kind == kind]
+
+    def format_report(self):
+        """Returns a human-readable report of the overlaps, one per line."""
+        lines = []
+        for overlap in self.overlaps:
+            lines.append(
+                "{0}: {1} <-> {2}".format(
+                    overlap.kind,
+                    self.item_data[overlap.rule],
+                    self.item_data[overlap.other],
+                )
+            )
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return "<RuleAnalysis> of {0} rules with {1} overlaps".format(
+            len(self.item_data), len(self.overlaps)
+        )
+
+
+def _token_set(token_pattern):
+    """Return the set of lowercase strings which a token pattern can match, or ANY."""
+    keys = set(token_pattern.keys()) - {"OP"}
+    if len(keys) != 1:
+        return ANY
+    (attr,) = keys
+    if attr.upper() not in _TEXT_ATTRS:
+        return ANY
+    value = token_pattern[attr]
+    if isinstance(value, str):
+        return frozenset([value.lower()])
+    if isinstance(value, dict) and set(value.keys()) == {"IN"}:
+        return frozenset(val.lower() for val in value["IN"])
+    return ANY
+
+
+def _expansions(item, tokenizer, max_expansions=64):
+    """Return a list of the token sequences which a rule can match, where each token is
+    a frozenset of strings or ANY, or None if the rule can match sequences of unbounded length.
+    """
+    if item.pattern is None:
+        return [tuple(frozenset([token]) for token in tokenizer(item.literal))]
+    expansions = [()]
+    for token_pattern in item.pattern:
+        op = token_pattern.get("OP")
+        token = _token_set(token_pattern)
+        if op in ("*", "+"):
+            return None
+        if op == "!":
+            # A negated token still matches exactly one token, which can be any other text
+            token = ANY
+        if op == "?":
+            expansions = expansions + [expansion + (token,) for expansion in expansions]
+        else:
+            expansions = [expansion + (token,) for expansion in expansions]
+        if len(expansions) > max_expansions:
+            return None
+    return [expansion for expansion in expansions if expansion]
+
+
+def _tokens_intersect(token1, token2):
+    if token1 is ANY or token2 is ANY:
+        return True
+    return bool(token1 & token2)
+
+
+def _fits_inside(inner, outer):
+    """Returns True if the token sequence inner can match a strictly shorter window of outer."""
+    if len(inner) >= len(outer):
+        return False
+    for offset in range(len(outer) - len(inner) + 1):
+        if all(
+            _tokens_intersect(token, outer[offset + i]) for (i, token) in enumerate(inner)
+        ):
+            return True
+    return False
+
+
+def _windows_overlap(seq1, seq2):
+    """Returns True if the token sequences seq1 and seq2 can match windows which share at least one token."""
+    for offset in range(-len(seq2) + 1, len(seq1)):
+        # seq2 starts at position offset of seq1
+        if all(
+            _tokens_intersect(seq1[offset + i], token)
+            for (i, token) in enumerate(seq2)
+            if 0 <= offset + i < len(seq1)
+        ):
+            return True
+    return False
+
+
+def _tokenizer_from_nlp(nlp, tokenizer):
+    if nlp is not None:
+        return lambda text: [token.lower_ for token in nlp.make_doc(text)]
+    if tokenizer is None:
+        return lambda text: text.lower().split()
+    return tokenizer
+
+
+def overlap_table(item_data, nlp=None, tokenizer=None):
+    """Find the pairs of rules whose matches can share at least one token.
+
+    Args:
+        item_data: A list of ConTextItems.
+        nlp: An optional spaCy model whose tokenizer is used to split literals.
+        tokenizer (callable or None): A function which splits a literal into a list of lowercase strings.
+
+    Returns:
+        table: a dict mapping the index of each rule to a set of the indices of the other rules
+            which can overlap it. Rules whose matches have unbounded length can overlap any rule.
+    """
+    tokenizer = _tokenizer_from_nlp(nlp, tokenizer)
+    expansions = [_expansions(item, tokenizer) for item in item_data]
+    table = {i: set() for i in range(len(item_data))}
+    for i in range(len(item_data)):
+        for j in range(i + 1, len(item_data)):
+            if (
+                expansions[i] is None
+                or expansions[j] is None
+                or any(
+                    _windows_overlap(seq1, seq2)
+                    for seq1 in expansions[i]
+                    for seq2 in expansions[j]
+                )
+            ):
+                table[i].add(j)
+                table[j].add(i)
+    return table
+
+
+def _same_text(item, other):
+    if item.pattern is None and other.pattern is None:
+        return item.literal == other.literal
+    return item.pattern is not None and item.pattern == other.pattern
+
+
+def analyze_rules(item_data, nlp=None, tokenizer=None):
+    """Find rules which can match inside other rules or which match the same text.
+
+    Args:
+        item_data: A list of ConTextItems.
+        nlp: An optional spaCy model whose tokenizer is used to split literals,
+            the same way ConTextComponent does.
+        tokenizer (callable or None): A function which splits a literal into a list of lowercase strings.
+            Used if nlp is None. If both are None, literals are split on whitespace.
+
+    Returns:
+        analysis: a RuleAnalysis
+    """
+    tokenizer = _tokenizer_from_nlp(nlp, tokenizer)
+    expansions = [_expansions(item, tokenizer) for item in item_data]
+    suppression_table = {}
+    overlaps = []
+    for (i, item) in enumerate(item_data):
+        for (j, other) in enumerate(item_data):
+            if i == j:
+                continue
+            if j > i and _same_text(item, other):
+                if item.category == other.category and item.rule == other.rule:
+                    overlaps.append(RuleOverlap("duplicate", i, j))
+                else:
+                    overlaps.append(RuleOverlap("conflict", i, j))
+                continue
+            if expansions[i] is None:
+                continue
+            if expansions[j] is None:
+                # The other rule can match text of any length, so it may contain this rule.
+                # Keep it in the suppression table since matches are checked at runtime,
+                # but don't report it.
+                suppression_table.setdefault(j, set()).add(i)
+                continue
+            if any(
+                _fits_inside(inner, outer)
+                for inner in expansions[i]
+                for outer in expansions[j]
+            ):
+                suppression_table.setdefault(j, set()).add(i)
+                if other.rule == "PSEUDO" and item.rule != "PSEUDO":
+                    overlaps.append(RuleOverlap("pseudo_shadowed", i, j))
+                else:
+                    overlaps.append(RuleOverlap("subsumed", i, j))
+    suppression_table = {
+        key: frozenset(value) for (key, value) in suppression_table.items()
+    }
+    return RuleAnalysis(item_data, suppression_table, overlaps)
+
+
+def suppress_submatches(matches, suppression_table, group=None):
+    """Remove matches which would always be removed by ConTextGraph.prune_modifiers.
+
+    A match of rule A is removed if it lies strictly inside a match of rule B, A is in the
+    suppression table of B, and every match which overlaps B lies inside B. In that case pruning
+    always keeps a match covering all of B, so removing A before pruning does not change the result.
+
+    Args:
+        matches: A list of (key, start, end) tuples sorted by start, where key is looked up
+            in suppression_table.
+        suppression_table: A dict mapping a key to a frozenset of keys which can match inside it.
+        group (callable or None): An optional function which maps a key to the group it belongs to,
+            such as its rule set. Matches of different groups are pruned separately, so they are
+            suppressed independently of each other.
+
+    Returns:
+        matches: a list of the remaining (key, start, end) tuples in the same order, or sorted by start
+            if group is not None
+    """
+    if group is not None:
+        groups = {}
+        for match in matches:
+            groups.setdefault(group(match[0]), []).append(match)
+        if len(groups) > 1:
+            rslt = []
+            for group_matches in groups.values():
+                rslt += suppress_submatches(group_matches, suppression_table)
+            # The sort is stable, so the matches of each group keep their order
+            return sorted(rslt, key=lambda x: x[1])
+    suppressed = set()
+    # lo is the index of the first match with the same start as the current match,
+    # and max_end is the largest end of the matches before lo
+    lo = 0
+    max_end = None
+    for (i, (key, start, end)) in enumerate(matches):
+        while matches[lo][1] < start:
+            if max_end is None or matches[lo][2] > max_end:
+                max_end = matches[lo][2]
+            lo += 1
+        contained = suppression_table.get(key)
+        if not contained:
+            continue
+        if max_end is not None and max_end > start:
+            # An earlier match overlaps this one from the left
+            continue
+        # Only the matches which start inside this one can overlap it
+        inside = []
+        isolated = True
+        for j in range(lo, len(matches)):
+            (other_key, other_start, other_end) = matches[j]
+            if other_start >= end:
+                break
+            if j == i or other_end <= start:
+                continue
+            if other_end > end:
+                isolated = False
+                break
+            if (other_end - other_start) < (end - start) and other_key in contained:
+                inside.append(j)
+        if isolated:
+            suppressed.update(inside)
+    if not suppressed:
+        return matches
+    return [match for (i, match) in enumerate(matches) if i not in suppressed]
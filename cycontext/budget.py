@@ -0,0 +1,125 @@
+"""Per-document limits on the work done by ConTextComponent.
+
+Most notes are processed in milliseconds, but a single pathological Doc can stall a worker:
+a sentence-less OCR dump makes every scope as long as the Doc, and thousands of matches of a short
+rule like "no" make the pairwise scope limiting in ConTextGraph.update_scopes quadratic.
+A WorkBudget attached to a ConTextComponent checks each Doc against a set of limits, and if one is
+exceeded the Doc is processed in a cheaper mode instead of failing. The Doc is processed with
+use_context_window, a scope of at most fallback_max_scope tokens and chunks of fallback_chunk_size
+tokens, so the work grows linearly with the length of the Doc instead of with the product of the
+number of modifiers and targets in a sentence. In addition, if max_modifiers or the deadline was exceeded,
+the scopes of the modifiers are not limited by each other, which skips update_scopes. The deadline is
+also checked while the scopes are being limited, in which case the graph is rebuilt in the cheaper mode.
+
+The reasons are stored in Doc._.context_degraded and counted by cycontext.stats.ConTextStats:
+
+    >>> budget = WorkBudget(max_tokens=20000, max_modifiers=2000, deadline=1.0)
+    >>> context = ConTextComponent(nlp, budget=budget)
+    >>> doc = context(nlp(text))
+    >>> doc._.context_degraded
+    ()
+"""
+import numpy as np
+from spacy.attrs import SENT_START
+
+MAX_TOKENS = "max_tokens"
+MAX_MODIFIERS = "max_modifiers"
+MAX_SENTENCE_LENGTH = "max_sentence_length"
+DEADLINE = "deadline"
+
+# The reasons for which scope limiting is skipped as well
+SKIP_SCOPE_LIMITS_REASONS = frozenset([MAX_MODIFIERS, DEADLINE])
+
+
+def longest_sentence(doc):
+    """Returns the number of tokens in the longest sentence of a Doc, or the length of the Doc
+    if sentence boundaries have not been set.
+    """
+    if len(doc) == 0 or not doc.is_sentenced:
+        return len(doc)
+    starts = np.flatnonzero(doc.to_array(SENT_START) == 1)
+    boundaries = np.concatenate([[0], starts[starts > 0], [len(doc)]])
+    return int(np.diff(boundaries).max())
+
+
+class WorkBudget:
+    """Limits on the work done by ConTextComponent for each Doc, and the settings of the cheaper
+    mode used when one of them is exceeded.
+    """
+
+    def __init__(
+        self,
+        max_tokens=None,
+        max_modifiers=None,
+        max_sentence_length=None,
+        deadline=None,
+        fallback_max_scope=10,
+        fallback_chunk_size=200,
+    ):
+        """Create a new WorkBudget. Limits which are None are not checked.
+
+        Args:
+            max_tokens (int or None): The maximum number of tokens in a Doc.
+            max_modifiers (int or None): The maximum number of modifiers matched in a Doc.
+            max_sentence_length (int or None): The maximum number of tokens in a sentence. A Doc without
+                sentence boundaries counts as a single sentence. Not checked if the component uses
+                use_context_window, since scopes don't depend on sentences then.
+            deadline (float or None): The maximum number of seconds spent on a Doc.
+            fallback_max_scope (int): The max_scope used with use_context_window when a limit is exceeded.
+            fallback_chunk_size (int): The chunk_size used when a limit is exceeded.
+
+        Raises:
+            ValueError: if a limit is not positive.
+        """
+        for (name, value) in (
+            ("max_tokens", max_tokens),
+            ("max_modifiers", max_modifiers),
+            ("max_sentence_length", max_sentence_length),
+            ("deadline", deadline),
+            ("fallback_max_scope", fallback_max_scope),
+            ("fallback_chunk_size", fallback_chunk_size),
+        ):
+            if value is not None and value <= 0:
+                raise ValueError(
+                    "'{0}' must be None or greater than 0, not {1}".format(name, value)
+                )
+        self.max_tokens = max_tokens
+        self.max_modifiers = max_modifiers
+        self.max_sentence_length = max_sentence_length
+        self.deadline = deadline
+        self.fallback_max_scope = fallback_max_scope
+        self.fallback_chunk_size = fallback_chunk_size
+
+    def check(self, doc, num_modifiers, elapsed, use_context_window=False):
+        """Check a Doc whose modifiers have been matched against the limits.
+
+        Args:
+            doc: a spaCy Doc
+            num_modifiers (int): the number of modifiers matched in doc
+            elapsed (float): the number of seconds spent on doc so far
+            use_context_window (bool): whether the component uses use_context_window
+
+        Returns:
+            reasons: a list of the names of the limits which were exceeded
+        """
+        reasons = []
+        if self.max_tokens is not None and len(doc) > self.max_tokens:
+            reasons.append(MAX_TOKENS)
+        if (
+            self.max_sentence_length is not None
+            and not use_context_window
+            and longest_sentence(doc) > self.max_sentence_length
+        ):
+            reasons.append(MAX_SENTENCE_LENGTH)
+        if self.max_modifiers is not None and num_modifiers > self.max_modifiers:
+            reasons.append(MAX_MODIFIERS)
+        if self.deadline is not None and elapsed > self.deadline:
+            reasons.append(DEADLINE)
+        return reasons
+
+    def __repr__(self):
+        return (
+            "<WorkBudget> max_tokens={0}, max_modifiers={1}, max_sentence_length={2}, deadline={3}".format(
+                self.max_tokens, self.max_modifiers, self.max_sentence_length, self.deadline
+            )
+        )
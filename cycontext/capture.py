@@ -0,0 +1,336 @@
+"""Capture slow Docs processed by ConTextComponent so that they can be reproduced.
+
+Pathological inputs are usually only noticed as a spike in the latency of a service, after the Doc is gone.
+A SlowDocCapture attached to a ConTextComponent times each Doc, and when one takes longer than a threshold
+it writes everything needed to run ConText on it again to a JSON file in a spool directory: the token texts
+and whitespace, the sentence boundaries, the targets, a fingerprint of the rules, the settings of the component
+and the time spent in each stage. Captures are rate limited, so that a burst of slow Docs can't fill the disk
+or slow down the service further.
+
+    >>> capture = SlowDocCapture("/var/spool/cycontext", threshold=0.5)
+    >>> context = ConTextComponent(nlp, capture=capture)
+
+A captured Doc is rebuilt with `load_capture` without running the spaCy model again, and `replay` runs it
+through a ConTextComponent under cProfile:
+
+    >>> doc, profile = replay(filepath, context)
+    >>> profile.sort_stats("cumulative").print_stats(20)
+
+The module can also be run as a script, which builds the component from the settings in the file:
+
+    $ python -m cycontext.capture /var/spool/cycontext/slow-1700000000000000000-123-0.json --rules my_rules.json
+"""
+import argparse
+import cProfile
+import hashlib
+import json
+import os
+import pstats
+import threading
+import time
+from collections import deque, namedtuple
+
+from spacy.tokens import Doc, Span
+
+from ._version import __version__
+
+# The version of the capture format
+FORMAT_VERSION = 1
+
+# The stages of ConTextComponent which are timed, in order
+STAGES = ("match", "graph", "results")
+
+# The settings of the component which are stored with each capture and used to rebuild it
+CONFIG_KEYS = (
+    "use_context_window",
+    "max_scope",
+    "max_targets",
+    "prune",
+    "remove_overlapping_modifiers",
+    "chunk_size",
+    "partition_rules",
+    "prefilter",
+)
+
+CapturedDoc = namedtuple("CapturedDoc", ["doc", "fingerprint", "config", "timings", "data"])
+CapturedDoc.__doc__ = """A Doc loaded from a capture file by `load_capture`.
+
+doc: The spaCy Doc, with the same tokens, sentence boundaries and targets in Doc.ents as the captured Doc.
+fingerprint (str): The fingerprint of the rules which processed the captured Doc. See `rules_fingerprint`.
+config (dict): The settings of the ConTextComponent, keyed by the names in CONFIG_KEYS.
+timings (dict): The seconds spent in each of STAGES, and in total.
+data (dict): The full contents of the capture file.
+"""
+
+
+def _json_default(value):
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if callable(value):
+        return "{0}.{1}".format(
+            getattr(value, "__module__", None), getattr(value, "__qualname__", repr(value))
+        )
+    return repr(value)
+
+
+def rules_fingerprint(rules):
+    """Returns a hex digest which identifies the rules of a ConTextRuleSet or MappedRuleSet.
+    Two rule sets have the same fingerprint if they contain the same ConTextItems, including their
+    callbacks by name, in the same order and in the same named rule sets.
+    """
+    digest = hashlib.sha256()
+    for (item, name) in zip(rules.item_data, rules.rule_set_names):
+        item_dict = item.to_dict()
+        item_dict["terminated_by"] = item.terminated_by
+        item_dict["on_match"] = item.on_match
+        item_dict["on_modifies"] = item.on_modifies
+        item_dict["rule_set"] = name
+        digest.update(
+            json.dumps(item_dict, sort_keys=True, default=_json_default).encode("utf-8")
+        )
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def doc_to_capture(doc, targets, rules, timings, config=None, reasons=()):
+    """Returns the JSON-serializable dict which is written for a captured Doc.
+
+    Args:
+        doc: a spaCy Doc
+        targets: the target Spans of doc
+        rules: the ConTextRuleSet or MappedRuleSet which processed doc
+        timings (dict): the seconds spent in each of STAGES, and in total
+        config (dict or None): the settings of the component, keyed by the names in CONFIG_KEYS
+        reasons (iterable): the limits of a WorkBudget which doc exceeded. See cycontext.budget.
+    """
+    if doc.is_sentenced:
+        sent_starts = [token.is_sent_start for token in doc]
+    else:
+        sent_starts = None
+    return {
+        "version": FORMAT_VERSION,
+        "cycontext_version": __version__,
+        "created": time.time(),
+        "words": [token.text for token in doc],
+        "spaces": [bool(token.whitespace_) for token in doc],
+        "sent_starts": sent_starts,
+        "targets": [[target.start, target.end, target.label_] for target in targets],
+        "fingerprint": rules_fingerprint(rules),
+        "num_rules": len(rules.item_data),
+        "config": dict(config or {}),
+        "timings": dict(timings),
+        "degraded": list(reasons),
+    }
+
+
+class SlowDocCapture:
+    """Writes the Docs which take longer than a threshold to a spool directory, at most
+    max_captures times in each interval of seconds and at most max_files files in total.
+    Can be shared between the threads of `ConTextComponent.pipe`.
+    """
+
+    def __init__(self, spool_dir, threshold=1.0, max_captures=10, interval=60.0, max_files=1000):
+        """Create a new SlowDocCapture. The spool directory is created if it doesn't exist.
+
+        Args:
+            spool_dir (str): The directory which capture files are written to.
+            threshold (float): The number of seconds spent on a Doc above which it is captured.
+            max_captures (int): The maximum number of Docs captured in any interval of seconds.
+            interval (float): The length of the rate limiting interval in seconds.
+            max_files (int or None): The maximum number of capture files in spool_dir, including
+                files written by other processes. If None, the number of files is not limited.
+
+        Raises:
+            ValueError: if a limit is not positive.
+        """
+        for (name, value) in (
+            ("threshold", threshold),
+            ("max_captures", max_captures),
+            ("interval", interval),
+            ("max_files", max_files),
+        ):
+            if value is not None and value <= 0:
+                raise ValueError(
+                    "'{0}' must be greater than 0, not {1}".format(name, value)
+                )
+        self.spool_dir = spool_dir
+        self.threshold = threshold
+        self.max_captures = max_captures
+        self.interval = interval
+        self.max_files = max_files
+        # The number of Docs written, and the number of slow Docs which were dropped by the rate limit
+        self.num_captured = 0
+        self.num_dropped = 0
+        self._capture_times = deque()
+        self._counter = 0
+        self._lock = threading.Lock()
+        os.makedirs(spool_dir, exist_ok=True)
+
+    def _num_files(self):
+        return sum(
+            1
+            for filename in os.listdir(self.spool_dir)
+            if filename.startswith("slow-") and filename.endswith(".json")
+        )
+
+    def _reserve(self, now):
+        """Returns the number of the next capture file, or None if the rate limit has been reached."""
+        with self._lock:
+            while self._capture_times and self._capture_times[0] <= now - self.interval:
+                self._capture_times.popleft()
+            if len(self._capture_times) >= self.max_captures or (
+                self.max_files is not None and self._num_files() >= self.max_files
+            ):
+                self.num_dropped += 1
+                return None
+            self._capture_times.append(now)
+            self._counter += 1
+            return self._counter - 1
+
+    def observe(self, doc, targets, rules, timings, config=None, reasons=()):
+        """Capture a Doc if it took longer than the threshold and the rate limit allows it.
+
+        Args:
+            doc: a spaCy Doc which has been processed
+            targets: the target Spans of doc
+            rules: the ConTextRuleSet or MappedRuleSet which processed doc
+            timings (dict): the seconds spent in each of STAGES, and in total
+            config (dict or None): the settings of the component, keyed by the names in CONFIG_KEYS
+            reasons (iterable): the limits of a WorkBudget which doc exceeded
+
+        Returns:
+            filepath: the path of the capture file, or None if the Doc wasn't captured
+        """
+        if timings["total"] <= self.threshold:
+            return None
+        number = self._reserve(time.monotonic())
+        if number is None:
+            return None
+        data = doc_to_capture(doc, targets, rules, timings, config, reasons)
+        filepath = os.path.join(
+            self.spool_dir,
+            "slow-{0}-{1}-{2}.json".format(time.time_ns(), os.getpid(), number),
+        )
+        # Write to a temporary file first so that readers never see a partial capture
+        tmp_filepath = filepath + ".tmp"
+        with open(tmp_filepath, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_filepath, filepath)
+        with self._lock:
+            self.num_captured += 1
+        return filepath
+
+    def __repr__(self):
+        return "<SlowDocCapture> {0} with threshold {1}s: {2} captured, {3} dropped".format(
+            self.spool_dir, self.threshold, self.num_captured, self.num_dropped
+        )
+
+
+def load_capture(filepath, nlp):
+    """Rebuild a captured Doc. The spaCy pipeline is not run, so the Doc only has the tokens,
+    sentence boundaries and targets which were captured.
+
+    Args:
+        filepath (str): The path of a capture file written by SlowDocCapture.
+        nlp: a spaCy Language whose vocab is used to create the Doc
+
+    Returns:
+        captured: a CapturedDoc
+
+    Raises:
+        ValueError: if the file was written with a different format version.
+    """
+    with open(filepath, encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("version") != FORMAT_VERSION:
+        raise ValueError(
+            "Cannot load a capture with format version {0}, expected {1}".format(
+                data.get("version"), FORMAT_VERSION
+            )
+        )
+    doc = Doc(nlp.vocab, words=data["words"], spaces=data["spaces"])
+    if data["sent_starts"] is not None:
+        for (token, is_sent_start) in zip(doc, data["sent_starts"]):
+            if is_sent_start is not None:
+                token.is_sent_start = is_sent_start
+    doc.ents = [Span(doc, start, end, label=label) for (start, end, label) in data["targets"]]
+    return CapturedDoc(doc, data["fingerprint"], data["config"], data["timings"], data)
+
+
+def replay(filepath, context, profile=True, check_rules=True):
+    """Run ConText on a captured Doc, optionally under cProfile.
+
+    Args:
+        filepath (str): The path of a capture file written by SlowDocCapture.
+        context: the ConTextComponent to run
+        profile (bool): Whether to profile the call to context.
+        check_rules (bool): Whether to check that context has the same rules as the component
+            which processed the captured Doc.
+
+    Returns:
+        doc: the processed Doc
+        stats: a pstats.Stats of the profile, or None if profile is False
+
+    Raises:
+        ValueError: if check_rules is True and the rules have a different fingerprint.
+    """
+    captured = load_capture(filepath, context.nlp)
+    if check_rules:
+        fingerprint = rules_fingerprint(context._rules)
+        if fingerprint != captured.fingerprint:
+            raise ValueError(
+                "The rules of the component have fingerprint {0}, but {1} was captured with {2}".format(
+                    fingerprint, filepath, captured.fingerprint
+                )
+            )
+    if not profile:
+        return context(captured.doc), None
+    profiler = cProfile.Profile()
+    doc = profiler.runcall(context, captured.doc)
+    return doc, pstats.Stats(profiler)
+
+
+def main(argv=None):
+    from .cli import build_pipeline
+
+    parser = argparse.ArgumentParser(description="Replay a captured Doc under cProfile.")
+    parser.add_argument("capture", help="A capture file written by SlowDocCapture.")
+    parser.add_argument(
+        "--rules",
+        default=None,
+        help="Path to the JSON or YAML rule file which the Doc was captured with. Default rules if not given.",
+    )
+    parser.add_argument("--sort", default="cumulative", help="The pstats sort key.")
+    parser.add_argument("--limit", type=int, default=30, help="The number of functions to print.")
+    parser.add_argument(
+        "--no-check-rules",
+        dest="check_rules",
+        action="store_false",
+        help="Replay the Doc even if the rules have a different fingerprint.",
+    )
+    args = parser.parse_args(argv)
+
+    with open(args.capture, encoding="utf-8") as f:
+        config = json.load(f)["config"]
+    pipeline_kwargs = {
+        key: config[key]
+        for key in (
+            "use_context_window",
+            "max_scope",
+            "max_targets",
+            "prune",
+            "remove_overlapping_modifiers",
+            "chunk_size",
+        )
+        if key in config
+    }
+    (_, context) = build_pipeline(rules=args.rules, **pipeline_kwargs)
+    for key in ("partition_rules", "prefilter"):
+        if key in config:
+            setattr(context, key, config[key])
+    (_, stats) = replay(args.capture, context, check_rules=args.check_rules)
+    stats.sort_stats(args.sort).print_stats(args.limit)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,460 @@
+"""A command-line interface for running ConText over a corpus.
+
+Reads documents as JSONL or plain text from files or stdin and writes one JSON line of results per
+document to stdout or a file, in the same order as the input.
+
+Example:
+    $ cycontext notes.jsonl --rules my_rules.json --batch-size 500 --workers 4 > results.jsonl
+
+Each input line in JSONL format is an object with a "text" key and optionally an "id" key and an "ents"
+key containing a list of [start_char, end_char, label] entity offsets. If "ents" is given, these are
+used as the targets instead of the entities found by the spaCy model. In text format, each non-empty
+line is a document.
+"""
+import argparse
+import gc
+import json
+import multiprocessing
+import sys
+import warnings
+from itertools import islice
+from multiprocessing import Pool
+from os import path
+
+import spacy
+
+from .context_component import ConTextComponent
+from .stats import ConTextStats
+
+# The pipeline used by each process. Set by _init_worker, or by prefork_pool before forking.
+_nlp = None
+_context = None
+
+# Processed by warm_pipeline so that state which is built on first use is created before forking
+WARMUP_TEXT = "There is no evidence of pneumonia. History of afib."
+
+
+def build_pipeline(
+    model=None,
+    lang="en",
+    rules=None,
+    allowed_types=None,
+    excluded_types=None,
+    use_context_window=False,
+    max_scope=None,
+    max_targets=None,
+    prune=True,
+    remove_overlapping_modifiers=False,
+    chunk_size=None,
+):
+    """Build a spaCy pipeline and a ConTextComponent.
+
+    Args:
+        model (str or None): The name or path of a spaCy model to load. If None, a blank model
+            for `lang` is created with a Sentencizer to set sentence boundaries, which are used
+            to limit scopes even if use_context_window is True.
+        lang (str): The language code of the blank model. Only used if model is None.
+        rules (str or None): The path to a JSON or YAML file of ConTextItems. If None,
+            the default rules are used.
+        The remaining arguments are passed to ConTextComponent.
+
+    Returns:
+        nlp: a spaCy Language which does not contain ConText
+        context: a ConTextComponent
+    """
+    if model is None:
+        nlp = spacy.blank(lang)
+        nlp.add_pipe(nlp.create_pipe("sentencizer"))
+    else:
+        nlp = spacy.load(model)
+    if rules is None:
+        rule_kwargs = {"rules": "default"}
+    else:
+        rule_kwargs = {"rules": "other", "rule_list": path.abspath(rules)}
+    context = ConTextComponent(
+        nlp,
+        allowed_types=allowed_types,
+        excluded_types=excluded_types,
+        use_context_window=use_context_window,
+        max_scope=max_scope,
+        max_targets=max_targets,
+        prune=prune,
+        remove_overlapping_modifiers=remove_overlapping_modifiers,
+        chunk_size=chunk_size,
+        **rule_kwargs,
+    )
+    return nlp, context
+
+
+def warm_pipeline(nlp, context, text=WARMUP_TEXT):
+    """Process a document so that the state which spaCy and ConText build on first use,
+    such as new lexemes and rule tables, already exists. The component is then frozen,
+    since workers only read it.
+    """
+    doc = nlp(text)
+    context(doc)
+    context.freeze()
+
+
+def read_records(lines, input_format="jsonl"):
+    """Parse lines of input into record dicts with the keys "id", "text" and "ents".
+
+    Args:
+        lines: An iterable of strings.
+        input_format (str): Either "jsonl" or "text".
+    """
+    i = 0
+    for line in lines:
+        line = line.rstrip("\n")
+        if not line.strip():
+            continue
+        if input_format == "jsonl":
+            data = json.loads(line)
+            record = {
+                "id": data.get("id", i),
+                "text": data["text"],
+                "ents": data.get("ents"),
+            }
+        elif input_format == "text":
+            record = {"id": i, "text": line, "ents": None}
+        else:
+            raise ValueError(
+                "input_format must be either 'jsonl' or 'text', not {0}".format(
+                    input_format
+                )
+            )
+        i += 1
+        yield record
+
+
+def set_ents(doc, ents):
+    """Set doc.ents from a list of (start_char, end_char, label) offsets.
+    Offsets which do not align with token boundaries are skipped with a warning.
+    """
+    spans = []
+    for (start_char, end_char, label) in ents:
+        span = doc.char_span(start_char, end_char, label=label)
+        if span is None:
+            warnings.warn(
+                "Entity offsets ({0}, {1}) do not align with token boundaries and will be skipped.".format(
+                    start_char, end_char
+                ),
+                RuntimeWarning,
+            )
+            continue
+        spans.append(span)
+    doc.ents = spans
+
+
+def doc_to_dict(doc, doc_id, context):
+    """Convert a processed Doc into a JSON-serializable dict of results.
+
+    Args:
+        doc: A spaCy Doc which has been processed by context.
+        doc_id: The id of the document.
+        context: The ConTextComponent which processed the doc.
+    """
+    attr_names = []
+    if context.add_attrs:
+        for attr_dict in context.context_attributes_mapping.values():
+            for attr_name in attr_dict:
+                if attr_name not in attr_names:
+                    attr_names.append(attr_name)
+    ents = []
+    for ent in doc.ents:
+        ent_data = {
+            "start": ent.start_char,
+            "end": ent.end_char,
+            "label": ent.label_,
+            "text": ent.text,
+            "modifiers": [
+                {
+                    "start": modifier.span.start_char,
+                    "end": modifier.span.end_char,
+                    "text": modifier.span.text,
+                    "category": modifier.category,
+                    "rule": modifier.rule,
+                    "scope_start": modifier.scope.start_char,
+                    "scope_end": modifier.scope.end_char,
+                }
+                for modifier in ent._.modifiers
+            ],
+        }
+        for attr_name in attr_names:
+            ent_data[attr_name] = getattr(ent._, attr_name)
+        ents.append(ent_data)
+    return {"id": doc_id, "ents": ents}
+
+
+def process_batch(records, nlp, context, stats=None):
+    """Process a list of records and return a list of result dicts in the same order.
+    If stats is a ConTextStats, it is updated with each processed Doc.
+    """
+    docs = [nlp.make_doc(record["text"]) for record in records]
+    for _, proc in nlp.pipeline:
+        if hasattr(proc, "pipe"):
+            docs = list(proc.pipe(docs, batch_size=len(docs)))
+        else:
+            docs = [proc(doc) for doc in docs]
+    results = []
+    for record, doc in zip(records, docs):
+        if record["ents"] is not None:
+            set_ents(doc, record["ents"])
+        context(doc)
+        if stats is not None:
+            stats.update(doc)
+        results.append(doc_to_dict(doc, record["id"], context))
+    return results
+
+
+def _init_worker(pipeline_kwargs):
+    global _nlp, _context
+    _nlp, _context = build_pipeline(**pipeline_kwargs)
+
+
+def _init_forked_worker():
+    gc.enable()
+
+
+def prefork_pool(workers, pipeline_kwargs):
+    """Build and warm the pipeline once in this process, then fork a pool of workers
+    which share it copy-on-write instead of each building their own.
+
+    The garbage collector is disabled while the pipeline is built and its objects are moved
+    to the permanent generation with gc.freeze() before forking, so that collections in the workers
+    don't write to the pages they share with the parent.
+
+    Args:
+        workers (int): The number of worker processes.
+        pipeline_kwargs (dict): Keyword arguments for `build_pipeline`.
+
+    Returns:
+        pool: a multiprocessing Pool
+
+    Raises:
+        ValueError: if the platform does not support forking processes.
+    """
+    global _nlp, _context
+    if "fork" not in multiprocessing.get_all_start_methods():
+        raise ValueError("A prefork pool requires the 'fork' start method.")
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        _nlp, _context = build_pipeline(**pipeline_kwargs)
+        warm_pipeline(_nlp, _context)
+        gc.freeze()
+        pool = multiprocessing.get_context("fork").Pool(
+            workers, initializer=_init_forked_worker
+        )
+    finally:
+        gc.unfreeze()
+        if gc_enabled:
+            gc.enable()
+    return pool
+
+
+def _process_batch_in_worker(records):
+    return process_batch(records, _nlp, _context)
+
+
+def _process_batch_with_stats_in_worker(args):
+    records, max_scope_length, max_edges = args
+    stats = ConTextStats(max_scope_length=max_scope_length, max_edges=max_edges)
+    results = process_batch(records, _nlp, _context, stats)
+    return results, stats.snapshot()
+
+
+def _batches(records, batch_size):
+    records = iter(records)
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def run(
+    records, pipeline_kwargs, batch_size=1000, workers=1, stats=None, prefork=False
+):
+    """Process records in batches, optionally across worker processes,
+    and yield result dicts in the same order as the input.
+
+    Args:
+        records: An iterable of record dicts, such as from `read_records`.
+        pipeline_kwargs (dict): Keyword arguments for `build_pipeline`.
+        batch_size (int): The number of documents in each batch.
+        workers (int): The number of worker processes. If 1, documents are processed
+            in the current process.
+        stats (ConTextStats or None): An optional ConTextStats which is updated with every document.
+            Each worker process collects its own statistics, which are merged into stats.
+        prefork (bool): If True, the pipeline is built once and shared by forked workers with
+            `prefork_pool`, instead of being built by each worker. Default False.
+    """
+    if batch_size < 1:
+        raise ValueError(
+            "batch_size must be an integer greater than 0, not {0}".format(batch_size)
+        )
+    if workers < 1:
+        raise ValueError(
+            "workers must be an integer greater than 0, not {0}".format(workers)
+        )
+    if workers == 1:
+        nlp, context = build_pipeline(**pipeline_kwargs)
+        for batch in _batches(records, batch_size):
+            yield from process_batch(batch, nlp, context, stats)
+        return
+
+    if prefork:
+        pool = prefork_pool(workers, pipeline_kwargs)
+    else:
+        pool = Pool(workers, initializer=_init_worker, initargs=(pipeline_kwargs,))
+    with pool:
+        # imap returns results in the order of the input batches
+        if stats is None:
+            for results in pool.imap(
+                _process_batch_in_worker, _batches(records, batch_size)
+            ):
+                yield from results
+            return
+        tasks = (
+            (batch, stats.max_scope_length, stats.max_edges)
+            for batch in _batches(records, batch_size)
+        )
+        for (results, snapshot) in pool.imap(_process_batch_with_stats_in_worker, tasks):
+            stats.merge(snapshot)
+            yield from results
+
+
+def _label_set(value):
+    return {label.strip() for label in value.split(",") if label.strip()}
+
+
+def _open_inputs(filepaths):
+    if not filepaths or filepaths == ["-"]:
+        yield from sys.stdin
+        return
+    for filepath in filepaths:
+        if filepath == "-":
+            yield from sys.stdin
+            continue
+        with open(filepath, encoding="utf-8") as f:
+            yield from f
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog="cycontext",
+        description="Run ConText over documents in JSONL or plain text and write JSONL results.",
+    )
+    parser.add_argument(
+        "inputs",
+        nargs="*",
+        help="Input files. Reads from stdin if none are given or if the file is '-'.",
+    )
+    parser.add_argument(
+        "-o", "--output", default=None, help="Output file. Default is stdout."
+    )
+    parser.add_argument(
+        "--format",
+        choices=("jsonl", "text"),
+        default="jsonl",
+        help="Input format. 'jsonl' lines contain 'text' and optional 'id' and 'ents' keys, "
+        "'text' treats each line as a document. Default 'jsonl'.",
+    )
+    parser.add_argument(
+        "--model",
+        default=None,
+        help="A spaCy model to load. If not given, a blank model with a Sentencizer is used.",
+    )
+    parser.add_argument(
+        "--lang", default="en", help="Language of the blank model. Default 'en'."
+    )
+    parser.add_argument(
+        "--rules",
+        default=None,
+        help="Path to a JSON or YAML rule file. If not given, the default rules are used.",
+    )
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--prefork",
+        action="store_true",
+        help="Build the pipeline once and fork the workers from it, instead of building it in each worker.",
+    )
+    parser.add_argument(
+        "--allowed-types",
+        type=_label_set,
+        default=None,
+        help="Comma-separated target labels which modifiers can modify.",
+    )
+    parser.add_argument(
+        "--excluded-types",
+        type=_label_set,
+        default=None,
+        help="Comma-separated target labels which modifiers cannot modify.",
+    )
+    parser.add_argument("--use-context-window", action="store_true")
+    parser.add_argument("--max-scope", type=int, default=None)
+    parser.add_argument("--max-targets", type=int, default=None)
+    parser.add_argument(
+        "--no-prune",
+        dest="prune",
+        action="store_false",
+        help="Do not prune modifiers which are substrings of another modifier.",
+    )
+    parser.add_argument("--remove-overlapping-modifiers", action="store_true")
+    parser.add_argument(
+        "--stats",
+        default=None,
+        help="Write corpus-level statistics of the results as JSON to this file.",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=None,
+        help="Process documents longer than this number of tokens in chunks.",
+    )
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    pipeline_kwargs = {
+        "model": args.model,
+        "lang": args.lang,
+        "rules": args.rules,
+        "allowed_types": args.allowed_types,
+        "excluded_types": args.excluded_types,
+        "use_context_window": args.use_context_window,
+        "max_scope": args.max_scope,
+        "max_targets": args.max_targets,
+        "prune": args.prune,
+        "remove_overlapping_modifiers": args.remove_overlapping_modifiers,
+        "chunk_size": args.chunk_size,
+    }
+    records = read_records(_open_inputs(args.inputs), args.format)
+    stats = ConTextStats() if args.stats is not None else None
+    if args.output is None:
+        out = sys.stdout
+    else:
+        out = open(args.output, "w", encoding="utf-8")
+    try:
+        for result in run(
+            records,
+            pipeline_kwargs,
+            batch_size=args.batch_size,
+            workers=args.workers,
+            stats=stats,
+            prefork=args.prefork,
+        ):
+            out.write(json.dumps(result) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    if stats is not None:
+        with open(args.stats, "w", encoding="utf-8") as f:
+            json.dump(stats.snapshot(), f)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""A memory-light representation of a ConTextGraph which stores token offsets
+instead of live TagObjects.
+"""
+from spacy.tokens import Span
+
+from .context_graph import ConTextGraph
+from .context_item import ConTextItem
+from .tag_object import TagObject
+
+
+class CompactConTextGraph:
+    """Stores the results of ConText for a Doc as plain tuples of integers.
+
+    Only modifiers which produced at least one edge are kept. Each modifier is recorded as a tuple of
+    (start, end, category_id, rule_index, scope_start, scope_end), where category_id is an index into
+    self.categories and rule_index is an index into self.rules. Targets are recorded as
+    (start, end, label) tuples and edges as (target_index, modifier_index) tuples.
+
+    The full ConTextGraph and TagObjects can be rebuilt on demand with `to_graph` and `get_modifiers`.
+    """
+
+    __slots__ = (
+        "rules",
+        "categories",
+        "targets",
+        "modifiers",
+        "edges",
+        "use_context_window",
+        "remove_overlapping_modifiers",
+    )
+
+    def __init__(
+        self,
+        rules,
+        categories,
+        targets,
+        modifiers,
+        edges,
+        use_context_window=False,
+        remove_overlapping_modifiers=False,
+    ):
+        """Create a new CompactConTextGraph.
+
+        Args:
+            rules: A sequence of ConTextItems. This is shared between all Docs processed by the same
+                component and is not copied.
+            categories: A sequence of category strings indexed by category_id.
+            targets: A tuple of (start, end, label) tuples.
+            modifiers: A tuple of (start, end, category_id, rule_index, scope_start, scope_end) tuples.
+            edges: A tuple of (target_index, modifier_index) tuples.
+            use_context_window (bool): Whether the modifiers were created with `use_context_window`.
+            remove_overlapping_modifiers (bool): The value of `remove_overlapping_modifiers`
+                in the original graph.
+        """
+        self.rules = rules
+        self.categories = categories
+        self.targets = targets
+        self.modifiers = modifiers
+        self.edges = edges
+        self.use_context_window = use_context_window
+        self.remove_overlapping_modifiers = remove_overlapping_modifiers
+
+    @classmethod
+    def from_graph(
+        cls,
+        graph,
+        rules,
+        rule_indices,
+        categories,
+        category_ids,
+        use_context_window=False,
+    ):
+        """Create a CompactConTextGraph from a processed ConTextGraph.
+
+        Args:
+            graph: A ConTextGraph which has had `apply_modifiers` called.
+            rules: The sequence of ConTextItems which rule_indices refer to.
+            rule_indices: A dict mapping the id() of each ConTextItem to its index in rules.
+            categories: The sequence of categories which category_ids refer to.
+            category_ids: A dict mapping each category to its index in categories.
+            use_context_window (bool): Whether the modifiers were created with `use_context_window`.
+
+        Returns:
+            compact_graph: a CompactConTextGraph
+        """
+        target_indices = {}
+        targets = []
+        for i, target in enumerate(graph.targets):
+            target_indices[(target.start, target.end)] = i
+            targets.append((target.start, target.end, target.label_))
+
+        modifier_indices = {}
+        modifiers = []
+        edges = []
+        for (target, modifier) in graph.edges:
+            modifier_idx = modifier_indices.get(id(modifier))
+            if modifier_idx is None:
+                modifier_idx = len(modifiers)
+                modifier_indices[id(modifier)] = modifier_idx
+                modifiers.append(
+                    (
+                        modifier.start,
+                        modifier.end,
+                        category_ids[modifier.category],
+                        rule_indices[id(modifier.context_item)],
+                        modifier._scope_start,
+                        modifier._scope_end,
+                    )
+                )
+            edges.append((target_indices[(target.start, target.end)], modifier_idx))
+
+        return cls(
+            rules,
+            categories,
+            tuple(targets),
+            tuple(modifiers),
+            tuple(edges),
+            use_context_window=use_context_window,
+            remove_overlapping_modifiers=graph.remove_overlapping_modifiers,
+        )
+
+    def _build_target(self, doc, target_idx):
+        start, end, label = self.targets[target_idx]
+        return Span(doc, start, end, label=label)
+
+    def _build_modifier(self, doc, modifier_idx):
+        start, end, _, rule_idx, scope_start, scope_end = self.modifiers[modifier_idx]
+        return TagObject(
+            self.rules[rule_idx],
+            start,
+            end,
+            doc,
+            self.use_context_window,
+            scope=(scope_start, scope_end),
+        )
+
+    def to_graph(self, doc):
+        """Rebuild the full ConTextGraph with live Spans and TagObjects.
+
+        Args:
+            doc: The spaCy Doc which this graph was created from.
+
+        Returns:
+            context_graph: a ConTextGraph
+        """
+        graph = ConTextGraph(
+            remove_overlapping_modifiers=self.remove_overlapping_modifiers
+        )
+        graph.targets = [self._build_target(doc, i) for i in range(len(self.targets))]
+        graph.modifiers = [
+            self._build_modifier(doc, i) for i in range(len(self.modifiers))
+        ]
+        edges = []
+        for (target_idx, modifier_idx) in self.edges:
+            target = graph.targets[target_idx]
+            modifier = graph.modifiers[modifier_idx]
+            modifier.modify(target)
+            edges.append((target, modifier))
+        graph.edges = edges
+        return graph
+
+    def get_modifiers(self, doc, target):
+        """Rebuild the TagObjects which modify a single target.
+
+        Args:
+            doc: The spaCy Doc which this graph was created from.
+            target: A spaCy Span.
+
+        Returns:
+            modifiers: a tuple of TagObjects
+        """
+        modifiers = []
+        for (target_idx, modifier_idx) in self.edges:
+            start, end, _ = self.targets[target_idx]
+            if start == target.start and end == target.end:
+                modifier = self._build_modifier(doc, modifier_idx)
+                modifier.modify(target)
+                modifiers.append(modifier)
+        return tuple(modifiers)
+
+    def to_dict(self):
+        """Convert to a dictionary containing only lists, strings, integers, booleans and None,
+        which can be stored in Doc.user_data and serialized with msgpack, ie. by `Doc.to_bytes`
+        or a `DocBin` with store_user_data=True.
+
+        Only the ConTextItems which are referenced by a modifier are included,
+        and rule indices are renumbered accordingly.
+
+        Returns:
+            data: a dict
+        """
+        rule_indices = {}
+        rules = []
+        modifiers = []
+        for (start, end, category_id, rule_idx, scope_start, scope_end) in self.modifiers:
+            if rule_idx not in rule_indices:
+                rule_indices[rule_idx] = len(rules)
+                rules.append(_item_to_dict(self.rules[rule_idx]))
+            modifiers.append(
+                [
+                    start,
+                    end,
+                    category_id,
+                    rule_indices[rule_idx],
+                    scope_start,
+                    scope_end,
+                ]
+            )
+        return {
+            "rules": rules,
+            "categories": list(self.categories),
+            "targets": [list(target) for target in self.targets],
+            "modifiers": modifiers,
+            "edges": [list(edge) for edge in self.edges],
+            "use_context_window": self.use_context_window,
+            "remove_overlapping_modifiers": self.remove_overlapping_modifiers,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create a CompactConTextGraph from the output of `to_dict`.
+
+        Args:
+            data: a dict created by `to_dict`. Lists may have been converted to tuples by msgpack.
+
+        Returns:
+            compact_graph: a CompactConTextGraph
+        """
+        rules = tuple(ConTextItem.from_dict(dict(item)) for item in data["rules"])
+        return cls(
+            rules,
+            tuple(data["categories"]),
+            tuple(tuple(target) for target in data["targets"]),
+            tuple(tuple(modifier) for modifier in data["modifiers"]),
+            tuple(tuple(edge) for edge in data["edges"]),
+            use_context_window=data["use_context_window"],
+            remove_overlapping_modifiers=data["remove_overlapping_modifiers"],
+        )
+
+    def __repr__(self):
+        return "<CompactConTextGraph> with {0} targets and {1} modifiers".format(
+            len(self.targets), len(self.modifiers)
+        )
+
+
+def _item_to_dict(item):
+    """Convert a ConTextItem to a dict which can be serialized with msgpack."""
+    item_dict = item.to_dict()
+    for key in ("allowed_types", "excluded_types"):
+        if item_dict[key] is not None:
+            item_dict[key] = sorted(item_dict[key])
+    item_dict["terminated_by"] = sorted(item.terminated_by)
+    return item_dict
@@ -1,15 +1,28 @@
 """The ConTextComponent definiton."""
+import copy
+import time
+import weakref
+from bisect import bisect_left, bisect_right
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from os import path
 
 # Filepath to default rules which are included in package
 from pathlib import Path
 
-from spacy.matcher import Matcher, PhraseMatcher
+import numpy as np
+from spacy.attrs import SENT_START
 from spacy.tokens import Doc, Span
 
+from .budget import DEADLINE, SKIP_SCOPE_LIMITS_REASONS
+from .capture import CONFIG_KEYS
 from .tag_object import TagObject
 from .context_graph import ConTextGraph
 from .context_item import ConTextItem
+from .compact_graph import CompactConTextGraph
+from .rule_set import ConTextRuleSet
+from .rule_store import MappedRuleSet, write_rule_store
 
 #
 DEFAULT_ATTRS = {
@@ -24,6 +37,205 @@ DEFAULT_RULES_FILEPATH = path.join(
     Path(__file__).resolve().parents[1], "kb", "default_rules.json"
 )
 
+# The keys which spaCy would use to store Doc._.context_graph and Span._.modifiers in Doc.user_data
+CONTEXT_GRAPH_KEY = ("._.", "context_graph", None, None)
+# The key in Doc.user_data which holds Doc._.context_graphs
+CONTEXT_GRAPHS_KEY = ("._.", "context_graphs", None, None)
+
+
+# The key in Doc.user_data which holds the pending work of a Doc processed in lazy mode
+LAZY_KEY = ("._.", "context_lazy", None, None)
+# The key in Doc.user_data which holds the modifiers of a Doc processed with cache_modifiers
+MODIFIER_CACHE_KEY = ("._.", "context_modifier_cache", None, None)
+# The key in Doc.user_data which holds Doc._.context_degraded
+DEGRADED_KEY = ("._.", "context_degraded", None, None)
+
+
+# The CompactConTextGraphs parsed from the dicts stored in serializable mode, so that the ConTextItems
+# are only created once per Doc. This is kept outside of Doc.user_data, which must stay serializable.
+_PARSED_GRAPHS = weakref.WeakKeyDictionary()
+
+
+def _modifiers_key(span):
+    return ("._.", "modifiers", span.start_char, span.end_char)
+
+
+def resolve(doc):
+    """Run the pending ConText processing of a Doc which was processed in lazy mode.
+    Does nothing if there is no pending work.
+
+    Returns:
+        doc: the spaCy Doc
+    """
+    pending = doc.user_data.pop(LAZY_KEY, None)
+    if pending is not None:
+        context, rules, targets = pending
+        context._process(doc, targets, rules)
+    return doc
+
+
+def _from_dict(doc, data):
+    """Returns the CompactConTextGraph of a dict stored on a Doc, parsing it the first time."""
+    parsed = _PARSED_GRAPHS.get(doc)
+    if parsed is None:
+        parsed = _PARSED_GRAPHS.setdefault(doc, {})
+    # The dict is kept with its graph so that its id can't be reused while it is cached
+    entry = parsed.get(id(data))
+    if entry is None or entry[0] is not data:
+        entry = (data, CompactConTextGraph.from_dict(data))
+        parsed[id(data)] = entry
+    return entry[1]
+
+
+def _get_compact_graph(doc):
+    graph = doc.user_data.get(CONTEXT_GRAPH_KEY)
+    if isinstance(graph, dict):
+        return _from_dict(doc, graph)
+    if isinstance(graph, CompactConTextGraph):
+        return graph
+    return None
+
+
+def get_context_graph(doc):
+    """Getter for Doc._.context_graph. If the Doc was processed in lean or serializable mode,
+    the full ConTextGraph is rebuilt from the stored CompactConTextGraph or its dict form.
+    If the Doc was processed in lazy mode, ConText is run first.
+    """
+    resolve(doc)
+    compact_graph = _get_compact_graph(doc)
+    if compact_graph is not None:
+        return compact_graph.to_graph(doc)
+    return doc.user_data.get(CONTEXT_GRAPH_KEY)
+
+
+def set_context_graph(doc, value):
+    """Setter for Doc._.context_graph."""
+    _PARSED_GRAPHS.pop(doc, None)
+    doc.user_data[CONTEXT_GRAPH_KEY] = value
+
+
+def get_context_graphs(doc):
+    """Getter for Doc._.context_graphs, a dict mapping the name of each rule set added with
+    ConTextComponent.add_rule_set to its ConTextGraph, or None if there are no rule sets.
+    Graphs stored in lean or serializable mode are rebuilt, and lazy Docs are processed first.
+    """
+    resolve(doc)
+    graphs = doc.user_data.get(CONTEXT_GRAPHS_KEY)
+    if graphs is None:
+        return None
+    rslt = {}
+    for (name, graph) in graphs.items():
+        if isinstance(graph, dict):
+            graph = _from_dict(doc, graph)
+        if isinstance(graph, CompactConTextGraph):
+            graph = graph.to_graph(doc)
+        rslt[name] = graph
+    return rslt
+
+
+def set_context_graphs(doc, value):
+    """Setter for Doc._.context_graphs."""
+    _PARSED_GRAPHS.pop(doc, None)
+    doc.user_data[CONTEXT_GRAPHS_KEY] = value
+
+
+def get_context_degraded(doc):
+    """Getter for Doc._.context_degraded, a tuple of the limits of the WorkBudget of the component
+    which the Doc exceeded, or an empty tuple if it was processed normally. See cycontext.budget.
+    """
+    resolve(doc)
+    return tuple(doc.user_data.get(DEGRADED_KEY, ()))
+
+
+def set_context_degraded(doc, value):
+    """Setter for Doc._.context_degraded."""
+    doc.user_data[DEGRADED_KEY] = value
+
+
+class _DeadlineExceeded(Exception):
+    """Raised when the deadline of a WorkBudget passes while the scopes of a Doc are being limited."""
+
+
+def get_modifiers(span):
+    """Getter for Span._.modifiers. If the Doc was processed in lean or serializable mode,
+    the TagObjects which modify this span are rebuilt from the stored CompactConTextGraph.
+    If the Doc was processed in lazy mode, ConText is run first.
+    """
+    resolve(span.doc)
+    modifiers = span.doc.user_data.get(_modifiers_key(span))
+    if modifiers is not None:
+        return modifiers
+    compact_graph = _get_compact_graph(span.doc)
+    if compact_graph is not None:
+        return compact_graph.get_modifiers(span.doc, span)
+    return ()
+
+
+def set_modifiers(span, value):
+    """Setter for Span._.modifiers."""
+    span.doc.user_data[_modifiers_key(span)] = value
+
+
+def _make_lazy_attribute(attr_name, default):
+    """Create a getter and setter for an assertion attribute such as Span._.is_negated
+    which run the pending ConText processing of a lazy Doc before the value is read.
+    The value is stored under the same key in Doc.user_data as a spaCy attribute with a default.
+    """
+
+    def getter(span):
+        resolve(span.doc)
+        return span.doc.user_data.get(
+            ("._.", attr_name, span.start_char, span.end_char), default
+        )
+
+    def setter(span, value):
+        span.doc.user_data[("._.", attr_name, span.start_char, span.end_char)] = value
+
+    getter.lazy = True
+    return getter, setter
+
+
+def _read_rule_list(rule_list):
+    """Read a list of ConTextItems from the path of a JSON or YAML file, or check a list of ConTextItems.
+
+    Raises:
+        ValueError: if rule_list is not a valid path or a non-empty list of ConTextItems.
+    """
+    if isinstance(rule_list, str):
+        # if rules_list is a string, then it must be a path to a json
+        if "yaml" in rule_list or "yml" in rule_list:
+            try:
+                return ConTextItem.from_yaml(rule_list)["item_data"]
+            except:
+                raise ValueError("rule list {0} could not be read".format(rule_list))
+        elif path.exists(rule_list):
+            return ConTextItem.from_json(rule_list)
+        else:
+            raise ValueError(
+                "rule_list must be a valid path. Currently is: {0}".format(rule_list)
+            )
+
+    elif isinstance(rule_list, list):
+        # otherwise it is a list of contextitems
+        if not rule_list:
+            raise ValueError("rule_list must not be empty.")
+        for item in rule_list:
+            # check that all items are contextitems
+            if not isinstance(item, ConTextItem):
+                raise ValueError(
+                    "rule_list must contain only ContextItems. Currently contains: {0}".format(
+                        type(item)
+                    )
+                )
+        return rule_list
+
+    else:
+        raise ValueError(
+            "rule_list must be a valid path or list of ContextItems. Currenty is: {0}".format(
+                type(rule_list)
+            )
+        )
+
 
 class ConTextComponent:
     """The ConTextComponent for spaCy processing."""
@@ -46,16 +258,28 @@ class ConTextComponent:
         terminations=None,
         prune=True,
         remove_overlapping_modifiers=False,
+        lean=False,
+        serializable=False,
+        chunk_size=None,
+        stats=None,
+        lazy=False,
+        partition_rules=False,
+        rule_sets=None,
+        prefilter=False,
+        cache_modifiers=False,
+        budget=None,
+        capture=None,
     ):
 
         """Create a new ConTextComponent algorithm.
 
         This component matches modifiers in a Doc,
         defines their scope, and identifies edges between targets and modifiers.
-        Sets two spaCy extensions:
+        Sets these spaCy extensions:
             - Span._.modifiers: a list of TagObject objects which modify a target Span
             - Doc._.context_graph: a ConText graph object which contains the targets,
                 modifiers, and edges between them.
+            - Doc._.context_graphs: a dict of the ConText graph of each named rule set, if any.
 
         Args:
             nlp: a spaCy NLP model
@@ -119,6 +343,61 @@ class ConTextComponent:
                 all modifiers of type "POSITIVE_EXISTENCE" will be terminated by "NEGATED_EXISTENCE" or "UNCERTAIN"
                 modifiers, and all "NEGATED_EXISTENCE" modifiers will be terminated by "FUTURE".
                 This can also be defined for specific ConTextItems in the `terminated_by` attribute.
+            lean (bool): Whether to store results in a memory-light form. If True, Doc._.context_graph is
+                stored as a CompactConTextGraph which only keeps modifiers which produced edges,
+                recorded as token offsets and rule indices, and Span._.modifiers is not stored at all.
+                The full ConTextGraph and TagObjects are rebuilt each time Doc._.context_graph or
+                Span._.modifiers is accessed. Default False.
+            serializable (bool): Whether to store results in a form which can be serialized with msgpack.
+                If True, Doc._.context_graph is stored in Doc.user_data as the dict form of a
+                CompactConTextGraph, which includes the ConTextItems that produced edges, so that
+                `Doc.to_bytes` and `DocBin(store_user_data=True)` keep the ConText results.
+                When the Doc is deserialized, Doc._.context_graph, Span._.modifiers and the assertion
+                attributes are restored from Doc.user_data without running ConText again.
+                Implies the storage behavior of `lean`. Default False.
+            chunk_size (int or None): If not None, Docs longer than this number of tokens are processed
+                in chunks of about chunk_size tokens so that pruning, scope updates and edge detection
+                work on one chunk at a time instead of the whole Doc. Chunks are split at sentence
+                boundaries, or at any token when use_context_window is True, in which case each chunk is
+                extended by a margin of the largest possible scope. Chunks are never split inside a
+                modifier or target, and the edges are identical to processing the whole Doc at once.
+                Default None.
+            stats (ConTextStats or None): An optional cycontext.stats.ConTextStats which is updated
+                with the results of each Doc. Default None.
+            lazy (bool): Whether to defer processing until the results are first needed. If True,
+                `__call__` only records the targets and the current rules, and matching, scoping and
+                edge building run the first time Doc._.context_graph, Span._.modifiers or one of the
+                assertion attributes is read, or when `cycontext.context_component.resolve(doc)` is called.
+                The results are then cached on the Doc. Pending Docs can't be serialized until they have been
+                resolved, and `stats` is only updated when a Doc is resolved. Default False.
+            partition_rules (bool): Whether to only run the rules which can affect the labels of a Doc's targets.
+                Rules are grouped by their allowed_types and excluded_types, and a group is skipped if it can't
+                modify any of the labels and can't terminate or overlap a group which can. Docs without targets
+                skip matching entirely and are given an empty ConTextGraph. The edges are identical, but
+                Doc._.context_graph.modifiers only contains the modifiers of the rules which were run.
+                Default False.
+            rule_sets (dict or None): An optional mapping from names to additional rule sets, where each rule set
+                is the path of a JSON or YAML rule file or a list of ConTextItems, like rule_list. The rules of
+                all rule sets are matched in the same pass as the main rules, and a separate ConTextGraph is built
+                for each rule set in Doc._.context_graphs[name]. Only the main rules set Span._.modifiers and the
+                assertion attributes. Rule sets can also be added with `add_rule_set`. Default None.
+            prefilter (bool): Whether to check each Doc for the tokens which can start or anchor a rule before
+                matching. Docs without any of these triggers skip matching and get an empty ConTextGraph,
+                and token patterns are only run over the windows around the triggers.
+                See cycontext.rule_set.TriggerFilter. The results are identical. Default False.
+            cache_modifiers (bool): Whether to cache the modifiers of each Doc after pruning and scope limiting,
+                which don't depend on the targets. If a Doc is processed again, for example after its entities
+                have changed, only the edges and attributes are recomputed. The cache is only used if the
+                rules haven't changed and, with partition_rules, if the new target labels were all present before.
+                Can't be used with serializable. Default False.
+            budget (WorkBudget or None): Optional per-Doc limits on the number of tokens, modifiers and tokens
+                per sentence, and on the time spent. A Doc which exceeds one is processed in a cheaper mode,
+                and the limits it exceeded are stored in Doc._.context_degraded. See cycontext.budget.
+                Default None.
+            capture (SlowDocCapture or None): Optional capture of the Docs which take longer than a threshold.
+                The tokens, sentence boundaries and targets of a slow Doc are written to a spool directory
+                with a fingerprint of the rules and the time spent matching, building the graph and storing
+                the results, so that it can be replayed under a profiler. See cycontext.capture. Default None.
 
 
         Returns:
@@ -134,19 +413,15 @@ class ConTextComponent:
         self._target_attr = targets
         self.prune = prune
         self.remove_overlapping_modifiers = remove_overlapping_modifiers
+        self.lean = lean
+        self.serializable = serializable
 
-        self._item_data = []
-        self._i = 0
-        self._categories = set()
+        self.phrase_matcher_attr = phrase_matcher_attr
+        self._frozen = False
 
-        # _modifier_item_mapping: A mapping from spaCy Matcher match_ids to ConTextItem
-        # This allows us to use spaCy Matchers while still linking back to the ConTextItem
-        # To get the rule and category
-        self._modifier_item_mapping = dict()
-        self.phrase_matcher = PhraseMatcher(
-            nlp.vocab, attr=phrase_matcher_attr, validate=True
-        )  # TODO: match on custom attributes
-        self.matcher = Matcher(nlp.vocab, validate=True)
+        # _rules: The current version of the compiled rules. This is read once per Doc
+        # so that it can be atomically replaced with swap_rules.
+        self._rules = ConTextRuleSet(nlp, phrase_matcher_attr)
 
         self.register_graph_attributes()
         if add_attrs is False:
@@ -176,6 +451,8 @@ class ConTextComponent:
                     add_attrs
                 )
             )
+        if lazy and self.add_attrs:
+            self.register_lazy_attributes()
         if use_context_window is True:
             if not isinstance(max_scope, int) or max_scope < 1:
                 raise ValueError(
@@ -191,6 +468,28 @@ class ConTextComponent:
                 "not {0}".format(max_scope)
             )
         self.max_scope = max_scope
+        if chunk_size is not None and (
+            not isinstance(chunk_size, int) or chunk_size < 1
+        ):
+            raise ValueError(
+                "'chunk_size' must be None or an integer greater than 0, "
+                "not {0}".format(chunk_size)
+            )
+        self.chunk_size = chunk_size
+        self.stats = stats
+        self.lazy = lazy
+        self.partition_rules = partition_rules
+        self.prefilter = prefilter
+        if cache_modifiers and serializable:
+            raise ValueError("'cache_modifiers' can't be used with 'serializable'.")
+        self.cache_modifiers = cache_modifiers
+        self.budget = budget
+        self.capture = capture
+        # Settings which are changed on a copy of the component to process a Doc which exceeds the budget
+        self._max_scope_limit = None
+        self._limit_scopes = True
+        self._index_targets = False
+        self._deadline = None
 
         self.allowed_types = allowed_types
         self.excluded_types = excluded_types
@@ -207,50 +506,12 @@ class ConTextComponent:
 
         elif rules == "other":
             # use custom rules
-            if isinstance(rule_list, str):
-                # if rules_list is a string, then it must be a path to a json
-                if "yaml" in rule_list or "yml" in rule_list:
-                    try:
-                        rule_list = ConTextItem.from_yaml(rule_list)
-                    except:
-                        raise ValueError(
-                            "rule list {0} could not be read".format(rule_list)
-                        )
-                elif path.exists(rule_list):
-                    item_data = ConTextItem.from_json(rule_list)
-                    self.add(item_data)
-                else:
-                    raise ValueError(
-                        "rule_list must be a valid path. Currently is: {0}".format(
-                            rule_list
-                        )
-                    )
-
-            elif isinstance(rule_list, list):
-                # otherwise it is a list of contextitems
-                if not rule_list:
-                    raise ValueError("rule_list must not be empty.")
-                for item in rule_list:
-                    # check that all items are contextitems
-                    if not isinstance(item, ConTextItem):
-                        raise ValueError(
-                            "rule_list must contain only ContextItems. Currently contains: {0}".format(
-                                type(item)
-                            )
-                        )
-                self.add(rule_list)
-
-            else:
-                raise ValueError(
-                    "rule_list must be a valid path or list of ContextItems. Currenty is: {0}".format(
-                        type(rule_list)
-                    )
-                )
+            self.add(_read_rule_list(rule_list))
 
         elif not rules:
             # otherwise leave the list empty.
             # do nothing
-            self._item_data = []
+            pass
 
         else:
             # loading from json path or list is possible later
@@ -258,15 +519,61 @@ class ConTextComponent:
                 "rules must either be 'default' (default), 'other' or None."
             )
 
+        if rule_sets is not None:
+            for (name, rule_list) in rule_sets.items():
+                self.add_rule_set(name, _read_rule_list(rule_list))
+
     @property
     def item_data(self):
         """Returns list of ConTextItems"""
-        return self._item_data
+        return self._rules.item_data
+
+    @property
+    def rule_ids(self):
+        """Returns the list of stable rule ids, aligned with item_data"""
+        return self._rules.rule_ids
 
     @property
     def categories(self):
         """Returns list of categories from ConTextItems"""
-        return self._categories
+        return self._rules.categories
+
+    @property
+    def rule_sets(self):
+        """Returns the names of the rule sets added with `add_rule_set`"""
+        return list(self._rules.rule_set_list)
+
+    @property
+    def rules_version(self):
+        """Returns the version number of the current rules, which is incremented by swap_rules"""
+        return self._rules.version
+
+    @property
+    def phrase_matcher(self):
+        """Returns the spaCy PhraseMatcher of the current rules"""
+        return self._rules.phrase_matcher
+
+    @property
+    def matcher(self):
+        """Returns the spaCy Matcher of the current rules"""
+        return self._rules.matcher
+
+    @property
+    def frozen(self):
+        """Returns True if the rule set has been frozen."""
+        return self._frozen
+
+    def freeze(self):
+        """Make the compiled rule set immutable.
+
+        After freezing, `add` raises a RuntimeError, each ConTextItem is frozen and the internal
+        rule tables are replaced with read-only versions. Since processing a Doc only reads this state,
+        a frozen component can be shared by many threads at once, ie. with `pipe(docs, n_threads=4)`.
+        """
+        if self._frozen:
+            return
+        self._rules.freeze()
+        self._frozen = True
 
     def add(self, item_data):
         """Add a list of ConTextItem items to ConText.
@@ -274,59 +581,213 @@ class ConTextComponent:
         Args:
             item_data: a list of ConTextItems to add.
 
+        Returns:
+            rule_ids: a list of the stable rule ids assigned to the ConTextItems,
+                which can be passed to `remove` and `replace`.
+
         Raises:
             TypeError: if item_data contains an object that is not a ConTextItem.
+            RuntimeError: if the component has been frozen.
         """
+        if self._frozen:
+            raise RuntimeError(
+                "Cannot add ConTextItems because this ConTextComponent has been frozen."
+            )
         try:
-            self._item_data += item_data
+            item_data = list(item_data)
         except TypeError:
             raise TypeError(
                 "item_data must be a list of ConText items. If you're just passing in a single ConText Item, "
                 "make sure to wrap the item in a list: `context.add([item])`"
             )
+        item_data = [self._set_item_defaults(item) for item in item_data]
+        return self._rules.add(item_data)
 
-        for item in item_data:
-
-            # UID is the hash which we'll use to retrieve the ConTextItem from a spaCy match
-            # And will be a key in self._modifier_item_mapping
-            uid = self.nlp.vocab.strings[str(self._i)]
-            # If no pattern is defined,
-            # match on the literal phrase.
-            if item.pattern is None:
-                self.phrase_matcher.add(
-                    str(self._i),
-                    [self.nlp.make_doc(item.literal)],
-                    on_match=item.on_match,
+    def add_rule_set(self, name, item_data):
+        """Add a named rule set. Its rules are matched in the same pass as the main rules,
+        and the targets and edges which they find are stored in a separate ConTextGraph
+        in Doc._.context_graphs[name]. Adding to an existing name extends that rule set.
+
+        Args:
+            name (str): The name of the rule set.
+            item_data: a list of ConTextItems.
+
+        Returns:
+            rule_ids: a list of the stable rule ids assigned to the ConTextItems.
+
+        Raises:
+            ValueError: if name is not a non-empty string.
+            RuntimeError: if the component has been frozen.
+        """
+        if not isinstance(name, str) or not name:
+            raise ValueError(
+                "The name of a rule set must be a non-empty string, not {0}".format(
+                    name
                 )
-            else:
+            )
+        if self._frozen:
+            raise RuntimeError(
+                "Cannot add a rule set because this ConTextComponent has been frozen."
+            )
+        item_data = [self._set_item_defaults(item) for item in item_data]
+        return self._rules.add(item_data, rule_set=name)
+
+    def remove(self, rule_id):
+        """Remove a ConTextItem by its rule id. Only the matcher entry of this rule is updated.
+
+        Args:
+            rule_id (int): The rule id returned by `add` or found in `rule_ids`.
+
+        Returns:
+            item: the removed ConTextItem
+
+        Raises:
+            KeyError: if there is no rule with this id.
+            RuntimeError: if the component has been frozen.
+        """
+        if self._frozen:
+            raise RuntimeError(
+                "Cannot remove ConTextItems because this ConTextComponent has been frozen. "
+                "Use swap_rules to replace the rules of a frozen component."
+            )
+        return self._rules.remove(rule_id)
+
+    def replace(self, rule_id, item):
+        """Replace a ConTextItem by a new ConTextItem which keeps the same rule id.
+        Only the matcher entry of this rule is updated.
+
+        Args:
+            rule_id (int): The rule id returned by `add` or found in `rule_ids`.
+            item: the new ConTextItem
+
+        Returns:
+            old_item: the replaced ConTextItem
+
+        Raises:
+            KeyError: if there is no rule with this id.
+            RuntimeError: if the component has been frozen.
+        """
+        if self._frozen:
+            raise RuntimeError(
+                "Cannot replace ConTextItems because this ConTextComponent has been frozen. "
+                "Use swap_rules to replace the rules of a frozen component."
+            )
+        item = self._set_item_defaults(item)
+        return self._rules.replace(rule_id, item)
 
-                self.matcher.add(
-                    str(self._i), [item.pattern], on_match=item.on_match
+    def swap_rules(self, item_data):
+        """Compile a new version of the rules and atomically swap it into the component.
+
+        The new matchers are built without touching the current rules, so Docs can keep being processed
+        while this runs. Each Doc is processed entirely by either the old or the new version.
+        If the component is frozen, the new version is frozen before it is swapped in.
+        The rule sets added with `add_rule_set` are kept.
+
+        Args:
+            item_data: a list of ConTextItems which will replace all of the current rules.
+
+        Returns:
+            version (int): the version number of the new rules.
+        """
+        rules = ConTextRuleSet(
+            self.nlp, self.phrase_matcher_attr, version=self._rules.version + 1
+        )
+        item_data = [self._set_item_defaults(item) for item in item_data]
+        rules.add(item_data)
+        current = self._rules
+        for name in current.rule_set_list:
+            rules.add(
+                [
+                    item
+                    for (item, item_name) in zip(
+                        current.item_data, current.rule_set_names
+                    )
+                    if item_name == name
+                ],
+                rule_set=name,
+            )
+        if self._frozen:
+            rules.freeze()
+        self._rules = rules
+        return rules.version
+
+    def export_rules(self, filepath):
+        """Write the current rules to a read-only rule store file which can be mapped
+        by many worker processes with `load_rule_store`. See cycontext.rule_store.
+
+        Args:
+            filepath (str): the path of the file to write
+
+        Raises:
+            ValueError: if one of the ConTextItems has an on_match or on_modifies callback.
+        """
+        write_rule_store(self._rules, filepath)
+
+    def load_rule_store(self, filepath):
+        """Replace the rules of the component with a memory-mapped rule store written by `export_rules`.
+        The rules in a rule store can't be changed, so the component is frozen.
+        A rule store always runs all of its rules, so partition_rules and prefilter have no effect,
+        and a RuntimeWarning is issued if either is set.
+
+        Args:
+            filepath (str): the path of the rule store file
+
+        Returns:
+            version (int): the version number of the rules in the file.
+        """
+        rules = MappedRuleSet(self.nlp, filepath)
+        if self.partition_rules or self.prefilter:
+            rules.warn_unsupported()
+        self._rules = rules
+        self._frozen = True
+        return rules.version
+
+    def analyze_rules(self):
+        """Find rules which match the same text or which can match inside another rule.
+
+        Returns:
+            analysis: a cycontext.analysis.RuleAnalysis. `analysis.overlaps` lists the duplicate,
+                conflicting, subsumed and PSEUDO-shadowed rules by their index in item_data,
+                and `analysis.format_report()` returns a readable report.
+        """
+        return self._rules.analyze()
+
+    def _set_item_defaults(self, item):
+        """Apply the global attributes and terminations of the component to a ConTextItem.
+        A frozen ConTextItem, such as one taken from the item_data of a frozen component, is copied first.
+
+        Returns:
+            item: the ConTextItem, or its unfrozen copy
+        """
+        if not isinstance(item, ConTextItem):
+            raise TypeError(
+                "item_data must contain only ConTextItems. Currently contains: {0}".format(
+                    type(item)
                 )
-            self._modifier_item_mapping[uid] = item
-            self._i += 1
-            self._categories.add(item.category)
-
-            # If global attributes like allowed_types and max_scope are defined,
-            # check if the ConTextItem has them defined. If not, set to the global
-            for attr in (
-                "allowed_types",
-                "excluded_types",
-                "max_scope",
-                "max_targets",
-            ):
-                value = getattr(self, attr)
-                if value is None:  # No global value set
-                    continue
-                if (
-                    getattr(item, attr) is None
-                ):  # If the item itself has it defined, don't override
-                    setattr(item, attr, value)
+            )
+        if item.frozen:
+            item = item.copy()
+        # If global attributes like allowed_types and max_scope are defined,
+        # check if the ConTextItem has them defined. If not, set to the global
+        for attr in (
+            "allowed_types",
+            "excluded_types",
+            "max_scope",
+            "max_targets",
+        ):
+            value = getattr(self, attr)
+            if value is None:  # No global value set
+                continue
+            if (
+                getattr(item, attr) is None
+            ):  # If the item itself has it defined, don't override
+                setattr(item, attr, value)
 
-            # Check custom termination points
-            if item.category.upper() in self.terminations:
-                for other_modifier in self.terminations[item.category.upper()]:
-                    item.terminated_by.add(other_modifier.upper())
+        # Check custom termination points
+        if item.category.upper() in self.terminations:
+            for other_modifier in self.terminations[item.category.upper()]:
+                item.terminated_by.add(other_modifier.upper())
+        return item
 
     def register_default_attributes(self):
         """Register the default values for the Span attributes defined in DEFAULT_ATTRS."""
@@ -342,10 +803,25 @@ class ConTextComponent:
             except ValueError:  # Extension already set
                 pass
 
+    def register_lazy_attributes(self):
+        """Replace the assertion attributes in context_attributes_mapping which were registered
+        with a default value by getters and setters which resolve lazy Docs before they are read.
+        Attributes which were registered with a getter or method are left unchanged.
+        """
+        for attr_dict in self.context_attributes_mapping.values():
+            for attr_name in attr_dict:
+                default, method, getter, setter = Span.get_extension(attr_name)
+                if getter is not None and getattr(getter, "lazy", False):
+                    continue
+                if method is not None or getter is not None or setter is not None:
+                    continue
+                getter, setter = _make_lazy_attribute(attr_name, default)
+                Span.set_extension(attr_name, getter=getter, setter=setter, force=True)
+
     def register_graph_attributes(self):
         """Register spaCy container custom attribute extensions.
 
-        By default will register Span._.modifiers and Doc._.context_graph.
+        By default will register Span._.modifiers, Doc._.context_graph and Doc._.context_graphs.
 
         If self.add_attrs is True, will add additional attributes to span
             as defined in DEFAULT_ATTRS:
@@ -353,8 +829,27 @@ class ConTextComponent:
             - is_historical
             - is_experiencer
         """
-        Span.set_extension("modifiers", default=(), force=True)
-        Doc.set_extension("context_graph", default=None, force=True)
+        Span.set_extension(
+            "modifiers", getter=get_modifiers, setter=set_modifiers, force=True
+        )
+        Doc.set_extension(
+            "context_graph",
+            getter=get_context_graph,
+            setter=set_context_graph,
+            force=True,
+        )
+        Doc.set_extension(
+            "context_graphs",
+            getter=get_context_graphs,
+            setter=set_context_graphs,
+            force=True,
+        )
+        Doc.set_extension(
+            "context_degraded",
+            getter=get_context_degraded,
+            setter=set_context_degraded,
+            force=True,
+        )
 
     def set_context_attributes(self, edges):
         """Add Span-level attributes to targets with modifiers.
@@ -379,11 +874,328 @@ class ConTextComponent:
         Returns:
             doc: a spaCy Doc
         """
+        targets = self._get_targets(doc)
+
+        # Read the rules once so that swap_rules cannot change them while processing this doc
+        rules = self._rules
+        if self.lazy:
+            doc.user_data[LAZY_KEY] = (self, rules, targets)
+            return doc
+        return self._process(doc, targets, rules)
+
+    def update(self, doc, prev_doc, start, end, new_end, context_graph=None):
+        """Apply ConText to an edited version of a Doc which has already been processed,
+        reusing the results for the parts of the Doc which the edit can't change.
+
+        The tokens prev_doc[start:end] were replaced by doc[start:new_end]. The other tokens, and the
+        targets and sentence boundaries outside the edited sentences, must be the same in both Docs.
+        Matches, scopes and edges are only recomputed for the sentences around the edit, or for a margin
+        of max_scope tokens on each side of it if use_context_window is True. The modifiers and edges in
+        the rest of the Doc are copied from context_graph with their offsets shifted.
+        The results are the same as processing doc with `__call__`.
+
+        The whole Doc is processed if the edit can't be isolated: for example if a rule can match
+        sequences of any length and use_context_window is True, if a target of a copied edge is
+        not in doc, if the rules have changed since prev_doc was processed or its graph was stored
+        in serializable mode, or if rule sets were added with `add_rule_set`.
+
+        Args:
+            doc: the edited spaCy Doc
+            prev_doc: the Doc before the edit, which was processed by this component
+            start (int): the index of the first edited token in both Docs
+            end (int): the end of the edited tokens in prev_doc
+            new_end (int): the end of the edited tokens in doc
+            context_graph: the ConTextGraph of prev_doc. If None, prev_doc._.context_graph is used.
+
+        Returns:
+            doc: the processed spaCy Doc
+
+        Raises:
+            ValueError: if the edited range doesn't match the lengths of the Docs.
+        """
+        if not (0 <= start <= end <= len(prev_doc) and start <= new_end <= len(doc)) or (
+            len(doc) - new_end != len(prev_doc) - end
+        ):
+            raise ValueError(
+                "The edit {0} does not match a Doc of length {1} edited to length {2}.".format(
+                    (start, end, new_end), len(prev_doc), len(doc)
+                )
+            )
+        targets = self._get_targets(doc)
+        rules = self._rules
+        if context_graph is None:
+            context_graph = prev_doc._.context_graph
+        if context_graph is None or rules.rule_set_list:
+            return self._process(doc, targets, rules)
+        updated_graph = self._update_graph(
+            doc, prev_doc, targets, rules, context_graph, start, end, new_end
+        )
+        if updated_graph is None:
+            return self._process(doc, targets, rules)
+        return self._set_results(doc, updated_graph, rules)
+
+    def _get_targets(self, doc):
         if self._target_attr == "ents":
-            targets = doc.ents
+            return doc.ents
+        return getattr(doc._, self._target_attr)
+
+    def _match(self, doc, targets, rules):
+        """Find the modifiers in a Doc with a ConTextRuleSet. Returns a list of (ConTextItem, start, end) tuples."""
+        if self.partition_rules:
+            labels = frozenset(target.label_ for target in targets)
+            if labels:
+                matches = rules.match(
+                    doc,
+                    suppress_subsumed=self.prune,
+                    labels=labels,
+                    prefilter=self.prefilter,
+                )
+            else:
+                # Nothing can be modified, so skip matching
+                matches = []
         else:
-            targets = getattr(doc._, self._target_attr)
+            # Sub-matches which pruning would remove are dropped before creating TagObjects
+            matches = rules.match(
+                doc, suppress_subsumed=self.prune, prefilter=self.prefilter
+            )
+        return matches
+
+    def _process(self, doc, targets, rules):
+        """Run ConText on a Doc with a list of targets and a ConTextRuleSet and store the results."""
+        start_time = time.perf_counter()
+        reasons = []
+        labels = None
+        if self.partition_rules:
+            labels = frozenset(target.label_ for target in targets)
+        layers = None
+        if self.cache_modifiers:
+            layers = self._get_cached_modifiers(doc, rules, labels)
+
+        if layers is None:
+            matches = self._match(doc, targets, rules)
+            match_time = time.perf_counter()
+            named_matches = {name: [] for name in rules.rule_set_list}
+            if rules.rule_set_list:
+                # The matches of all rule sets were found in one pass. Split them by rule set, keeping their order.
+                main_matches = []
+                for match in matches:
+                    name = rules.rule_set_names[rules.rule_indices[id(match[0])]]
+                    if name is None:
+                        main_matches.append(match)
+                    else:
+                        named_matches[name].append(match)
+                matches = main_matches
+            named_matches[None] = matches
+
+            context = self
+            if self.budget is not None:
+                reasons = self.budget.check(
+                    doc,
+                    sum(len(name_matches) for name_matches in named_matches.values()),
+                    time.perf_counter() - start_time,
+                    self.use_context_window,
+                )
+                context = self._budget_context(doc, reasons, start_time)
+            try:
+                (graphs, layers) = context._make_graphs(
+                    doc, targets, named_matches, rules
+                )
+            except _DeadlineExceeded:
+                reasons.append(DEADLINE)
+                context = self._budget_context(doc, reasons, start_time)
+                (graphs, layers) = context._make_graphs(
+                    doc, targets, named_matches, rules
+                )
+            if self.cache_modifiers and not reasons:
+                doc.user_data[MODIFIER_CACHE_KEY] = (
+                    rules,
+                    rules.revision,
+                    len(doc),
+                    labels,
+                    layers,
+                )
+        else:
+            match_time = time.perf_counter()
+            graphs = {
+                name: self._apply_cached_modifiers(doc, targets, layer)
+                for (name, layer) in layers.items()
+            }
+        graph_time = time.perf_counter()
+
+        if reasons:
+            doc._.context_degraded = tuple(reasons)
+        elif DEGRADED_KEY in doc.user_data:
+            del doc.user_data[DEGRADED_KEY]
+        if rules.rule_set_list:
+            doc._.context_graphs = {
+                name: self._store_graph(graphs[name], rules)
+                for name in rules.rule_set_list
+            }
+        doc = self._set_results(doc, graphs[None], rules)
+        if self.capture is not None:
+            end_time = time.perf_counter()
+            timings = {
+                "match": match_time - start_time,
+                "graph": graph_time - match_time,
+                "results": end_time - graph_time,
+                "total": end_time - start_time,
+            }
+            self.capture.observe(
+                doc,
+                targets,
+                rules,
+                timings,
+                {key: getattr(self, key) for key in CONFIG_KEYS},
+                reasons,
+            )
+        return doc
+
+    def _make_graphs(self, doc, targets, named_matches, rules):
+        """Create a ConTextGraph for the matches of each rule set.
+
+        Returns:
+            graphs: a dict mapping the name of each rule set, or None for the main rules, to its ConTextGraph
+            layers: a dict mapping the same names to the modifiers to cache, or None if cache_modifiers is False
+        """
+        graphs = {}
+        layers = {} if self.cache_modifiers else None
+        for (name, matches) in named_matches.items():
+            layer = [] if self.cache_modifiers else None
+            graphs[name] = self._make_graph(doc, targets, matches, rules, layer)
+            if layer is not None:
+                layers[name] = tuple(
+                    (
+                        modifier.context_item,
+                        modifier.start,
+                        modifier.end,
+                        modifier._scope_start,
+                        modifier._scope_end,
+                    )
+                    for modifier in layer
+                )
+        return graphs, layers
+
+    def _budget_context(self, doc, reasons, start_time):
+        """Returns the component which should build the graphs of a Doc which exceeded the limits in reasons:
+        the component itself, or a copy of it with the settings of the cheaper mode or the deadline of the Doc.
+        """
+        if not reasons and self.budget.deadline is None:
+            return self
+        context = copy.copy(self)
+        if not reasons:
+            context._deadline = start_time + self.budget.deadline
+            return context
+        context.use_context_window = True
+        context.chunk_size = self.budget.fallback_chunk_size
+        context._max_scope_limit = self.budget.fallback_max_scope
+        context._index_targets = True
+        if SKIP_SCOPE_LIMITS_REASONS.intersection(reasons) or not doc.is_sentenced:
+            # Modifiers only limit each other within a sentence
+            context._limit_scopes = False
+        return context
+
+    def _get_cached_modifiers(self, doc, rules, labels):
+        """Returns the cached modifiers of each rule set of a Doc as a dict mapping the name of each rule set,
+        or None for the main rules, to a tuple of (ConTextItem, start, end, scope_start, scope_end) tuples.
+        Returns None if there is no cache or it can't be used with these rules and labels.
+        """
+        cached = doc.user_data.get(MODIFIER_CACHE_KEY)
+        if cached is None:
+            return None
+        (cached_rules, revision, length, cached_labels, layers) = cached
+        if cached_rules is not rules or revision != rules.revision or length != len(doc):
+            return None
+        if cached_labels is not None and not labels <= cached_labels:
+            return None
+        return layers
+
+    def _apply_cached_modifiers(self, doc, targets, layer):
+        """Create a ConTextGraph from a list of targets and the cached modifiers of a Doc."""
+        context_graph = ConTextGraph(
+            remove_overlapping_modifiers=self.remove_overlapping_modifiers
+        )
+        context_graph.targets = targets
+        context_graph.modifiers = [
+            TagObject(
+                item, start, end, doc, self.use_context_window, scope=(scope_start, scope_end)
+            )
+            for (item, start, end, scope_start, scope_end) in layer
+        ]
+        context_graph.apply_modifiers()
+        return context_graph
+
+    def _clear_results(self, doc):
+        """Remove the Span._.modifiers and assertion attributes which were set by an earlier run on a Doc."""
+        attr_names = {"modifiers"}
+        if self.add_attrs:
+            for attr_dict in self.context_attributes_mapping.values():
+                attr_names.update(attr_dict.keys())
+        stale = [
+            key
+            for key in doc.user_data
+            if isinstance(key, tuple)
+            and len(key) == 4
+            and key[0] == "._."
+            and key[1] in attr_names
+            and key[2] is not None
+        ]
+        for key in stale:
+            del doc.user_data[key]
+
+    def _set_results(self, doc, context_graph, rules):
+        """Store a ConTextGraph on a Doc and set the attributes of its targets."""
+        if CONTEXT_GRAPH_KEY in doc.user_data:
+            # The Doc has been processed before, possibly with other targets
+            self._clear_results(doc)
+
+        # If add_attrs is True, add is_negated, is_current, is_asserted to targets
+        if self.add_attrs:
+            self.set_context_attributes(context_graph.edges)
+
+        if self.lean or self.serializable:
+            doc._.context_graph = self._store_graph(context_graph, rules)
+            if self.stats is not None:
+                self.stats.update(doc, context_graph)
+            return doc
+
+        # Link targets to their modifiers
+        for target, modifier in context_graph.edges:
+            target._.modifiers += (modifier,)
+
+        doc._.context_graph = context_graph
+        if self.stats is not None:
+            self.stats.update(doc, context_graph)
+
+        return doc
 
+    def _make_graph(self, doc, targets, matches, rules, layer=None):
+        if self.chunk_size is not None and len(doc) > self.chunk_size:
+            return self._build_chunked_graph(doc, targets, matches, rules, layer)
+        return self._build_graph(doc, targets, matches, layer)
+
+    def _store_graph(self, context_graph, rules):
+        """Returns the form in which a ConTextGraph is stored on a Doc: the graph itself,
+        or a CompactConTextGraph or its dict form in lean or serializable mode.
+        """
+        if not (self.lean or self.serializable):
+            return context_graph
+        compact_graph = CompactConTextGraph.from_graph(
+            context_graph,
+            rules.item_data,
+            rules.rule_indices,
+            rules.category_list,
+            rules.category_ids,
+            use_context_window=self.use_context_window,
+        )
+        if self.serializable:
+            return compact_graph.to_dict()
+        return compact_graph
+
+    def _build_graph(self, doc, targets, matches, layer=None):
+        """Create a ConTextGraph from a list of targets and (ConTextItem, start, end) matches.
+        If layer is a list, the modifiers are added to it after pruning and scope limiting,
+        before any are removed for overlapping a target.
+        """
         # Store data in ConTextGraph object
         # TODO: move some of this over to ConTextGraph
         context_graph = ConTextGraph(
@@ -393,33 +1205,359 @@ class ConTextComponent:
         context_graph.targets = targets
 
         context_graph.modifiers = []
-
-        matches = self.phrase_matcher(doc)
-        matches += self.matcher(doc)
-
-        # Sort matches
-        matches = sorted(matches, key=lambda x: x[1])
-        for (match_id, start, end) in matches:
-            # Get the ConTextItem object defining this modifier
-            item_data = self._modifier_item_mapping[match_id]
+        for (item_data, start, end) in matches:
             tag_object = TagObject(
-                item_data, start, end, doc, self.use_context_window
+                item_data,
+                start,
+                end,
+                doc,
+                self.use_context_window,
+                _max_scope=self._max_scope_limit,
             )
             context_graph.modifiers.append(tag_object)
 
         if self.prune:
             context_graph.prune_modifiers()
-        context_graph.update_scopes()
-        context_graph.apply_modifiers()
+        if self._limit_scopes and not context_graph.update_scopes(
+            deadline=self._deadline
+        ):
+            raise _DeadlineExceeded()
+        if layer is not None:
+            layer.extend(context_graph.modifiers)
+        context_graph.apply_modifiers(index_targets=self._index_targets)
+        return context_graph
 
-        # Link targets to their modifiers
-        for target, modifier in context_graph.edges:
-            target._.modifiers += (modifier,)
+    def _chunk_regions(self, doc, targets, matches, rules):
+        """Split a Doc into chunks.
 
-        # If add_attrs is True, add is_negated, is_current, is_asserted to targets
-        if self.add_attrs:
-            self.set_context_attributes(context_graph.edges)
+        Returns:
+            regions: a list of (core_start, core_end, region_start, region_end) token offsets.
+                The cores partition the Doc. Each region contains its core plus the margin which is needed
+                to compute the modifiers starting in the core exactly. Returns None if the Doc can't be split.
+        """
+        # Blocks are the unions of overlapping modifiers and targets. Pruning and scope updates
+        # only interact within a block or a sentence, so no chunk or region boundary may fall inside a block.
+        intervals = sorted(
+            [(start, end) for (_, start, end) in matches]
+            + [(target.start, target.end) for target in targets]
+        )
+        block_starts = []
+        block_ends = []
+        for (start, end) in intervals:
+            if block_ends and start < block_ends[-1]:
+                block_ends[-1] = max(block_ends[-1], end)
+            else:
+                block_starts.append(start)
+                block_ends.append(end)
 
-        doc._.context_graph = context_graph
+        def block_containing(i):
+            idx = bisect_right(block_starts, i) - 1
+            if idx >= 0 and block_starts[idx] < i < block_ends[idx]:
+                return idx
+            return None
 
-        return doc
+        if self.use_context_window:
+            if self._max_scope_limit is not None:
+                max_scope = self._max_scope_limit
+            else:
+                max_scope = max(
+                    [item.max_scope for item in rules.item_data] + [self.max_scope]
+                )
+            max_length = max([end - start for (_, start, end) in matches] + [0])
+            margin = max_scope + max_length
+            cuts = range(1, len(doc))
+        else:
+            if not doc.is_sentenced:
+                return None
+            margin = 0
+            cuts = [sent.start for sent in doc.sents][1:]
+
+        # Choose chunk boundaries from the allowed cuts, as close as possible to chunk_size tokens apart
+        boundaries = [0]
+        candidates = [cut for cut in cuts if block_containing(cut) is None]
+        while True:
+            idx = bisect_right(candidates, boundaries[-1] + self.chunk_size) - 1
+            if idx < 0 or candidates[idx] <= boundaries[-1]:
+                idx = bisect_right(candidates, boundaries[-1])
+                if idx == len(candidates):
+                    break
+            boundaries.append(candidates[idx])
+        boundaries.append(len(doc))
+
+        regions = []
+        for (core_start, core_end) in zip(boundaries, boundaries[1:]):
+            region_start = max(0, core_start - margin)
+            region_end = min(len(doc), core_end + margin)
+            idx = block_containing(region_start)
+            if idx is not None:
+                region_start = block_starts[idx]
+            idx = block_containing(region_end)
+            if idx is not None:
+                region_end = block_ends[idx]
+            regions.append((core_start, core_end, region_start, region_end))
+        return regions
+
+    def _build_chunked_graph(self, doc, targets, matches, rules, layer=None):
+        """Create a ConTextGraph by processing one chunk of the Doc at a time.
+        Only the modifiers which start in the core of each chunk are kept, along with their edges.
+        """
+        regions = self._chunk_regions(doc, targets, matches, rules)
+        if regions is None:
+            return self._build_graph(doc, targets, matches, layer)
+
+        # Matches and targets are both sorted by start
+        match_starts = [start for (_, start, _) in matches]
+        target_starts = [target.start for target in targets]
+        modifiers = []
+        edges = []
+        for (core_start, core_end, region_start, region_end) in regions:
+            region_matches = matches[
+                bisect_left(match_starts, region_start) : bisect_left(
+                    match_starts, region_end
+                )
+            ]
+            region_targets = targets[
+                bisect_left(target_starts, region_start) : bisect_left(
+                    target_starts, region_end
+                )
+            ]
+            region_layer = [] if layer is not None else None
+            chunk_graph = self._build_graph(
+                doc, region_targets, region_matches, region_layer
+            )
+            if layer is not None:
+                layer.extend(
+                    modifier
+                    for modifier in region_layer
+                    if core_start <= modifier.start < core_end
+                )
+            for modifier in chunk_graph.modifiers:
+                if core_start <= modifier.start < core_end:
+                    modifiers.append(modifier)
+                    for target in modifier._targets:
+                        edges.append((target, modifier))
+
+        context_graph = ConTextGraph(
+            remove_overlapping_modifiers=self.remove_overlapping_modifiers
+        )
+        context_graph.targets = targets
+        context_graph.modifiers = modifiers
+        context_graph.edges = edges
+        return context_graph
+
+    def _match_window(self, doc, targets, rules, window_start, window_end):
+        """Find the modifiers in doc[window_start:window_end], with offsets relative to doc."""
+        if window_start == 0 and window_end == len(doc):
+            return self._match(doc, targets, rules)
+        window = doc[window_start:window_end].as_doc()
+        return [
+            (item, start + window_start, end + window_start)
+            for (item, start, end) in self._match(window, targets, rules)
+        ]
+
+    def _update_graph(
+        self, doc, prev_doc, targets, rules, prev_graph, start, end, new_end
+    ):
+        """Create a ConTextGraph for an edited Doc from the ConTextGraph of the Doc before the edit.
+        See `update`. Returns None if the edit can't be isolated.
+        """
+        if len(doc) == 0:
+            return None
+        # The edited tokens in doc, extended to any sentence boundary outside them which has changed
+        changed_start, changed_end = start, new_end
+        if doc.is_sentenced and prev_doc.is_sentenced:
+            sent_starts = doc.to_array(SENT_START)
+            prev_sent_starts = prev_doc.to_array(SENT_START)
+            changed = np.nonzero(sent_starts[:start] != prev_sent_starts[:start])[0]
+            if len(changed):
+                # The sentence ending before the changed boundary has changed too
+                changed_start = max(0, changed[0] - 1)
+            changed = np.nonzero(sent_starts[new_end:] != prev_sent_starts[end:])[0]
+            if len(changed):
+                changed_end = new_end + changed[-1] + 1
+        elif not self.use_context_window:
+            return None
+
+        trigger_filter = getattr(rules, "trigger_filter", None)
+        max_length = None if trigger_filter is None else trigger_filter.max_length
+        if self.use_context_window:
+            if max_length is None:
+                return None
+            max_scope = max(
+                [item.max_scope for item in rules.item_data] + [self.max_scope]
+            )
+            # A modifier depends on the tokens up to max_scope tokens past the matches which
+            # overlap it, so a modifier outside the core can't be changed by the edit
+            margin = max_scope + 2 * max_length
+            core_start = max(0, changed_start - margin)
+            core_end = min(len(doc), changed_end + margin)
+        else:
+            margin = 0
+            # Include the sentences next to the edit, which may have been split or joined
+            core_start = max(0, changed_start - 1)
+            core_end = min(len(doc), changed_end + 1)
+
+        # The core is recomputed and the region is the context needed to compute it exactly.
+        # As in _chunk_regions, no boundary may fall inside a block of overlapping matches and targets,
+        # and matches are found in a window large enough to contain every match which overlaps the region.
+        region_start, region_end = core_start, core_end
+        window = None
+        while True:
+            if not self.use_context_window:
+                core_start = doc[core_start].sent.start
+                core_end = doc[core_end - 1].sent.end
+            region_start = min(region_start, max(0, core_start - margin))
+            region_end = max(region_end, min(len(doc), core_end + margin))
+            if max_length is None:
+                needed = (0, len(doc))
+            else:
+                needed = (
+                    max(0, region_start - 2 * max_length),
+                    min(len(doc), region_end + 2 * max_length),
+                )
+            if window is None or needed[0] < window[0] or needed[1] > window[1]:
+                window = needed
+                matches = self._match_window(doc, targets, rules, *window)
+                intervals = sorted(
+                    [(match_start, match_end) for (_, match_start, match_end) in matches]
+                    + [(target.start, target.end) for target in targets]
+                )
+                blocks = []
+                for (interval_start, interval_end) in intervals:
+                    if blocks and interval_start < blocks[-1][1]:
+                        blocks[-1][1] = max(blocks[-1][1], interval_end)
+                    else:
+                        blocks.append([interval_start, interval_end])
+
+            boundaries = [core_start, core_end, region_start, region_end]
+            snapped = list(boundaries)
+            for (block_start, block_end) in blocks:
+                for (i, boundary) in enumerate(boundaries):
+                    if block_start < boundary < block_end:
+                        snapped[i] = block_start if i % 2 == 0 else block_end
+            if snapped == boundaries:
+                break
+            (core_start, core_end, region_start, region_end) = snapped
+
+        region_matches = [
+            match for match in matches if region_start <= match[1] < region_end
+        ]
+        region_targets = [
+            target for target in targets if region_start <= target.start < region_end
+        ]
+        region_graph = self._build_graph(doc, region_targets, region_matches)
+        core_modifiers = [
+            modifier
+            for modifier in region_graph.modifiers
+            if core_start <= modifier.start < core_end
+        ]
+
+        # Copy the modifiers outside the core, shifting the offsets after the edit
+        delta = new_end - end
+        prev_core_end = core_end - delta
+
+        def shift(i):
+            if i <= start:
+                return i
+            if i >= end:
+                return i + delta
+            return None
+
+        target_lookup = {
+            (target.start, target.end, target.label_): target for target in targets
+        }
+        before = []
+        after = []
+        for modifier in prev_graph.modifiers:
+            if modifier.end <= core_start:
+                copied = before
+            elif modifier.start >= prev_core_end:
+                copied = after
+            elif modifier.start < core_start or modifier.end > prev_core_end:
+                # The modifier crosses the boundary of the core
+                return None
+            else:
+                continue
+            if id(modifier.context_item) not in rules.rule_indices:
+                # The rules have changed, or the graph was deserialized with copies of them
+                return None
+            offsets = [
+                shift(i)
+                for i in (
+                    modifier.start,
+                    modifier.end,
+                    modifier._scope_start,
+                    modifier._scope_end,
+                )
+            ]
+            if None in offsets:
+                return None
+            tag_object = TagObject(
+                modifier.context_item,
+                offsets[0],
+                offsets[1],
+                doc,
+                self.use_context_window,
+                scope=(offsets[2], offsets[3]),
+            )
+            for target in modifier._targets:
+                key = (shift(target.start), shift(target.end), target.label_)
+                if key not in target_lookup:
+                    return None
+                tag_object.modify(target_lookup[key])
+            copied.append(tag_object)
+
+        context_graph = ConTextGraph(
+            remove_overlapping_modifiers=self.remove_overlapping_modifiers
+        )
+        context_graph.targets = targets
+        context_graph.modifiers = before + core_modifiers + after
+        context_graph.edges = [
+            (target, modifier)
+            for modifier in context_graph.modifiers
+            for target in modifier._targets
+        ]
+        return context_graph
+
+    def _process_batch(self, docs):
+        return [self(doc) for doc in docs]
+
+    def pipe(self, docs, batch_size=128, n_threads=1):
+        """Apply the ConText algorithm to a stream of Docs.
+
+        If n_threads is greater than 1, batches of Docs are processed by a thread pool while the caller
+        keeps consuming the input and output streams, which allows overlapping I/O-bound work such as
+        tokenization and serialization with ConText. Docs are yielded in the same order as the input.
+
+        Args:
+            docs: an iterable of spaCy Docs
+            batch_size (int): The number of Docs sent to a thread at a time.
+            n_threads (int): The number of threads. If greater than 1, the component must be frozen.
+
+        Yields:
+            doc: a spaCy Doc
+
+        Raises:
+            RuntimeError: if n_threads is greater than 1 and the component has not been frozen.
+        """
+        if n_threads <= 1:
+            for doc in docs:
+                yield self(doc)
+            return
+        if not self._frozen:
+            raise RuntimeError(
+                "ConTextComponent must be frozen with `freeze()` before processing with multiple threads."
+            )
+        docs = iter(docs)
+        with ThreadPoolExecutor(n_threads) as executor:
+            # Limit the number of batches in flight so memory stays bounded
+            pending = deque()
+            while True:
+                batch = list(islice(docs, batch_size))
+                if not batch:
+                    break
+                pending.append(executor.submit(self._process_batch, batch))
+                if len(pending) >= 2 * n_threads:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
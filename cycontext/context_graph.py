@@ -1,3 +1,7 @@
+import time
+from bisect import bisect_left
+
+
 class ConTextGraph:
     def __init__(self, remove_overlapping_modifiers=False):
         self.targets = []
@@ -5,7 +9,7 @@ class ConTextGraph:
         self.edges = []
         self.remove_overlapping_modifiers = remove_overlapping_modifiers
 
-    def update_scopes(self):
+    def update_scopes(self, deadline=None):
         """Update the scope of all TagObjects.
 
         For each modifier in a list of TagObjects, check against each other
@@ -14,23 +18,31 @@ class ConTextGraph:
         scope and allows "terminate" modifiers to end a modifier's scope.
 
         Args:
-            marked_modifiers: A list of TagObjects in a Doc.
+            deadline (float or None): An optional time.perf_counter() value. If it passes
+                before all pairs of modifiers have been compared, the rest are skipped.
+
+        Returns:
+            completed (bool): False if the deadline passed before all scopes were updated.
         """
         for i in range(len(self.modifiers) - 1):
+            if deadline is not None and time.perf_counter() > deadline:
+                return False
             modifier1 = self.modifiers[i]
             for j in range(i + 1, len(self.modifiers)):
                 modifier2 = self.modifiers[j]
                 # TODO: Add modifier -> modifier edges
                 modifier1.limit_scope(modifier2)
                 modifier2.limit_scope(modifier1)
+        return True
 
-    def apply_modifiers(self):
+    def apply_modifiers(self, index_targets=False):
         """Checks each target/modifier pair. If modifier modifies target,
         create an edge between them.
 
         Args:
-            marked_targets: A list of Spans
-            marked_modifiers: A list of TagObjects
+            index_targets (bool): If True, each modifier is only checked against the targets which
+                overlap its scope, which are found by binary search, instead of against every target.
+                The edges are the same, but on_modifies callbacks are called in the order of the modifiers.
 
         RETURNS 
             edges: A list of tuples consisting of target/modifier pairs
@@ -44,10 +56,13 @@ class ConTextGraph:
                         break
 
         edges = []
-        for target in self.targets:
-            for modifier in self.modifiers:
-                if modifier.modifies(target):
-                    modifier.modify(target)
+        if index_targets:
+            self._apply_indexed_modifiers()
+        else:
+            for target in self.targets:
+                for modifier in self.modifiers:
+                    if modifier.modifies(target):
+                        modifier.modify(target)
 
         # Now do a second pass and reduce the number of targets
         # for any modifiers with a max_targets int
@@ -58,6 +73,19 @@ class ConTextGraph:
 
         self.edges = edges
 
+    def _apply_indexed_modifiers(self):
+        order = sorted(range(len(self.targets)), key=lambda i: self.targets[i].start)
+        starts = [self.targets[i].start for i in order]
+        max_length = max([len(target) for target in self.targets] + [0])
+        for modifier in self.modifiers:
+            # A target can only be modified if its first or last token is in the scope
+            lo = bisect_left(starts, modifier._scope_start - max_length + 1)
+            hi = bisect_left(starts, modifier._scope_end)
+            for i in sorted(order[lo:hi]):
+                target = self.targets[i]
+                if target.end > modifier._scope_start and modifier.modifies(target):
+                    modifier.modify(target)
+
     def prune_modifiers(self):
         """Prune overlapping modifiers so that only the longest span is kept.
 
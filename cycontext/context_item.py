@@ -1,3 +1,4 @@
+import copy
 import json
 
 
@@ -170,6 +171,49 @@ class ConTextItem:
                 )
             )
 
+    def __setattr__(self, name, value):
+        if getattr(self, "_frozen", False):
+            raise AttributeError(
+                "Cannot set attribute '{0}' because this ConTextItem is frozen.".format(
+                    name
+                )
+            )
+        super().__setattr__(name, value)
+
+    @property
+    def frozen(self):
+        """Returns True if the ConTextItem has been frozen."""
+        return getattr(self, "_frozen", False)
+
+    def freeze(self):
+        """Make the ConTextItem immutable so that it can be safely shared between threads.
+        The sets allowed_types, excluded_types and terminated_by are converted to frozensets
+        and any later attempt to set an attribute raises an AttributeError.
+        ConTextComponent.freeze freezes copies of its items, so this is only needed to freeze
+        an item directly.
+        """
+        if self.frozen:
+            return
+        if self.allowed_types is not None:
+            self.allowed_types = frozenset(self.allowed_types)
+        if self.excluded_types is not None:
+            self.excluded_types = frozenset(self.excluded_types)
+        self.terminated_by = frozenset(self.terminated_by)
+        self._frozen = True
+
+    def copy(self):
+        """Returns a copy of the ConTextItem which is not frozen, with its own sets of
+        allowed_types, excluded_types and terminated_by. This can be used to change a frozen item
+        or to add it to another ConTextComponent.
+        """
+        item = copy.copy(self)
+        item.__dict__["_frozen"] = False
+        for attr in ("allowed_types", "excluded_types"):
+            if getattr(item, attr) is not None:
+                setattr(item, attr, set(getattr(item, attr)))
+        item.terminated_by = set(item.terminated_by)
+        return item
+
     @classmethod
     def from_yaml(cls, _file):
         """Read in a lexicon of modifiers from a YAML file.
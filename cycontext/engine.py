@@ -0,0 +1,550 @@
+"""A ConText engine which runs directly over pre-tokenized arrays without creating a spaCy Doc.
+
+ConTextEngine applies the same ConTextItem rules with the same scope, pruning, termination
+and max_targets semantics as ConTextComponent and ConTextGraph, but takes lowercase tokens,
+sentence-start flags and (start, end, label) target triples and returns edges as arrays.
+
+Example:
+    >>> engine = ConTextEngine.from_component(context)
+    >>> tokens = ["there", "is", "no", "evidence", "of", "pneumonia", "."]
+    >>> sent_starts = [True, False, False, False, False, False, False]
+    >>> edges = engine(tokens, sent_starts, [(5, 6, "PROBLEM")])
+    >>> edges["target"], edges["modifier_start"], edges["modifier_end"]
+    (array([0]), array([2]), array([5]))
+"""
+import re
+import unicodedata
+
+import numpy as np
+
+from .context_item import ConTextItem
+
+# The columns in the output of ConTextEngine.__call__, in order
+ENGINE_EDGE_COLUMNS = (
+    "target",
+    "modifier_start",
+    "modifier_end",
+    "category_id",
+    "rule",
+    "scope_start",
+    "scope_end",
+)
+
+_STRING_ATTRS = {"LOWER", "NORM", "TEXT", "ORTH"}
+
+_BOOL_ATTRS = {
+    "IS_ALPHA": str.isalpha,
+    "IS_DIGIT": str.isdigit,
+    "IS_SPACE": str.isspace,
+    "IS_PUNCT": lambda text: bool(text)
+    and all(unicodedata.category(char).startswith("P") for char in text),
+}
+
+_ALLOWED_OPS = (None, "1", "?", "*", "+")
+
+
+def _default_tokenizer(text):
+    return re.findall(r"\w+|[^\w\s]", text.lower())
+
+
+def _compile_value(attr, value):
+    if attr in _STRING_ATTRS:
+        get = lambda text: text
+    elif attr in _BOOL_ATTRS:
+        get = _BOOL_ATTRS[attr]
+    elif attr == "LENGTH":
+        get = len
+    else:
+        raise ValueError(
+            "ConTextEngine does not support the token attribute {0}. Supported attributes are: {1}".format(
+                attr, sorted(_STRING_ATTRS | set(_BOOL_ATTRS) | {"LENGTH"})
+            )
+        )
+    if not isinstance(value, dict):
+        if attr in _STRING_ATTRS:
+            value = value.lower()
+        return lambda text: get(text) == value
+
+    predicates = []
+    for (predicate, arg) in value.items():
+        if predicate == "IN":
+            if attr in _STRING_ATTRS:
+                arg = {val.lower() for val in arg}
+            else:
+                arg = set(arg)
+            predicates.append(lambda text, arg=arg: get(text) in arg)
+        elif predicate == "NOT_IN":
+            if attr in _STRING_ATTRS:
+                arg = {val.lower() for val in arg}
+            else:
+                arg = set(arg)
+            predicates.append(lambda text, arg=arg: get(text) not in arg)
+        elif predicate == "REGEX":
+            regex = re.compile(arg)
+            predicates.append(lambda text, regex=regex: bool(regex.search(get(text))))
+        else:
+            raise ValueError(
+                "ConTextEngine does not support the pattern predicate {0}.".format(
+                    predicate
+                )
+            )
+    return lambda text: all(predicate(text) for predicate in predicates)
+
+
+def _compile_token_pattern(token_pattern):
+    token_pattern = dict(token_pattern)
+    op = token_pattern.pop("OP", None)
+    if op not in _ALLOWED_OPS:
+        raise ValueError(
+            "ConTextEngine does not support the pattern operator {0}. Must be one of: {1}".format(
+                op, _ALLOWED_OPS
+            )
+        )
+    predicates = [
+        _compile_value(attr.upper(), value) for (attr, value) in token_pattern.items()
+    ]
+    return (
+        lambda text: all(predicate(text) for predicate in predicates),
+        op,
+    )
+
+
+def _pattern_match_ends(pattern, tokens, start):
+    """Return all end indices of the token pattern starting at tokens[start], like spaCy's Matcher."""
+
+    def closure(states):
+        states = set(states)
+        stack = list(states)
+        while stack:
+            state = stack.pop()
+            if state < len(pattern) and pattern[state][1] in ("?", "*"):
+                if state + 1 not in states:
+                    states.add(state + 1)
+                    stack.append(state + 1)
+        return states
+
+    ends = []
+    states = closure({0})
+    i = start
+    while states:
+        if len(pattern) in states and i > start:
+            ends.append(i)
+        if i == len(tokens):
+            break
+        next_states = set()
+        for state in states:
+            if state == len(pattern):
+                continue
+            matches, op = pattern[state]
+            if matches(tokens[i]):
+                next_states.add(state + 1)
+                if op in ("*", "+"):
+                    next_states.add(state)
+        states = closure(next_states)
+        i += 1
+    return ends
+
+
+class _Modifier:
+    """A lightweight equivalent of TagObject used internally by ConTextEngine."""
+
+    __slots__ = (
+        "start",
+        "end",
+        "rule_idx",
+        "scope_start",
+        "scope_end",
+        "sent",
+        "targets",
+    )
+
+    def __init__(self, start, end, rule_idx, sent):
+        self.start = start
+        self.end = end
+        self.rule_idx = rule_idx
+        self.sent = sent
+        self.scope_start = None
+        self.scope_end = None
+        self.targets = []
+
+
+class ConTextEngine:
+    """Applies ConText rules to pre-tokenized arrays without spaCy."""
+
+    def __init__(
+        self,
+        item_data,
+        allowed_types=None,
+        excluded_types=None,
+        use_context_window=False,
+        max_scope=None,
+        max_targets=None,
+        terminations=None,
+        prune=True,
+        remove_overlapping_modifiers=False,
+        tokenizer=None,
+        strings=None,
+    ):
+        """Create a new ConTextEngine.
+
+        The global arguments have the same meaning as in ConTextComponent. Unlike ConTextComponent.add,
+        the ConTextItems are not modified; the global values are resolved into the engine's own tables.
+
+        Args:
+            item_data: A list of ConTextItems. Items with `on_match` or `on_modifies` callbacks are
+                not supported, since these require spaCy objects. Token patterns may use the attributes
+                LOWER, NORM, TEXT, ORTH (all compared to the lowercase token), LENGTH, IS_ALPHA,
+                IS_DIGIT, IS_PUNCT and IS_SPACE, the predicates IN, NOT_IN and REGEX,
+                and the operators "?", "*" and "+".
+            tokenizer (callable or None): A function which splits the literal of a ConTextItem into a
+                list of lowercase token strings. This should match the tokenization of the input arrays.
+                If None, literals are split into runs of word characters and single punctuation characters.
+            strings (sequence, dict or None): A mapping from token ids to lowercase strings, such as a
+                list or a spaCy StringStore. Required if tokens are passed to `__call__` as integer ids.
+
+        Raises:
+            ValueError: if one of the parameters is incorrectly formatted or a rule is not supported.
+        """
+        if use_context_window is True:
+            if not isinstance(max_scope, int) or max_scope < 1:
+                raise ValueError(
+                    "If 'use_context_window' is True, 'max_scope' must be an integer greater 1, "
+                    "not {0}".format(max_scope)
+                )
+        if max_scope is not None and (
+            not isinstance(max_scope, int) or max_scope < 1
+        ):
+            raise ValueError(
+                "'max_scope' must be None or an integer greater 1, "
+                "not {0}".format(max_scope)
+            )
+        self.use_context_window = use_context_window
+        self.prune = prune
+        self.remove_overlapping_modifiers = remove_overlapping_modifiers
+        self.strings = strings
+        if tokenizer is None:
+            tokenizer = _default_tokenizer
+        if terminations is None:
+            terminations = dict()
+        terminations = {k.upper(): v for (k, v) in terminations.items()}
+
+        self.rules = tuple(item_data)
+        self.categories = []
+        category_ids = dict()
+        # Per-rule tables with the global values resolved
+        self._rule_category_ids = []
+        self._rule_directions = []
+        self._rule_allowed_types = []
+        self._rule_excluded_types = []
+        self._rule_max_scopes = []
+        self._rule_max_targets = []
+        self._rule_terminated_by = []
+
+        # _phrases: A mapping from a tuple of tokens to the indices of the rules with that literal
+        # _patterns: A list of (rule index, compiled pattern)
+        self._phrases = dict()
+        self._phrase_lengths = set()
+        self._patterns = []
+
+        globals_ = {
+            "allowed_types": allowed_types,
+            "excluded_types": excluded_types,
+            "max_scope": max_scope,
+            "max_targets": max_targets,
+        }
+        for (i, item) in enumerate(self.rules):
+            if not isinstance(item, ConTextItem):
+                raise ValueError(
+                    "item_data must contain only ConTextItems. Currently contains: {0}".format(
+                        type(item)
+                    )
+                )
+            if item.on_match is not None or item.on_modifies is not None:
+                raise ValueError(
+                    "ConTextEngine does not support ConTextItems with on_match or on_modifies callbacks: "
+                    "{0}".format(item)
+                )
+            values = {}
+            for (attr, value) in globals_.items():
+                item_value = getattr(item, attr)
+                values[attr] = value if item_value is None else item_value
+
+            if item.category not in category_ids:
+                category_ids[item.category] = len(self.categories)
+                self.categories.append(item.category)
+            self._rule_category_ids.append(category_ids[item.category])
+            self._rule_directions.append(item.rule)
+            self._rule_allowed_types.append(values["allowed_types"])
+            self._rule_excluded_types.append(values["excluded_types"])
+            self._rule_max_scopes.append(values["max_scope"])
+            self._rule_max_targets.append(values["max_targets"])
+            terminated_by = set(item.terminated_by)
+            for other_modifier in terminations.get(item.category.upper(), ()):
+                terminated_by.add(other_modifier.upper())
+            self._rule_terminated_by.append(terminated_by)
+
+            if item.pattern is None:
+                phrase = tuple(tokenizer(item.literal))
+                self._phrases.setdefault(phrase, []).append(i)
+                self._phrase_lengths.add(len(phrase))
+            else:
+                self._patterns.append(
+                    (i, [_compile_token_pattern(token) for token in item.pattern])
+                )
+        self.categories = tuple(self.categories)
+        self._phrase_lengths = sorted(self._phrase_lengths)
+
+    @classmethod
+    def from_component(cls, context):
+        """Create a ConTextEngine with the same rules and settings as a ConTextComponent.
+        Literals are tokenized with the component's spaCy tokenizer.
+        """
+        return cls(
+            context.item_data,
+            allowed_types=context.allowed_types,
+            excluded_types=context.excluded_types,
+            use_context_window=context.use_context_window,
+            max_scope=context.max_scope,
+            max_targets=context.max_targets,
+            terminations=context.terminations,
+            prune=context.prune,
+            remove_overlapping_modifiers=context.remove_overlapping_modifiers,
+            tokenizer=lambda text: [
+                token.lower_ for token in context.nlp.make_doc(text)
+            ],
+        )
+
+    def _match(self, tokens, sent_ids):
+        """Find all modifiers in the same order which ConTextComponent creates TagObjects:
+        phrase matches before pattern matches for the same start, each sorted by (end, rule index).
+        """
+        phrase_matches = []
+        for start in range(len(tokens)):
+            for length in self._phrase_lengths:
+                if start + length > len(tokens):
+                    break
+                for rule_idx in self._phrases.get(
+                    tuple(tokens[start : start + length]), ()
+                ):
+                    phrase_matches.append((start, start + length, rule_idx))
+        pattern_matches = []
+        for start in range(len(tokens)):
+            for (rule_idx, pattern) in self._patterns:
+                for end in _pattern_match_ends(pattern, tokens, start):
+                    pattern_matches.append((start, end, rule_idx))
+        phrase_matches.sort(key=lambda x: (x[0], x[1], x[2]))
+        pattern_matches.sort(key=lambda x: (x[1], x[0], x[2]))
+        matches = sorted(phrase_matches + pattern_matches, key=lambda x: x[0])
+        return [
+            _Modifier(start, end, rule_idx, sent_ids[start])
+            for (start, end, rule_idx) in matches
+        ]
+
+    def _set_scope(self, modifier, num_tokens, sent_bounds):
+        rule_idx = modifier.rule_idx
+        max_scope = self._rule_max_scopes[rule_idx]
+        if self.use_context_window:
+            full_scope_start = max(0, modifier.start - max_scope)
+            full_scope_end = min(num_tokens, modifier.end + max_scope)
+        else:
+            full_scope_start, full_scope_end = sent_bounds[modifier.sent]
+
+        direction = self._rule_directions[rule_idx].lower()
+        if direction == "forward":
+            modifier.scope_start, modifier.scope_end = modifier.end, full_scope_end
+            if (
+                max_scope is not None
+                and (modifier.scope_end - modifier.scope_start) > max_scope
+            ):
+                modifier.scope_end = modifier.end + max_scope
+        elif direction == "backward":
+            modifier.scope_start, modifier.scope_end = full_scope_start, modifier.start
+            if (
+                max_scope is not None
+                and (modifier.scope_end - modifier.scope_start) > max_scope
+            ):
+                modifier.scope_start = modifier.start - max_scope
+        else:
+            modifier.scope_start, modifier.scope_end = full_scope_start, full_scope_end
+            if max_scope is not None and (modifier.start - modifier.scope_start) > max_scope:
+                modifier.scope_start = modifier.start - max_scope
+            if max_scope is not None and (modifier.scope_end - modifier.end) > max_scope:
+                modifier.scope_end = modifier.end + max_scope
+
+    def _limit_scope(self, modifier, other):
+        """Equivalent to TagObject.limit_scope."""
+        if modifier.sent != other.sent:
+            return
+        rule = self._rule_directions[modifier.rule_idx]
+        other_rule = self._rule_directions[other.rule_idx]
+        if rule == "TERMINATE":
+            return
+        category = self.rules[modifier.rule_idx].category.upper()
+        other_category = self.rules[other.rule_idx].category.upper()
+        if (
+            other_rule != "TERMINATE"
+            and other_category not in self._rule_terminated_by[modifier.rule_idx]
+            and other_category != category
+        ):
+            return
+        if category == other_category and (
+            (
+                self._rule_allowed_types[modifier.rule_idx]
+                != self._rule_allowed_types[other.rule_idx]
+            )
+            or (
+                self._rule_excluded_types[modifier.rule_idx]
+                != self._rule_excluded_types[other.rule_idx]
+            )
+        ):
+            return
+        if rule in ("FORWARD", "BIDIRECTIONAL") and other.start > modifier.start:
+            modifier.scope_end = min(modifier.scope_end, other.start)
+        if rule in ("BACKWARD", "BIDIRECTIONAL") and other.start < modifier.start:
+            modifier.scope_start = max(modifier.scope_start, other.end)
+
+    def _prune(self, modifiers):
+        """Equivalent to ConTextGraph.prune_overlapping_modifiers."""
+        while len(modifiers) > 1:
+            unpruned = list(modifiers)
+            pruned = []
+            curr_mod = unpruned.pop(0)
+            while True:
+                if len(unpruned) == 0:
+                    pruned.append(curr_mod)
+                    break
+                next_mod = unpruned.pop(0)
+                if curr_mod.start < next_mod.end and next_mod.start < curr_mod.end:
+                    pruned.append(
+                        max(curr_mod, next_mod, key=lambda x: (x.end - x.start))
+                    )
+                    if len(unpruned) == 0:
+                        break
+                    curr_mod = unpruned.pop(0)
+                else:
+                    pruned.append(curr_mod)
+                    curr_mod = next_mod
+            if len(pruned) == len(modifiers):
+                return pruned
+            modifiers = pruned
+        return modifiers
+
+    def _allows(self, rule_idx, label):
+        allowed_types = self._rule_allowed_types[rule_idx]
+        if allowed_types is not None:
+            return label in allowed_types
+        excluded_types = self._rule_excluded_types[rule_idx]
+        if excluded_types is not None:
+            return label not in excluded_types
+        return True
+
+    def _modifies(self, modifier, target):
+        """Equivalent to TagObject.modifies."""
+        start, end, label = target
+        if modifier.start < end and start < modifier.end:
+            return False
+        if self._rule_directions[modifier.rule_idx] in ("TERMINATE", "PSEUDO"):
+            return False
+        if not self._allows(modifier.rule_idx, label.upper()):
+            return False
+        return (
+            modifier.scope_start <= start < modifier.scope_end
+            or modifier.scope_start <= end - 1 < modifier.scope_end
+        )
+
+    def _reduce_targets(self, modifier, targets):
+        max_targets = self._rule_max_targets[modifier.rule_idx]
+        if max_targets is None or len(modifier.targets) <= max_targets:
+            return
+        target_dists = []
+        for target_idx in modifier.targets:
+            start, end, _ = targets[target_idx]
+            dist = min(abs(modifier.start - end), abs(start - modifier.end))
+            target_dists.append((target_idx, dist))
+        srtd_targets, _ = zip(*sorted(target_dists, key=lambda x: x[1]))
+        modifier.targets = list(srtd_targets[:max_targets])
+
+    def __call__(self, tokens, sent_starts, targets):
+        """Apply ConText to a single pre-tokenized document.
+
+        Args:
+            tokens: A sequence of lowercase token strings, or of integer ids if `strings` was given.
+            sent_starts: A sequence of booleans which are True for the first token of each sentence,
+                or None. If None, the whole document is treated as a single sentence.
+            targets: A sequence of (start, end, label) triples of token offsets.
+
+        Returns:
+            edges: a dict mapping each name in ENGINE_EDGE_COLUMNS to an int64 NumPy array.
+                "target" is an index into targets, "rule" is an index into self.rules
+                and "category_id" is an index into self.categories.
+        """
+        if len(tokens) and not isinstance(tokens[0], str):
+            if self.strings is None:
+                raise ValueError(
+                    "tokens must be strings unless ConTextEngine was created with `strings`."
+                )
+            tokens = [self.strings[token] for token in tokens]
+        num_tokens = len(tokens)
+        targets = [tuple(target) for target in targets]
+
+        # Assign each token to a sentence
+        sent_ids = []
+        sent_bounds = []
+        sent_start = 0
+        for i in range(num_tokens):
+            if i > 0 and sent_starts is not None and sent_starts[i]:
+                sent_bounds.append((sent_start, i))
+                sent_start = i
+            sent_ids.append(len(sent_bounds))
+        sent_bounds.append((sent_start, num_tokens))
+
+        modifiers = self._match(tokens, sent_ids)
+        for modifier in modifiers:
+            self._set_scope(modifier, num_tokens, sent_bounds)
+
+        if self.prune and modifiers:
+            modifiers = self._prune(modifiers)
+        for i in range(len(modifiers) - 1):
+            for j in range(i + 1, len(modifiers)):
+                self._limit_scope(modifiers[i], modifiers[j])
+                self._limit_scope(modifiers[j], modifiers[i])
+
+        if self.remove_overlapping_modifiers:
+            modifiers = [
+                modifier
+                for modifier in modifiers
+                if not any(
+                    (end > modifier.start and end <= modifier.end)
+                    or (start >= modifier.start and start < modifier.end)
+                    for (start, end, _) in targets
+                )
+            ]
+
+        for (target_idx, target) in enumerate(targets):
+            for modifier in modifiers:
+                if self._modifies(modifier, target):
+                    modifier.targets.append(target_idx)
+
+        rows = []
+        for modifier in modifiers:
+            self._reduce_targets(modifier, targets)
+            for target_idx in modifier.targets:
+                rows.append(
+                    (
+                        target_idx,
+                        modifier.start,
+                        modifier.end,
+                        self._rule_category_ids[modifier.rule_idx],
+                        modifier.rule_idx,
+                        modifier.scope_start,
+                        modifier.scope_end,
+                    )
+                )
+        if rows:
+            columns = list(zip(*rows))
+        else:
+            columns = [()] * len(ENGINE_EDGE_COLUMNS)
+        return {
+            name: np.array(values, dtype=np.int64)
+            for (name, values) in zip(ENGINE_EDGE_COLUMNS, columns)
+        }
@@ -0,0 +1,224 @@
+"""Functions for exporting the edges found by ConText for batches of documents
+as column arrays, which can be bulk-loaded into a database or written to Parquet.
+"""
+from itertools import count
+
+import numpy as np
+
+from .context_component import _get_compact_graph
+
+# The columns in each batch, in order
+EDGE_COLUMNS = (
+    "doc_id",
+    "target_start_char",
+    "target_end_char",
+    "target_label",
+    "modifier_start_char",
+    "modifier_end_char",
+    "category",
+    "rule",
+    "scope_start_char",
+    "scope_end_char",
+)
+
+_INT_COLUMNS = {
+    "target_start_char",
+    "target_end_char",
+    "modifier_start_char",
+    "modifier_end_char",
+    "scope_start_char",
+    "scope_end_char",
+}
+
+
+def _char_offset(doc, i):
+    """Return the character offset of the start of token i, or the end of the doc if i == len(doc)."""
+    if i < len(doc):
+        return doc[i].idx
+    return len(doc.text)
+
+
+def _end_char_offset(doc, i):
+    """Return the character offset of the end of the token before token i."""
+    if i == 0:
+        return 0
+    token = doc[i - 1]
+    return token.idx + len(token)
+
+
+def iter_edge_rows(doc, doc_id):
+    """Yield one tuple per edge in a processed Doc with the values of EDGE_COLUMNS.
+
+    If the Doc was processed with `lean` or `serializable`, the rows are read directly from the
+    stored CompactConTextGraph without rebuilding TagObjects.
+
+    Args:
+        doc: A spaCy Doc which has been processed by ConTextComponent.
+        doc_id: The value of the doc_id column for this Doc.
+    """
+    compact_graph = _get_compact_graph(doc)
+    if compact_graph is not None:
+        for (target_idx, modifier_idx) in compact_graph.edges:
+            target_start, target_end, target_label = compact_graph.targets[target_idx]
+            (
+                start,
+                end,
+                category_id,
+                rule_idx,
+                scope_start,
+                scope_end,
+            ) = compact_graph.modifiers[modifier_idx]
+            yield (
+                doc_id,
+                _char_offset(doc, target_start),
+                _end_char_offset(doc, target_end),
+                target_label,
+                _char_offset(doc, start),
+                _end_char_offset(doc, end),
+                compact_graph.categories[category_id],
+                compact_graph.rules[rule_idx].rule,
+                _char_offset(doc, scope_start),
+                _end_char_offset(doc, scope_end),
+            )
+        return
+
+    context_graph = doc._.context_graph
+    if context_graph is None:
+        return
+    for (target, modifier) in context_graph.edges:
+        yield (
+            doc_id,
+            target.start_char,
+            target.end_char,
+            target.label_,
+            modifier.span.start_char,
+            modifier.span.end_char,
+            modifier.category,
+            modifier.rule,
+            _char_offset(doc, modifier._scope_start),
+            _end_char_offset(doc, modifier._scope_end),
+        )
+
+
+def rows_to_columns(rows):
+    """Convert a list of row tuples into a dict mapping each name in EDGE_COLUMNS to a NumPy array.
+    Character offsets are int64 arrays and all other columns are object arrays.
+    """
+    if rows:
+        columns = list(zip(*rows))
+    else:
+        columns = [()] * len(EDGE_COLUMNS)
+    arrays = {}
+    for name, values in zip(EDGE_COLUMNS, columns):
+        if name in _INT_COLUMNS:
+            arrays[name] = np.array(values, dtype=np.int64)
+        else:
+            array = np.empty(len(values), dtype=object)
+            array[:] = values
+            arrays[name] = array
+    return arrays
+
+
+def iter_edge_batches(docs, doc_ids=None, batch_size=100000):
+    """Stream processed Docs into batches of edge columns.
+
+    Args:
+        docs: An iterable of spaCy Docs which have been processed by ConTextComponent.
+        doc_ids: An optional iterable of ids with the same length as docs. If None,
+            the position of each Doc in docs is used.
+        batch_size (int): The maximum number of edges (rows) in each batch. A Doc's edges
+            may be split across two batches.
+
+    Yields:
+        columns: a dict mapping each name in EDGE_COLUMNS to a NumPy array
+    """
+    if batch_size < 1:
+        raise ValueError(
+            "batch_size must be an integer greater than 0, not {0}".format(batch_size)
+        )
+    if doc_ids is None:
+        doc_ids = count()
+    rows = []
+    for doc, doc_id in zip(docs, doc_ids):
+        for row in iter_edge_rows(doc, doc_id):
+            rows.append(row)
+            if len(rows) == batch_size:
+                yield rows_to_columns(rows)
+                rows = []
+    if rows:
+        yield rows_to_columns(rows)
+
+
+def edges_to_arrays(docs, doc_ids=None):
+    """Export the edges of all processed Docs as a single dict of NumPy arrays.
+
+    Args:
+        docs: An iterable of spaCy Docs which have been processed by ConTextComponent.
+        doc_ids: An optional iterable of ids with the same length as docs. If None,
+            the position of each Doc in docs is used.
+
+    Returns:
+        columns: a dict mapping each name in EDGE_COLUMNS to a NumPy array
+    """
+    if doc_ids is None:
+        doc_ids = count()
+    rows = []
+    for doc, doc_id in zip(docs, doc_ids):
+        rows.extend(iter_edge_rows(doc, doc_id))
+    return rows_to_columns(rows)
+
+
+def columns_to_arrow(columns):
+    """Convert a dict of edge columns into a pyarrow Table. Requires pyarrow."""
+    import pyarrow as pa
+
+    arrays = {}
+    for name in EDGE_COLUMNS:
+        if name in _INT_COLUMNS:
+            arrays[name] = pa.array(columns[name], type=pa.int64())
+        elif name == "doc_id":
+            arrays[name] = pa.array(columns[name].tolist())
+        else:
+            arrays[name] = pa.array(columns[name].tolist(), type=pa.string())
+    return pa.Table.from_pydict(arrays)
+
+
+def write_parquet(docs, filepath, doc_ids=None, row_group_size=100000):
+    """Write the edges of processed Docs to a Parquet file, one row group per batch of edges.
+    Requires pyarrow.
+
+    Args:
+        docs: An iterable of spaCy Docs which have been processed by ConTextComponent.
+        filepath: The path of the Parquet file to write.
+        doc_ids: An optional iterable of ids with the same length as docs. If None,
+            the position of each Doc in docs is used.
+        row_group_size (int): The maximum number of edges in each row group.
+
+    Returns:
+        num_rows (int): The number of edges written.
+    """
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError(
+            "Writing Parquet files requires pyarrow. Install it with `pip install pyarrow`."
+        )
+
+    writer = None
+    num_rows = 0
+    try:
+        for columns in iter_edge_batches(
+            docs, doc_ids=doc_ids, batch_size=row_group_size
+        ):
+            table = columns_to_arrow(columns)
+            if writer is None:
+                writer = pq.ParquetWriter(filepath, table.schema)
+            writer.write_table(table)
+            num_rows += table.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        # No edges, but still write an empty file with the expected columns
+        pq.write_table(columns_to_arrow(rows_to_columns([])), filepath)
+    return num_rows
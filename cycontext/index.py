@@ -0,0 +1,387 @@
+"""An on-disk inverted index of the assertions found by ConText across a corpus.
+
+The index maps each (target label or normalized target text, modifier category) to a posting list of
+(doc_id, start_char, end_char) target mentions. Every mention is also posted under the category None,
+so that queries can refer to all mentions of a target. Each call to `AssertionIndex.add` writes a new,
+immutable segment file, so new batches of documents can be appended without rewriting the index.
+
+A segment stores the posting lists of all of its keys as flat arrays of document numbers and character
+offsets, which are memory-mapped when the segment is opened. Only the table of keys and the doc ids of a
+segment are read into memory, and a posting list is only read from the mapped arrays when a query uses it.
+
+Example:
+    >>> index = AssertionIndex("assertions_index")
+    >>> index.add(nlp.pipe(texts), doc_ids=note_ids)
+    >>> query = Term("PNEUMONIA", "NEGATED_EXISTENCE") & ~Term("PNEUMONIA", "HISTORICAL")
+    >>> index.search(query, level="doc")
+"""
+import json
+import mmap
+import os
+from itertools import count
+
+import numpy as np
+
+from .export import iter_edge_rows
+
+MANIFEST_FILENAME = "manifest.json"
+
+MAGIC = b"CYCTXIX1"
+
+# The arrays in a segment, in order. Each posting list is a range of rows of these arrays,
+# where "doc" is the position of the document in the doc ids of the segment.
+_ARRAYS = ("doc", "start", "end")
+
+# The fields of a target which can be indexed
+FIELDS = ("label", "text")
+
+
+def normalize_text(text):
+    """Normalize the text of a target for indexing by lowercasing and collapsing whitespace."""
+    return " ".join(text.lower().split())
+
+
+def _normalize_category(category):
+    if category is None:
+        return None
+    return category.upper()
+
+
+class Query:
+    """A boolean query over an AssertionIndex. Queries are combined with &, | and ~.
+    Each subclass implements `evaluate(index, level)`, which returns a set of (doc_id, start_char, end_char)
+    mentions, or of doc ids if level is "doc".
+    """
+
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+    def __sub__(self, other):
+        return And(self, Not(other))
+
+
+class Term(Query):
+    """Matches the mentions of a target which are modified by a category."""
+
+    def __init__(self, value, category=None, field="label"):
+        """Create a new Term.
+
+        Args:
+            value (str): The target label, or the target text if field is "text".
+            category (str or None): The modifier category, such as "NEGATED_EXISTENCE".
+                If None, matches all mentions of the target.
+            field (str): Either "label" or "text". Default "label".
+        """
+        if field not in FIELDS:
+            raise ValueError(
+                "field must be either 'label' or 'text', not {0}".format(field)
+            )
+        if field == "text":
+            value = normalize_text(value)
+        self.field = field
+        self.value = value
+        self.category = _normalize_category(category)
+
+    def evaluate(self, index, level):
+        postings = index.postings(self.field, self.value, self.category)
+        if level == "doc":
+            return {doc_id for (doc_id, _, _) in postings}
+        return set(postings)
+
+    def __repr__(self):
+        return "Term({0!r}, {1!r}, field={2!r})".format(
+            self.value, self.category, self.field
+        )
+
+
+class And(Query):
+    def __init__(self, *queries):
+        self.queries = queries
+
+    def evaluate(self, index, level):
+        rslt = self.queries[0].evaluate(index, level)
+        for query in self.queries[1:]:
+            rslt &= query.evaluate(index, level)
+        return rslt
+
+    def __repr__(self):
+        return "({0})".format(" & ".join(repr(query) for query in self.queries))
+
+
+class Or(Query):
+    def __init__(self, *queries):
+        self.queries = queries
+
+    def evaluate(self, index, level):
+        rslt = set()
+        for query in self.queries:
+            rslt |= query.evaluate(index, level)
+        return rslt
+
+    def __repr__(self):
+        return "({0})".format(" | ".join(repr(query) for query in self.queries))
+
+
+class Not(Query):
+    """Matches every mention (or document) which is not matched by a query."""
+
+    def __init__(self, query):
+        self.query = query
+
+    def evaluate(self, index, level):
+        return index.universe(level) - self.query.evaluate(index, level)
+
+    def __repr__(self):
+        return "~{0!r}".format(self.query)
+
+
+def iter_postings(doc, doc_id):
+    """Yield (field, value, category, doc_id, start_char, end_char) tuples for each target
+    in a processed Doc. Each target is posted under the category None and under the category
+    of each of its modifiers.
+    """
+    categories = {}
+    for row in iter_edge_rows(doc, doc_id):
+        (_, start_char, end_char, _, _, _, category) = row[:7]
+        categories.setdefault((start_char, end_char), set()).add(
+            _normalize_category(category)
+        )
+    for ent in doc.ents:
+        offsets = (ent.start_char, ent.end_char)
+        for category in [None] + sorted(categories.get(offsets, ())):
+            yield ("label", ent.label_, category, doc_id) + offsets
+            yield ("text", normalize_text(ent.text), category, doc_id) + offsets
+
+
+def write_segment(filepath, doc_ids, postings):
+    """Write a segment file.
+
+    Args:
+        filepath (str): the path of the file to write
+        doc_ids: the list of the JSON-serializable ids of the documents in the segment
+        postings: a dict mapping each (field, value, category) key to a tuple of three lists:
+            the positions of the documents in doc_ids, the start_chars and the end_chars
+    """
+    keys = []
+    columns = ([], [], [])
+    for (key, posting_list) in postings.items():
+        keys.append(list(key) + [len(columns[0]), len(posting_list[0])])
+        for (column, values) in zip(columns, posting_list):
+            column.extend(values)
+    blobs = [np.array(column, dtype=np.int64).tobytes() for column in columns]
+    header = {"doc_ids": list(doc_ids), "keys": keys, "num_postings": len(columns[0])}
+    header_bytes = json.dumps(header).encode("utf-8")
+    # The arrays follow the header, aligned to 8 bytes
+    header_bytes += b" " * (-len(header_bytes) % 8)
+    with open(filepath + ".tmp", "wb") as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(header_bytes)).tobytes())
+        f.write(header_bytes)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(filepath + ".tmp", filepath)
+
+
+class _Segment:
+    """A memory-mapped segment file."""
+
+    def __init__(self, filepath):
+        with open(filepath, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[: len(MAGIC)] != MAGIC:
+            raise ValueError("{0} is not an assertion index segment".format(filepath))
+        header_len = int(np.frombuffer(self._mmap, dtype=np.uint64, count=1, offset=len(MAGIC))[0])
+        data_start = len(MAGIC) + 8 + header_len
+        header = json.loads(bytes(self._mmap[len(MAGIC) + 8 : data_start]).decode("utf-8"))
+        self.doc_ids = header["doc_ids"]
+        self.keys = {
+            (field, value, category): (offset, length)
+            for (field, value, category, offset, length) in header["keys"]
+        }
+        num_postings = header["num_postings"]
+        self.arrays = [
+            np.frombuffer(
+                self._mmap, dtype=np.int64, count=num_postings, offset=data_start + 8 * num_postings * i
+            )
+            for i in range(len(_ARRAYS))
+        ]
+
+    def postings(self, key):
+        """Returns the list of (doc_id, start_char, end_char) mentions for a key."""
+        location = self.keys.get(key)
+        if location is None:
+            return []
+        (offset, length) = location
+        (docs, starts, ends) = (
+            array[offset : offset + length].tolist() for array in self.arrays
+        )
+        doc_ids = self.doc_ids
+        return [(doc_ids[doc], start, end) for (doc, start, end) in zip(docs, starts, ends)]
+
+    def close(self):
+        self.arrays = None
+        self._mmap.close()
+
+
+class AssertionIndex:
+    """An inverted index of ConText assertions stored in a directory of segment files."""
+
+    def __init__(self, directory):
+        """Open an AssertionIndex, creating the directory if it doesn't exist.
+
+        Args:
+            directory (str): The directory which contains the index.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        manifest_path = os.path.join(directory, MANIFEST_FILENAME)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {"segments": [], "num_docs": 0}
+        # The segments which have been opened, in the order of the manifest
+        self._segments = []
+
+    @property
+    def segments(self):
+        """Returns the list of segment filenames."""
+        return list(self.manifest["segments"])
+
+    @property
+    def num_docs(self):
+        """Returns the number of documents which have been added."""
+        return self.manifest["num_docs"]
+
+    def _write_manifest(self):
+        manifest_path = os.path.join(self.directory, MANIFEST_FILENAME)
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f)
+        # Replace the manifest atomically so that readers never see a partial write
+        os.replace(tmp_path, manifest_path)
+
+    def add(self, docs, doc_ids=None):
+        """Index a batch of processed Docs as a new segment.
+
+        Args:
+            docs: An iterable of spaCy Docs which have been processed by ConTextComponent.
+            doc_ids: An optional iterable of ids with the same length as docs. The ids must be
+                JSON-serializable and unique across the index. If None, the ids continue from
+                the number of documents already in the index.
+
+        Returns:
+            segment (str): the filename of the new segment, or None if docs was empty.
+        """
+        if doc_ids is None:
+            doc_ids = count(self.num_docs)
+        segment_doc_ids = []
+        postings = {}
+        for doc, doc_id in zip(docs, doc_ids):
+            position = len(segment_doc_ids)
+            segment_doc_ids.append(doc_id)
+            for (field, value, category, _, start_char, end_char) in iter_postings(
+                doc, doc_id
+            ):
+                posting_list = postings.setdefault((field, value, category), ([], [], []))
+                posting_list[0].append(position)
+                posting_list[1].append(start_char)
+                posting_list[2].append(end_char)
+        if not segment_doc_ids:
+            return None
+
+        segment = "segment-{0:06d}.idx".format(len(self.manifest["segments"]))
+        write_segment(os.path.join(self.directory, segment), segment_doc_ids, postings)
+
+        self.manifest["segments"].append(segment)
+        self.manifest["num_docs"] += len(segment_doc_ids)
+        self._write_manifest()
+        return segment
+
+    def _open_segments(self):
+        """Map any segments which have not been opened yet. Returns the list of open segments."""
+        for segment in self.manifest["segments"][len(self._segments) :]:
+            self._segments.append(_Segment(os.path.join(self.directory, segment)))
+        return self._segments
+
+    def _doc_order(self):
+        """Returns a dict mapping each doc id to its position in the order the documents were added."""
+        order = {}
+        for segment in self._open_segments():
+            for doc_id in segment.doc_ids:
+                order[doc_id] = len(order)
+        return order
+
+    def reload(self):
+        """Re-read the manifest to pick up segments added by another AssertionIndex."""
+        with open(os.path.join(self.directory, MANIFEST_FILENAME)) as f:
+            self.manifest = json.load(f)
+
+    def postings(self, field, value, category=None):
+        """Returns the list of (doc_id, start_char, end_char) mentions for a key.
+
+        Args:
+            field (str): Either "label" or "text".
+            value (str): The target label or normalized target text.
+            category (str or None): The modifier category, or None for all mentions.
+        """
+        key = (field, value, _normalize_category(category))
+        rslt = []
+        for segment in self._open_segments():
+            rslt += segment.postings(key)
+        return rslt
+
+    def universe(self, level):
+        """Returns the set of all mentions, or of all doc ids if level is "doc"."""
+        segments = self._open_segments()
+        rslt = set()
+        for segment in segments:
+            if level == "doc":
+                rslt.update(segment.doc_ids)
+                continue
+            for key in segment.keys:
+                if key[0] == "label" and key[2] is None:
+                    rslt.update(segment.postings(key))
+        return rslt
+
+    def search(self, query, level="mention"):
+        """Evaluate a boolean query.
+
+        Args:
+            query: A Query, such as `Term("PNEUMONIA", "NEGATED_EXISTENCE") & ~Term("PNEUMONIA", "HISTORICAL")`.
+            level (str): If "mention", each term is evaluated as a set of target mentions, so that all terms
+                must hold for the same mention. If "doc", each term is evaluated as a set of doc ids.
+
+        Returns:
+            results: a list of (doc_id, start_char, end_char) tuples if level is "mention",
+                or a list of doc ids if level is "doc", in the order the documents were added.
+        """
+        if level not in ("mention", "doc"):
+            raise ValueError(
+                "level must be either 'mention' or 'doc', not {0}".format(level)
+            )
+        rslt = query.evaluate(self, level)
+        order = self._doc_order()
+        if level == "doc":
+            return sorted(rslt, key=lambda doc_id: order[doc_id])
+        return sorted(rslt, key=lambda mention: (order[mention[0]],) + mention[1:])
+
+    def close(self):
+        """Unmap the open segments. They are mapped again if the index is searched."""
+        for segment in self._segments:
+            segment.close()
+        self._segments = []
+
+    def __len__(self):
+        return self.num_docs
+
+    def __repr__(self):
+        return "<AssertionIndex> of {0} documents in {1} segments".format(
+            self.num_docs, len(self.manifest["segments"])
+        )
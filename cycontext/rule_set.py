@@ -0,0 +1,727 @@
+"""The compiled form of a list of ConTextItems used by ConTextComponent."""
+import copy
+import heapq
+import re
+import threading
+import warnings
+from types import MappingProxyType
+
+import numpy as np
+from spacy.attrs import FLAG19, FLAG63, LOWER
+from spacy.errors import MatchPatternError
+from spacy.matcher import Matcher, PhraseMatcher
+from spacy.matcher._schemas import TOKEN_PATTERN_SCHEMA
+from spacy.util import get_json_validator, validate_json
+
+from .analysis import analyze_rules, overlap_table, suppress_submatches
+
+
+class _RuleGroup:
+    """The ConTextItems which share the same allowed_types and excluded_types,
+    with their own spaCy matchers.
+    """
+
+    def __init__(self, allowed_types, excluded_types):
+        self.allowed_types = allowed_types
+        self.excluded_types = excluded_types
+        self.indices = []
+        self.phrase_matcher = None
+        self.matcher = None
+        self.has_terminate = False
+        self.categories = set()
+        self.terminated_by = set()
+
+    def allows_any(self, labels):
+        """Returns True if a rule in this group can modify a target with one of the labels."""
+        for label in labels:
+            label = label.upper()
+            if self.allowed_types is not None:
+                if label in self.allowed_types:
+                    return True
+            elif self.excluded_types is None or label not in self.excluded_types:
+                return True
+        return False
+
+
+_PATTERN_VALIDATOR = get_json_validator(TOKEN_PATTERN_SCHEMA)
+
+# The lexeme attributes whose REGEX predicates can be replaced by a lexeme flag
+_REGEX_FLAG_ATTRS = ("LOWER", "ORTH", "TEXT")
+
+# The lexeme flag ids which spaCy leaves free for custom flags. The lower ids belong to built-in
+# attributes, some of which, like IS_OOV_DEPRECATED, have no getter and would be overwritten.
+_CUSTOM_FLAG_IDS = range(FLAG19, FLAG63 + 1)
+
+
+class RegexFlag:
+    """A lexeme flag getter which evaluates a regular expression on the text or lowercase text of a lexeme.
+    Registered with `Vocab.add_flag`, it is evaluated once for each lexeme in the vocabulary
+    and then for each new lexeme as it is added.
+    """
+
+    def __init__(self, attr, regex, lower=None):
+        self.attr = attr
+        self.regex = regex
+        self.lower = lower
+        self._compiled = re.compile(regex)
+
+    def __call__(self, string):
+        if self.attr == "LOWER":
+            string = self.lower(string) if self.lower is not None else string.lower()
+        return self._compiled.search(string) is not None
+
+    def __reduce__(self):
+        return (RegexFlag, (self.attr, self.regex, self.lower))
+
+
+def get_regex_flag(vocab, attr, regex):
+    """Returns the id of a lexeme flag which is True for lexemes whose attr matches regex,
+    adding it to the vocab if needed. New flags use the first id from FLAG19 to FLAG63 which
+    has no getter in the vocab.
+
+    Raises:
+        ValueError: if all of the custom flag ids are in use.
+    """
+    for (flag_id, getter) in vocab.lex_attr_getters.items():
+        if isinstance(getter, RegexFlag) and (getter.attr, getter.regex) == (attr, regex):
+            return flag_id
+    for flag_id in _CUSTOM_FLAG_IDS:
+        if flag_id not in vocab.lex_attr_getters:
+            return vocab.add_flag(
+                RegexFlag(attr, regex, vocab.lex_attr_getters.get(LOWER)), flag_id=flag_id
+            )
+    raise ValueError(
+        "Cannot add a lexeme flag for the regular expression {0!r}: the custom flag ids "
+        "FLAG19 to FLAG63 are all in use.".format(regex)
+    )
+
+
+def compile_regex_predicates(pattern, vocab):
+    """Replace the REGEX predicates on LOWER, ORTH and TEXT in a token pattern with lexeme flags,
+    so that each regular expression is run once per lexeme instead of once per token.
+    Predicates which can't be replaced are left unchanged, with a warning if there are no free flag ids.
+
+    Args:
+        pattern: a list of token pattern dicts
+        vocab: a spaCy Vocab
+
+    Returns:
+        pattern: a new list of token pattern dicts
+    """
+    compiled = []
+    for token_pattern in pattern:
+        new_token_pattern = {}
+        for (attr, value) in token_pattern.items():
+            if (
+                isinstance(attr, str)
+                and attr.upper() in _REGEX_FLAG_ATTRS
+                and isinstance(value, dict)
+                and set(value.keys()) == {"REGEX"}
+            ):
+                name = "ORTH" if attr.upper() == "TEXT" else attr.upper()
+                try:
+                    flag_id = get_regex_flag(vocab, name, value["REGEX"])
+                except ValueError as err:
+                    warnings.warn(
+                        "{0} The REGEX predicate is evaluated for each token instead.".format(err),
+                        RuntimeWarning,
+                    )
+                else:
+                    new_token_pattern[flag_id] = True
+                    continue
+            new_token_pattern[attr] = value
+        compiled.append(new_token_pattern)
+    return compiled
+
+
+# The attributes whose values can be used as triggers: a token matches one of them only if its
+# lowercase text matches the lowercased value
+_TRIGGER_ATTRS = ("LOWER", "ORTH", "TEXT")
+
+# The number of bits of a lexeme hash used to index the trigger bitmap
+_TRIGGER_BITMAP_BITS = 16
+
+
+class TriggerFilter:
+    """A prefilter built from a rule set, which finds the tokens of a Doc where a match can occur.
+
+    Each rule is given a trigger set: the lowercase strings which one of the tokens it always consumes
+    must match. For literals this is the longest token which is not a stop word, and for patterns it is
+    the smallest finite set of a required token. A match of a rule always contains a token in its
+    trigger set, so a Doc or a region of a Doc without any triggers can't contain any matches.
+    Tokens are first checked against a bitmap indexed by the low bits of their lexeme hash and
+    the candidates are then checked exactly.
+    """
+
+    def __init__(self, triggers, max_length, complete=True):
+        """Create a new TriggerFilter.
+
+        Args:
+            triggers: an iterable of the hashes of the lowercase trigger strings
+            max_length (int or None): the maximum number of tokens in a match of any rule,
+                or None if some rule can match sequences of any length or has an on_match callback.
+            complete (bool): False if some rule has no trigger set, in which case every Doc can match.
+        """
+        self.triggers = np.unique(np.array(list(triggers), dtype=np.uint64))
+        self.bitmap = np.zeros(1 << _TRIGGER_BITMAP_BITS, dtype=np.bool_)
+        self.bitmap[self.triggers & np.uint64((1 << _TRIGGER_BITMAP_BITS) - 1)] = True
+        self.max_length = max_length
+        self.complete = complete
+
+    def trigger_positions(self, doc):
+        """Returns an array of the indices of the tokens in doc which are triggers."""
+        hashes = doc.to_array(LOWER).astype(np.uint64)
+        candidates = np.nonzero(
+            self.bitmap[hashes & np.uint64((1 << _TRIGGER_BITMAP_BITS) - 1)]
+        )[0]
+        return candidates[np.isin(hashes[candidates], self.triggers)]
+
+    def windows(self, doc):
+        """Returns a list of the disjoint (start, end) token windows which contain every match in doc,
+        an empty list if doc can't contain any matches, or None if no window can be excluded.
+        """
+        if not self.complete:
+            return None
+        positions = self.trigger_positions(doc)
+        if len(positions) == 0:
+            return []
+        if self.max_length is None:
+            return [(0, len(doc))]
+        windows = []
+        for position in positions.tolist():
+            start = max(0, position - self.max_length + 1)
+            end = min(len(doc), position + self.max_length)
+            if windows and start <= windows[-1][1]:
+                windows[-1] = (windows[-1][0], end)
+            else:
+                windows.append((start, end))
+        return windows
+
+
+def _trigger_set(token_pattern):
+    """Returns the set of lowercase strings which a token pattern must match, or None if it isn't finite."""
+    for (attr, value) in token_pattern.items():
+        if not isinstance(attr, str) or attr.upper() not in _TRIGGER_ATTRS:
+            continue
+        if isinstance(value, str):
+            return {value.lower()}
+        if isinstance(value, dict) and set(value.keys()) == {"IN"}:
+            return {val.lower() for val in value["IN"]}
+    return None
+
+
+def build_trigger_filter(item_data, nlp, phrase_matcher_attr="LOWER"):
+    """Build a TriggerFilter from a list of ConTextItems.
+
+    Args:
+        item_data: a list of ConTextItems
+        nlp: the spaCy model whose tokenizer splits the literals
+        phrase_matcher_attr: the attribute which literals are matched on. Literals can only be used as
+            triggers if it is LOWER, ORTH or TEXT.
+
+    Returns:
+        trigger_filter: a TriggerFilter
+    """
+    triggers = set()
+    max_length = 0
+    complete = True
+    for item in item_data:
+        if item.pattern is None:
+            tokens = list(nlp.make_doc(item.literal))
+            length = len(tokens)
+            best = None
+            if phrase_matcher_attr.upper() in _TRIGGER_ATTRS and tokens:
+                # Every token of a literal is required, so use the one which is likely to be rarest
+                trigger = max(tokens, key=lambda token: (not token.is_stop, len(token)))
+                best = {trigger.lower_}
+        else:
+            best = None
+            length = 0
+            for token_pattern in item.pattern:
+                op = token_pattern.get("OP")
+                if op in ("*", "+"):
+                    length = None
+                elif length is not None:
+                    length += 1
+                if op in (None, "+"):
+                    token_triggers = _trigger_set(token_pattern)
+                    if token_triggers is not None and (
+                        best is None
+                        or len(token_triggers) < len(best)
+                        or (
+                            len(token_triggers) == len(best)
+                            and not nlp.vocab[min(token_triggers)].is_stop
+                        )
+                    ):
+                        best = token_triggers
+        if item.on_match is not None:
+            # Callbacks must be passed the whole Doc and all of its matches, so no window can be excluded
+            length = None
+        if max_length is not None:
+            max_length = None if length is None else max(max_length, length)
+        if best is None:
+            complete = False
+        else:
+            triggers.update(best)
+    strings = nlp.vocab.strings
+    return TriggerFilter(
+        [strings.add(trigger) for trigger in triggers], max_length, complete
+    )
+
+
+# Windows are only matched separately if they cover less than this fraction of a Doc,
+# since each call to a Matcher has a fixed cost
+_MAX_WINDOW_COVERAGE = 0.5
+
+
+def _run_matcher(matcher, doc, windows):
+    """Run a Matcher over the whole doc, or only over a list of (start, end) windows."""
+    if windows is None:
+        return matcher(doc)
+    if sum(end - start for (start, end) in windows) >= _MAX_WINDOW_COVERAGE * len(doc):
+        return matcher(doc)
+    matches = []
+    for (start, end) in windows:
+        for (match_id, match_start, match_end) in matcher(doc[start:end]):
+            matches.append((match_id, match_start + start, match_end + start))
+    return matches
+
+
+# The maximum number of target label sets whose rule groups are cached
+_MAX_CACHED_LABEL_SETS = 1024
+
+
+class ConTextRuleSet:
+    """A version of the compiled rules of a ConTextComponent: the ConTextItems, the spaCy matchers
+    and the mappings between them.
+
+    Each ConTextItem is given a stable integer rule id which does not change when other rules are
+    added or removed. The id is also used as the matcher key, and ids of removed rules are reused,
+    so the keys added to the shared StringStore do not grow with each update.
+
+    ConTextComponent reads its rule set once for each Doc, so replacing the component's rule set
+    with a new version is atomic for Docs which are being processed.
+    """
+
+    def __init__(self, nlp, phrase_matcher_attr="LOWER", version=0):
+        """Create a new, empty ConTextRuleSet.
+
+        Args:
+            nlp: a spaCy NLP model
+            phrase_matcher_attr: The token attribute to be used by the underlying PhraseMatcher.
+            version (int): A number identifying this version of the rules.
+        """
+        self.nlp = nlp
+        self.phrase_matcher_attr = phrase_matcher_attr
+        self.version = version
+        self.phrase_matcher = PhraseMatcher(
+            nlp.vocab, attr=phrase_matcher_attr, validate=True
+        )  # TODO: match on custom attributes
+        # Patterns are validated in _compile_pattern, since patterns with flags can't be validated by spaCy
+        self.matcher = Matcher(nlp.vocab)
+
+        # item_data and rule_ids are aligned lists. They are replaced rather than modified
+        # when a rule is removed so that earlier references (ie., in a CompactConTextGraph) stay valid.
+        self.item_data = []
+        self.rule_ids = []
+        self.categories = set()
+        # rule_set_names: The name of the rule set of each ConTextItem, aligned with item_data,
+        # or None for the main rules. rule_set_list: The names of the rule sets in the order they were added.
+        self.rule_set_names = []
+        self.rule_set_list = []
+
+        # modifier_item_mapping: A mapping from spaCy Matcher match_ids to ConTextItem
+        # This allows us to use spaCy Matchers while still linking back to the ConTextItem
+        # To get the rule and category
+        self.modifier_item_mapping = dict()
+        # rule_indices and category_ids: Mappings from the id() of each ConTextItem to its index
+        # in item_data and from each category to its index in category_list.
+        self.rule_indices = dict()
+        self.category_list = []
+        self.category_ids = dict()
+
+        self._next_rule_id = 0
+        self._free_rule_ids = []
+        # Computed from item_data when first needed and reset whenever the rules change
+        self._suppression_table = None
+        self._label_partition = None
+        self._trigger_filter = None
+        # Guards the label partition and its cache, which are built lazily and can be used by many threads
+        self._label_lock = threading.Lock()
+        # revision: Incremented each time a rule is added, removed or replaced
+        self.revision = 0
+        self.frozen = False
+
+    def _check_not_frozen(self):
+        if self.frozen:
+            raise RuntimeError(
+                "Cannot modify the rules because they have been frozen."
+            )
+
+    def _allocate_rule_id(self):
+        if self._free_rule_ids:
+            return heapq.heappop(self._free_rule_ids)
+        rule_id = self._next_rule_id
+        self._next_rule_id += 1
+        return rule_id
+
+    def _match_key(self, rule_id):
+        return str(rule_id)
+
+    def _compile_pattern(self, key, pattern):
+        """Validate a token pattern and replace its REGEX predicates with lexeme flags.
+
+        Raises:
+            MatchPatternError: if the pattern is invalid.
+        """
+        errors = validate_json(pattern, _PATTERN_VALIDATOR)
+        if errors:
+            raise MatchPatternError(key, {0: errors})
+        return compile_regex_predicates(pattern, self.nlp.vocab)
+
+    def _add_to_matcher(self, rule_id, item):
+        key = self._match_key(rule_id)
+        # If no pattern is defined,
+        # match on the literal phrase.
+        if item.pattern is None:
+            self.phrase_matcher.add(
+                key, [self.nlp.make_doc(item.literal)], on_match=item.on_match,
+            )
+        else:
+            self.matcher.add(
+                key, [self._compile_pattern(key, item.pattern)], on_match=item.on_match
+            )
+        # The match_id is the hash which we'll use to retrieve the ConTextItem from a spaCy match
+        self.modifier_item_mapping[self.nlp.vocab.strings[key]] = item
+
+    def _remove_from_matcher(self, rule_id, item):
+        key = self._match_key(rule_id)
+        if item.pattern is None:
+            self.phrase_matcher.remove(key)
+        else:
+            self.matcher.remove(key)
+        self.modifier_item_mapping.pop(self.nlp.vocab.strings[key], None)
+
+    def _add_category(self, category):
+        self.categories.add(category)
+        if category not in self.category_ids:
+            self.category_ids[category] = len(self.category_list)
+            self.category_list.append(category)
+
+    def _index(self, rule_id):
+        try:
+            return self.rule_ids.index(rule_id)
+        except ValueError:
+            raise KeyError("No ConTextItem with rule id {0}".format(rule_id))
+
+    def add(self, item_data, rule_set=None):
+        """Add a list of ConTextItems.
+
+        Args:
+            item_data: a list of ConTextItems
+            rule_set (str or None): The name of the rule set which the ConTextItems belong to,
+                or None for the main rules. Rules in different rule sets are matched together,
+                but never suppress each other's matches.
+
+        Returns:
+            rule_ids: a list of the rule ids assigned to each ConTextItem
+        """
+        self._check_not_frozen()
+        if rule_set is not None and rule_set not in self.rule_set_list:
+            self.rule_set_list.append(rule_set)
+        rule_ids = []
+        for item in item_data:
+            rule_id = self._allocate_rule_id()
+            self._add_to_matcher(rule_id, item)
+            self.rule_indices[id(item)] = len(self.item_data)
+            self.item_data.append(item)
+            self.rule_ids.append(rule_id)
+            self.rule_set_names.append(rule_set)
+            self._add_category(item.category)
+            rule_ids.append(rule_id)
+        self._suppression_table = None
+        self._label_partition = None
+        self._trigger_filter = None
+        self.revision += 1
+        return rule_ids
+
+    def remove(self, rule_id):
+        """Remove the ConTextItem with a rule id. Only the matcher entry for this rule is updated.
+
+        Args:
+            rule_id (int): The id of the rule to remove.
+
+        Returns:
+            item: the removed ConTextItem
+
+        Raises:
+            KeyError: if there is no rule with this id.
+        """
+        self._check_not_frozen()
+        idx = self._index(rule_id)
+        item = self.item_data[idx]
+        self._remove_from_matcher(rule_id, item)
+        self.item_data = self.item_data[:idx] + self.item_data[idx + 1 :]
+        self.rule_ids = self.rule_ids[:idx] + self.rule_ids[idx + 1 :]
+        self.rule_set_names = self.rule_set_names[:idx] + self.rule_set_names[idx + 1 :]
+        self.rule_indices = {id(other): i for (i, other) in enumerate(self.item_data)}
+        self.categories = {other.category for other in self.item_data}
+        heapq.heappush(self._free_rule_ids, rule_id)
+        self._suppression_table = None
+        self._label_partition = None
+        self._trigger_filter = None
+        self.revision += 1
+        return item
+
+    def replace(self, rule_id, item):
+        """Replace the ConTextItem with a rule id by a new ConTextItem which keeps the same id.
+        Only the matcher entry for this rule is updated.
+
+        Args:
+            rule_id (int): The id of the rule to replace.
+            item: the new ConTextItem
+
+        Returns:
+            old_item: the replaced ConTextItem
+
+        Raises:
+            KeyError: if there is no rule with this id.
+        """
+        self._check_not_frozen()
+        idx = self._index(rule_id)
+        old_item = self.item_data[idx]
+        self._remove_from_matcher(rule_id, old_item)
+        self._add_to_matcher(rule_id, item)
+        self.item_data = self.item_data[:idx] + [item] + self.item_data[idx + 1 :]
+        self.rule_indices = {id(other): i for (i, other) in enumerate(self.item_data)}
+        self.categories = {other.category for other in self.item_data}
+        self._add_category(item.category)
+        self._suppression_table = None
+        self._label_partition = None
+        self._trigger_filter = None
+        self.revision += 1
+        return old_item
+
+    def get(self, rule_id):
+        """Returns the ConTextItem with a rule id.
+
+        Raises:
+            KeyError: if there is no rule with this id.
+        """
+        return self.item_data[self._index(rule_id)]
+
+    @property
+    def suppression_table(self):
+        """A dict mapping each ConTextItem to a frozenset of the shorter ConTextItems
+        in the same rule set which can match inside it. See `cycontext.analysis.analyze_rules`.
+        """
+        if self._suppression_table is None:
+            item_data = self.item_data
+            names = self.rule_set_names
+            analysis = analyze_rules(item_data, self.nlp)
+            self._suppression_table = {}
+            for (key, value) in analysis.suppression_table.items():
+                contained = frozenset(
+                    item_data[i] for i in value if names[i] == names[key]
+                )
+                if contained:
+                    self._suppression_table[item_data[key]] = contained
+        return self._suppression_table
+
+    @property
+    def trigger_filter(self):
+        """A TriggerFilter of the tokens which can start or anchor a match of any rule."""
+        if self._trigger_filter is None:
+            self._trigger_filter = build_trigger_filter(
+                self.item_data, self.nlp, self.phrase_matcher_attr
+            )
+        return self._trigger_filter
+
+    def _build_label_partition(self):
+        """Group the rules by the target labels they can modify and build a pair of matchers for each group."""
+        groups = {}
+        for (i, item) in enumerate(self.item_data):
+            key = (
+                None if item.allowed_types is None else frozenset(item.allowed_types),
+                None if item.excluded_types is None else frozenset(item.excluded_types),
+            )
+            if key not in groups:
+                groups[key] = _RuleGroup(*key)
+            group = groups[key]
+            group.indices.append(i)
+            group.has_terminate = group.has_terminate or item.rule.upper() == "TERMINATE"
+            group.categories.add(item.category.upper())
+            group.terminated_by.update(item.terminated_by)
+        groups = list(groups.values())
+
+        group_of_rule = {}
+        for (group_idx, group) in enumerate(groups):
+            group.phrase_matcher = PhraseMatcher(
+                self.nlp.vocab, attr=self.phrase_matcher_attr
+            )
+            group.matcher = Matcher(self.nlp.vocab)
+            for i in group.indices:
+                group_of_rule[i] = group_idx
+                item = self.item_data[i]
+                key = self._match_key(self.rule_ids[i])
+                if item.pattern is None:
+                    group.phrase_matcher.add(
+                        key, [self.nlp.make_doc(item.literal)], on_match=item.on_match
+                    )
+                else:
+                    group.matcher.add(
+                        key,
+                        [self._compile_pattern(key, item.pattern)],
+                        on_match=item.on_match,
+                    )
+
+        # Groups which can overlap each other, and so can change each other's modifiers when pruning
+        overlapping = [set() for _ in groups]
+        for (i, others) in overlap_table(self.item_data, self.nlp).items():
+            for j in others:
+                if group_of_rule[i] != group_of_rule[j]:
+                    overlapping[group_of_rule[i]].add(group_of_rule[j])
+        return {"groups": groups, "overlapping": overlapping, "cache": {}}
+
+    def _groups_for_labels(self, labels):
+        """Returns the rule groups which are needed to find the edges of targets with these labels."""
+        with self._label_lock:
+            if self._label_partition is None:
+                self._label_partition = self._build_label_partition()
+            partition = self._label_partition
+            rslt = partition["cache"].get(labels)
+        if rslt is not None:
+            return rslt
+
+        groups = partition["groups"]
+        kept = {i for (i, group) in enumerate(groups) if group.allows_any(labels)}
+        if kept:
+            # Terminating rules can limit the scope of any modifier
+            kept.update(i for (i, group) in enumerate(groups) if group.has_terminate)
+        while True:
+            terminated_by = set()
+            for i in kept:
+                terminated_by.update(groups[i].terminated_by)
+            added = set()
+            for (i, group) in enumerate(groups):
+                if i in kept:
+                    continue
+                if partition["overlapping"][i] & kept or group.categories & terminated_by:
+                    added.add(i)
+            if not added:
+                break
+            kept.update(added)
+
+        rslt = tuple(groups[i] for i in sorted(kept))
+        with self._label_lock:
+            cache = partition["cache"]
+            if len(cache) >= _MAX_CACHED_LABEL_SETS:
+                cache.clear()
+            cache[labels] = rslt
+        return rslt
+
+    def analyze(self):
+        """Find overlapping and duplicate rules. Returns a cycontext.analysis.RuleAnalysis."""
+        return analyze_rules(self.item_data, self.nlp)
+
+    def match(self, doc, suppress_subsumed=False, labels=None, prefilter=False):
+        """Find all modifiers in a Doc.
+
+        Args:
+            doc: a spaCy Doc
+            suppress_subsumed (bool): Whether to drop matches which lie inside a longer match
+                and which would always be removed by ConTextGraph.prune_modifiers.
+                Only use this if the modifiers will be pruned. Default False.
+            labels (frozenset or None): If not None, only run the rules which can change the edges of
+                targets with these labels: the rules which can modify one of the labels, and the rules
+                which can terminate or overlap them. If empty, no rules are run.
+            prefilter (bool): Whether to check the Doc against the trigger_filter first. If the Doc contains
+                no triggers, no rules are run, and otherwise the token patterns are only run over
+                the windows around the triggers. Default False.
+
+        Returns:
+            matches: a list of (ConTextItem, start, end) tuples sorted by start
+        """
+        windows = None
+        if prefilter:
+            windows = self.trigger_filter.windows(doc)
+            if windows == []:
+                return []
+
+        if labels is None:
+            matches = self.phrase_matcher(doc)
+            matches += _run_matcher(self.matcher, doc, windows)
+        else:
+            groups = self._groups_for_labels(labels)
+            matches = []
+            for group in groups:
+                matches += group.phrase_matcher(doc)
+            for group in groups:
+                matches += _run_matcher(group.matcher, doc, windows)
+
+        # Sort matches
+        matches = sorted(matches, key=lambda x: x[1])
+        rslt = []
+        for (match_id, start, end) in matches:
+            # Get the ConTextItem object defining this modifier.
+            # A rule may have been removed while this Doc was being matched.
+            item = self.modifier_item_mapping.get(match_id)
+            if item is not None:
+                rslt.append((item, start, end))
+        if suppress_subsumed and len(rslt) > 1:
+            group = None
+            if self.rule_set_list:
+                group = lambda item: self.rule_set_names[self.rule_indices[id(item)]]
+            rslt = suppress_submatches(rslt, self.suppression_table, group)
+        return rslt
+
+    def freeze(self):
+        """Make the rule set immutable so that it can be safely read from many threads.
+        The ConTextItems are replaced with frozen copies, so the items which were added are not frozen
+        and can still be changed or added to another component, and the internal tables are replaced
+        with read-only versions. The label partition used by `match` with labels is still built
+        when first needed, under a lock.
+        """
+        if self.frozen:
+            return
+        frozen_items = {}
+        for item in self.item_data:
+            frozen_item = item
+            if not item.frozen:
+                frozen_item = copy.copy(item)
+                frozen_item.freeze()
+            frozen_items[id(item)] = frozen_item
+        self.item_data = tuple(frozen_items[id(item)] for item in self.item_data)
+        self.rule_ids = tuple(self.rule_ids)
+        self.rule_set_names = tuple(self.rule_set_names)
+        self.rule_set_list = tuple(self.rule_set_list)
+        self.categories = frozenset(self.categories)
+        self.category_list = tuple(self.category_list)
+        self.modifier_item_mapping = MappingProxyType(
+            {
+                match_id: frozen_items[id(item)]
+                for (match_id, item) in self.modifier_item_mapping.items()
+            }
+        )
+        self.rule_indices = MappingProxyType(
+            {id(item): i for (i, item) in enumerate(self.item_data)}
+        )
+        self.category_ids = MappingProxyType(self.category_ids)
+        # The tables which refer to the items are rebuilt from the frozen copies
+        self._suppression_table = None
+        self._suppression_table = MappingProxyType(self.suppression_table)
+        self._label_partition = None
+        # Build the trigger filter now so that threads don't build it at the same time
+        self._trigger_filter = None
+        self.trigger_filter
+        # Results cached for the previous items, such as a Doc's cached modifiers, are no longer valid
+        self.revision += 1
+        self.frozen = True
+
+    def __len__(self):
+        return len(self.item_data)
+
+    def __repr__(self):
+        return "<ConTextRuleSet> version {0} with {1} rules".format(
+            self.version, len(self.item_data)
+        )
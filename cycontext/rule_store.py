@@ -0,0 +1,372 @@
+"""A read-only, memory-mapped file of compiled ConText rules which can be shared by many worker processes.
+
+`write_rule_store` compiles the literal rules of a ConTextRuleSet into a trie over token attribute hashes,
+stored as flat arrays, along with the serialized ConTextItems and the suppression table. `MappedRuleSet`
+maps the file with mmap and matches directly against the mapped arrays, so the operating system keeps a single
+copy of the rules in memory no matter how many processes map the file. ConTextItems are only created when a
+rule first matches. The rules which use token patterns are compiled into a spaCy Matcher by each process.
+
+Example:
+    >>> context.export_rules("rules.ctx")
+    >>> # in each worker
+    >>> context = ConTextComponent(nlp, rules=None)
+    >>> context.load_rule_store("rules.ctx")
+"""
+import json
+import mmap
+import warnings
+from types import MappingProxyType
+
+import numpy as np
+from spacy.attrs import IDS
+from spacy.matcher import Matcher
+
+from .analysis import suppress_submatches
+from .compact_graph import _item_to_dict
+from .context_item import ConTextItem
+from .rule_set import compile_regex_predicates
+
+MAGIC = b"CYCTXRS1"
+
+# The arrays in a rule store, in order
+_ARRAYS = (
+    ("child_start", np.int64),
+    ("child_hash", np.uint64),
+    ("child_node", np.int64),
+    ("term_start", np.int64),
+    ("term_rule", np.int64),
+    ("item_offset", np.int64),
+    ("suppress_start", np.int64),
+    ("suppress_rule", np.int64),
+)
+
+
+def _to_dict(item):
+    if item.on_match is not None or item.on_modifies is not None:
+        raise ValueError(
+            "ConTextItems with on_match or on_modifies callbacks can't be written to a rule store: {0}".format(
+                item
+            )
+        )
+    return _item_to_dict(item)
+
+
+def _build_trie(sequences):
+    """Build a trie of hash sequences as flat CSR arrays.
+
+    Args:
+        sequences: a list of (rule_index, hashes) tuples
+
+    Returns:
+        arrays: a dict with the child_start, child_hash, child_node, term_start and term_rule arrays
+    """
+    children = [{}]
+    terms = [[]]
+    for (rule_idx, hashes) in sequences:
+        node = 0
+        for hash_ in hashes:
+            child = children[node].get(hash_)
+            if child is None:
+                child = len(children)
+                children[node][hash_] = child
+                children.append({})
+                terms.append([])
+            node = child
+        terms[node].append(rule_idx)
+
+    child_start = [0]
+    child_hash = []
+    child_node = []
+    term_start = [0]
+    term_rule = []
+    for node in range(len(children)):
+        # Children are sorted by hash so they can be found with a binary search
+        for (hash_, child) in sorted(children[node].items()):
+            child_hash.append(hash_)
+            child_node.append(child)
+        child_start.append(len(child_hash))
+        term_rule.extend(terms[node])
+        term_start.append(len(term_rule))
+    return {
+        "child_start": np.array(child_start, dtype=np.int64),
+        "child_hash": np.array(child_hash, dtype=np.uint64),
+        "child_node": np.array(child_node, dtype=np.int64),
+        "term_start": np.array(term_start, dtype=np.int64),
+        "term_rule": np.array(term_rule, dtype=np.int64),
+    }
+
+
+def write_rule_store(rules, filepath):
+    """Write the compiled rules of a ConTextComponent or ConTextRuleSet to a rule store file.
+
+    Args:
+        rules: a ConTextComponent or ConTextRuleSet
+        filepath (str): the path of the file to write
+
+    Raises:
+        ValueError: if one of the ConTextItems has an on_match or on_modifies callback.
+    """
+    # A ConTextComponent stores its current rule set in _rules
+    rules = getattr(rules, "_rules", rules)
+    item_data = list(rules.item_data)
+    item_dicts = [json.dumps(_to_dict(item)).encode("utf-8") for item in item_data]
+
+    attr_id = IDS[rules.phrase_matcher_attr.upper()]
+    sequences = []
+    for (i, item) in enumerate(item_data):
+        if item.pattern is None:
+            hashes = rules.nlp.make_doc(item.literal).to_array([attr_id])
+            if len(hashes):
+                sequences.append((i, [int(hash_) for hash_ in hashes.ravel()]))
+    arrays = _build_trie(sequences)
+
+    arrays["item_offset"] = np.cumsum([0] + [len(data) for data in item_dicts], dtype=np.int64)
+    indices = {item: i for (i, item) in enumerate(item_data)}
+    suppress_start = [0]
+    suppress_rule = []
+    for item in item_data:
+        suppress_rule.extend(
+            sorted(indices[other] for other in rules.suppression_table.get(item, ()))
+        )
+        suppress_start.append(len(suppress_rule))
+    arrays["suppress_start"] = np.array(suppress_start, dtype=np.int64)
+    arrays["suppress_rule"] = np.array(suppress_rule, dtype=np.int64)
+
+    blobs = [arrays[name].astype(dtype).tobytes() for (name, dtype) in _ARRAYS]
+    blobs.append(b"".join(item_dicts))
+    header = {
+        "version": rules.version,
+        "phrase_matcher_attr": rules.phrase_matcher_attr,
+        "rule_ids": list(rules.rule_ids),
+        "category_list": list(rules.category_list),
+        "rule_set_names": list(rules.rule_set_names),
+        "rule_set_list": list(rules.rule_set_list),
+        "pattern_rules": [i for (i, item) in enumerate(item_data) if item.pattern is not None],
+        "sections": [],
+    }
+    # The header is followed by each section, aligned to 8 bytes
+    names = [name for (name, _) in _ARRAYS] + ["items"]
+    offset = 0
+    for (name, blob) in zip(names, blobs):
+        header["sections"].append([name, offset, len(blob)])
+        offset += len(blob) + (-len(blob) % 8)
+    header_bytes = json.dumps(header).encode("utf-8")
+    header_bytes += b" " * (-len(header_bytes) % 8)
+
+    with open(filepath, "wb") as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(header_bytes)).tobytes())
+        f.write(header_bytes)
+        for blob in blobs:
+            f.write(blob)
+            f.write(b"\0" * (-len(blob) % 8))
+
+
+class _LazyItems:
+    """A read-only sequence of the ConTextItems in a rule store, which are created when first accessed."""
+
+    def __init__(self, rule_set):
+        self._rule_set = rule_set
+
+    def __len__(self):
+        return self._rule_set._num_items
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("rule index out of range")
+        return self._rule_set._get_item(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class _SuppressionTable:
+    """A read-only mapping from a rule index to a frozenset of rule indices, backed by mapped arrays."""
+
+    def __init__(self, start, rules):
+        self._start = start
+        self._rules = rules
+
+    def get(self, rule_idx, default=None):
+        start, end = self._start[rule_idx], self._start[rule_idx + 1]
+        if start == end:
+            return default
+        return frozenset(self._rules[start:end].tolist())
+
+
+class MappedRuleSet:
+    """A frozen rule set read from a memory-mapped rule store file.
+    It can be used by a ConTextComponent in place of a ConTextRuleSet with `load_rule_store`.
+    """
+
+    def __init__(self, nlp, filepath):
+        """Map a rule store file.
+
+        Args:
+            nlp: a spaCy NLP model with the same tokenizer that was used to write the file
+            filepath (str): the path of a file written by `write_rule_store`
+
+        Raises:
+            ValueError: if the file is not a rule store.
+        """
+        self.nlp = nlp
+        self.filepath = filepath
+        with open(filepath, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[: len(MAGIC)] != MAGIC:
+            raise ValueError("{0} is not a ConText rule store".format(filepath))
+        header_len = int(np.frombuffer(self._mmap, dtype=np.uint64, count=1, offset=len(MAGIC))[0])
+        data_start = len(MAGIC) + 8 + header_len
+        header = json.loads(bytes(self._mmap[len(MAGIC) + 8 : data_start]).decode("utf-8"))
+
+        dtypes = dict(_ARRAYS)
+        self._arrays = {}
+        for (name, offset, length) in header["sections"]:
+            if name == "items":
+                self._items_offset = data_start + offset
+                continue
+            dtype = np.dtype(dtypes[name])
+            self._arrays[name] = np.frombuffer(
+                self._mmap, dtype=dtype, count=length // dtype.itemsize, offset=data_start + offset
+            )
+
+        self.version = header["version"]
+        # A rule store can't be modified, so its revision never changes
+        self.revision = 0
+        self.phrase_matcher_attr = header["phrase_matcher_attr"]
+        self._attr_id = IDS[self.phrase_matcher_attr.upper()]
+        self.rule_ids = tuple(header["rule_ids"])
+        self.category_list = tuple(header["category_list"])
+        self.category_ids = MappingProxyType(
+            {category: i for (i, category) in enumerate(self.category_list)}
+        )
+        self.categories = frozenset(self.category_list)
+        self.rule_set_names = tuple(header["rule_set_names"])
+        self.rule_set_list = tuple(header["rule_set_list"])
+        self._num_items = len(self._arrays["item_offset"]) - 1
+        self.item_data = _LazyItems(self)
+        self._suppression_table = _SuppressionTable(
+            self._arrays["suppress_start"], self._arrays["suppress_rule"]
+        )
+        self.frozen = True
+        self._warned_unsupported = False
+
+        # rule_indices maps the id() of each ConTextItem which has been created to its index
+        self._items = {}
+        self.rule_indices = {}
+
+        # Literal rules are matched against the mapped trie instead of a PhraseMatcher
+        self.phrase_matcher = None
+        self.matcher = Matcher(nlp.vocab)
+        self._pattern_keys = {}
+        for i in header["pattern_rules"]:
+            item = self._get_item(i)
+            key = str(self.rule_ids[i])
+            # Patterns were validated when the rule store was written
+            self.matcher.add(key, [compile_regex_predicates(item.pattern, nlp.vocab)])
+            self._pattern_keys[self.nlp.vocab.strings[key]] = i
+
+    def _get_item(self, i):
+        item = self._items.get(i)
+        if item is None:
+            offsets = self._arrays["item_offset"]
+            start = self._items_offset + int(offsets[i])
+            end = self._items_offset + int(offsets[i + 1])
+            item_dict = json.loads(bytes(self._mmap[start:end]).decode("utf-8"))
+            item = ConTextItem.from_dict(item_dict)
+            item.freeze()
+            # setdefault keeps a single ConTextItem per rule if two threads create it at once
+            item = self._items.setdefault(i, item)
+            self.rule_indices[id(item)] = i
+        return item
+
+    def _match_phrases(self, doc):
+        """Find all literal rules in a Doc by walking the trie from each token."""
+        if not len(doc):
+            return []
+        child_start = self._arrays["child_start"]
+        child_hash = self._arrays["child_hash"]
+        child_node = self._arrays["child_node"]
+        term_start = self._arrays["term_start"]
+        term_rule = self._arrays["term_rule"]
+        hashes = doc.to_array([self._attr_id]).ravel().astype(np.uint64)
+
+        # Find the tokens which start a literal with a single vectorized search of the root's children
+        root_hashes = child_hash[child_start[0] : child_start[1]]
+        positions = np.searchsorted(root_hashes, hashes)
+        positions[positions == len(root_hashes)] = 0
+        starts = np.nonzero(root_hashes[positions] == hashes)[0] if len(root_hashes) else []
+
+        matches = []
+        for start in starts:
+            node = int(child_node[child_start[0] + positions[start]])
+            end = start + 1
+            while True:
+                for rule_idx in term_rule[term_start[node] : term_start[node + 1]]:
+                    matches.append((int(rule_idx), int(start), end))
+                if end == len(hashes):
+                    break
+                lo, hi = child_start[node], child_start[node + 1]
+                if lo == hi:
+                    break
+                idx = lo + np.searchsorted(child_hash[lo:hi], hashes[end])
+                if idx == hi or child_hash[idx] != hashes[end]:
+                    break
+                node = int(child_node[idx])
+                end += 1
+        return matches
+
+    @property
+    def suppression_table(self):
+        return self._suppression_table
+
+    def warn_unsupported(self):
+        """Warn, once per rule store, that labels and prefilter are ignored."""
+        if self._warned_unsupported:
+            return
+        self._warned_unsupported = True
+        warnings.warn(
+            "The rule store {0} does not support partition_rules or prefilter. "
+            "All rules are run on every Doc.".format(self.filepath),
+            RuntimeWarning,
+        )
+
+    def match(self, doc, suppress_subsumed=False, labels=None, prefilter=False):
+        """Find all modifiers in a Doc. See ConTextRuleSet.match.
+        labels and prefilter are not supported: all rules are always run, which finds the same edges,
+        and a RuntimeWarning is issued the first time either is given.
+        The literal rules only walk the trie from the tokens which start a literal.
+        """
+        if labels is not None or prefilter:
+            self.warn_unsupported()
+        matches = self._match_phrases(doc)
+        for (match_id, start, end) in self.matcher(doc):
+            matches.append((self._pattern_keys[match_id], start, end))
+        matches = sorted(matches, key=lambda x: x[1])
+        if suppress_subsumed and len(matches) > 1:
+            group = self.rule_set_names.__getitem__ if self.rule_set_list else None
+            matches = suppress_submatches(matches, self._suppression_table, group)
+        return [(self._get_item(rule_idx), start, end) for (rule_idx, start, end) in matches]
+
+    def freeze(self):
+        """A MappedRuleSet is always frozen."""
+
+    def close(self):
+        """Unmap the file. The rule set can't be used after it is closed."""
+        # The arrays are views of the mapped file, which can't be closed while they exist
+        self._arrays = {}
+        self._suppression_table = None
+        self._mmap.close()
+
+    def __len__(self):
+        return self._num_items
+
+    def __repr__(self):
+        return "<MappedRuleSet> version {0} with {1} rules from {2}".format(
+            self.version, self._num_items, self.filepath
+        )
@@ -0,0 +1,368 @@
+"""An asyncio service which collects concurrent ConText requests into micro-batches.
+
+Requests arrive one document at a time, but are grouped into batches of up to `max_batch_size` documents,
+waiting at most `max_wait_ms` milliseconds for a batch to fill. Each batch is run through the spaCy pipeline
+and ConTextComponent in an executor so the event loop is never blocked, and each caller receives the results
+for its own document.
+
+Example:
+    >>> service = ConTextService(nlp, context, max_batch_size=64, max_wait_ms=5)
+    >>> await service.start()
+    >>> result = await service.process("There is no evidence of pneumonia.", ents=[(24, 33, "PROBLEM")])
+    >>> await service.stop()
+
+A minimal HTTP front end is available with `start_http_server`, which uses only asyncio streams.
+"""
+import asyncio
+import json
+
+from .cli import process_batch
+
+
+def check_record(text, ents=None):
+    """Check the text and entity offsets of a request before it is batched, so that a bad request
+    fails on its own instead of failing the batch it would be processed in.
+
+    Raises:
+        ValueError: if text is not a string, or ents is not a list of (start_char, end_char, label)
+            offsets with 0 <= start_char < end_char <= len(text) and a string label.
+    """
+    if not isinstance(text, str):
+        raise ValueError("'text' must be a string, not {0}".format(type(text).__name__))
+    if ents is None:
+        return
+    if not isinstance(ents, (list, tuple)):
+        raise ValueError("'ents' must be a list, not {0}".format(type(ents).__name__))
+    for ent in ents:
+        if (
+            not isinstance(ent, (list, tuple))
+            or len(ent) != 3
+            or not all(isinstance(offset, int) for offset in ent[:2])
+            or not isinstance(ent[2], str)
+        ):
+            raise ValueError(
+                "Each entity must be a [start_char, end_char, label] list, not {0}".format(ent)
+            )
+        if not 0 <= ent[0] < ent[1] <= len(text):
+            raise ValueError(
+                "Entity offsets ({0}, {1}) are out of range for a text of length {2}".format(
+                    ent[0], ent[1], len(text)
+                )
+            )
+
+
+class ConTextService:
+    """Micro-batches concurrent requests to a spaCy pipeline and ConTextComponent."""
+
+    def __init__(
+        self,
+        nlp,
+        context,
+        max_batch_size=32,
+        max_wait_ms=10,
+        max_queue_size=1024,
+        executor=None,
+    ):
+        """Create a new ConTextService.
+
+        Args:
+            nlp: A spaCy Language. Its pipeline is run on each document before context.
+                If context has also been added to nlp.pipeline, it should not be passed separately.
+            context: A ConTextComponent.
+            max_batch_size (int): The maximum number of documents in a batch.
+            max_wait_ms (float): The maximum time in milliseconds to wait for a batch to fill
+                after its first request arrives.
+            max_queue_size (int): The maximum number of requests waiting to be batched. When the queue
+                is full, `process` waits for space (or raises asyncio.QueueFull if block=False),
+                which provides backpressure to callers.
+            executor (concurrent.futures.Executor or None): The executor used to process batches.
+                If None, the event loop's default executor is used.
+
+        Raises:
+            ValueError: if one of the parameters is incorrectly formatted.
+        """
+        if not isinstance(max_batch_size, int) or max_batch_size < 1:
+            raise ValueError(
+                "max_batch_size must be an integer greater than 0, not {0}".format(
+                    max_batch_size
+                )
+            )
+        if max_wait_ms < 0:
+            raise ValueError(
+                "max_wait_ms must be greater than or equal to 0, not {0}".format(
+                    max_wait_ms
+                )
+            )
+        self.nlp = nlp
+        self.context = context
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_queue_size = max_queue_size
+        self.executor = executor
+
+        self._queue = None
+        self._task = None
+        self._num_requests = 0
+        self._num_rejected = 0
+        self._num_batches = 0
+        self._num_documents = 0
+        self._num_errors = 0
+        self._max_queue_depth = 0
+        self._last_batch_size = 0
+
+    @property
+    def running(self):
+        """Returns True if the batching loop has been started and not stopped."""
+        return self._task is not None and not self._task.done()
+
+    @property
+    def queue_depth(self):
+        """Returns the number of requests waiting to be batched."""
+        if self._queue is None:
+            return 0
+        return self._queue.qsize()
+
+    @property
+    def metrics(self):
+        """Returns a dict of counters describing the service."""
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self._max_queue_depth,
+            "max_queue_size": self.max_queue_size,
+            "requests": self._num_requests,
+            "rejected": self._num_rejected,
+            "batches": self._num_batches,
+            "documents": self._num_documents,
+            "errors": self._num_errors,
+            "last_batch_size": self._last_batch_size,
+            "mean_batch_size": self._num_documents / self._num_batches
+            if self._num_batches
+            else 0.0,
+        }
+
+    async def start(self):
+        """Start the batching loop in the running event loop."""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """Stop the batching loop. Requests which have not been processed are cancelled."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.cancel()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    async def process(self, text, ents=None, doc_id=None, block=True):
+        """Process a single document and return its results.
+
+        Args:
+            text (str): The text of the document.
+            ents (list or None): An optional list of (start_char, end_char, label) entity offsets
+                to use as targets.
+            doc_id: An optional id which is returned in the results.
+            block (bool): If True, wait for space when the queue is full. If False, raise asyncio.QueueFull.
+
+        Returns:
+            result: a dict with the same format as the `cycontext` command-line output
+
+        Raises:
+            ValueError: if text or ents are invalid. See `check_record`.
+        """
+        if not self.running:
+            raise RuntimeError("ConTextService has not been started. Call `await service.start()`.")
+        check_record(text, ents)
+        record = {"id": doc_id, "text": text, "ents": ents}
+        future = asyncio.get_event_loop().create_future()
+        if block:
+            await self._queue.put((record, future))
+        else:
+            try:
+                self._queue.put_nowait((record, future))
+            except asyncio.QueueFull:
+                self._num_rejected += 1
+                raise
+        self._num_requests += 1
+        self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        return await future
+
+    async def _next_batch(self):
+        batch = [await self._queue.get()]
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            # Skip requests whose callers have gone away
+            batch = [(record, future) for (record, future) in batch if not future.done()]
+            if not batch:
+                continue
+            records = [record for (record, _) in batch]
+            try:
+                results = await self._process_records(records)
+            except asyncio.CancelledError:
+                for (_, future) in batch:
+                    future.cancel()
+                raise
+            self._num_batches += 1
+            self._num_documents += len(batch)
+            self._last_batch_size = len(batch)
+            for ((_, future), result) in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    async def _process_records(self, records):
+        """Process a batch of records in the executor. Returns a list with the result of each record,
+        or the exception raised while processing it.
+        """
+        loop = asyncio.get_event_loop()
+        try:
+            return await loop.run_in_executor(
+                self.executor, process_batch, records, self.nlp, self.context
+            )
+        except Exception as err:
+            if len(records) == 1:
+                self._num_errors += 1
+                return [err]
+        # Retry the records one at a time, so that an error only reaches the request which caused it
+        results = []
+        for record in records:
+            (result,) = await self._process_records([record])
+            results.append(result)
+        return results
+
+
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+async def _write_response(writer, status, data):
+    body = json.dumps(data).encode("utf-8")
+    header = (
+        "HTTP/1.1 {0} {1}\r\n"
+        "Content-Type: application/json\r\n"
+        "Content-Length: {2}\r\n"
+        "Connection: close\r\n\r\n".format(status, _REASONS[status], len(body))
+    )
+    writer.write(header.encode("latin-1") + body)
+    await writer.drain()
+    writer.close()
+
+
+def _make_handler(service):
+    async def handle(reader, writer):
+        try:
+            await _handle_request(service, reader, writer)
+        except Exception as err:
+            try:
+                await _write_response(
+                    writer, 500, {"error": "{0}: {1}".format(type(err).__name__, err)}
+                )
+            except Exception:
+                pass
+        finally:
+            writer.close()
+
+    return handle
+
+
+async def _handle_request(service, reader, writer):
+    try:
+        request_line = await reader.readline()
+        method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, value = line.decode("latin-1").split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+    except (ValueError, asyncio.IncompleteReadError):
+        await _write_response(writer, 400, {"error": "Malformed HTTP request"})
+        return
+
+    if method == "GET" and target == "/metrics":
+        await _write_response(writer, 200, service.metrics)
+    elif method == "POST" and target == "/process":
+        try:
+            data = json.loads(body.decode("utf-8"))
+            text = data["text"]
+        except (ValueError, KeyError, TypeError):
+            await _write_response(
+                writer, 400, {"error": "Body must be a JSON object with a 'text' key"}
+            )
+            return
+        try:
+            check_record(text, data.get("ents"))
+        except ValueError as err:
+            await _write_response(writer, 400, {"error": str(err)})
+            return
+        try:
+            result = await service.process(
+                text, ents=data.get("ents"), doc_id=data.get("id"), block=False
+            )
+        except asyncio.QueueFull:
+            await _write_response(writer, 503, {"error": "Queue is full"})
+            return
+        await _write_response(writer, 200, result)
+    else:
+        await _write_response(writer, 404, {"error": "Not found"})
+
+
+async def start_http_server(service, host="127.0.0.1", port=0):
+    """Serve a ConTextService over HTTP using asyncio streams.
+
+    Routes:
+        POST /process: The body is a JSON object with a "text" key and optional "ents" and "id" keys.
+            Returns the results for the document, 400 if the text or ents are invalid, 503 if the queue
+            is full, or 500 if processing the document failed.
+        GET /metrics: Returns `service.metrics`.
+
+    Args:
+        service: A ConTextService which has been started.
+        host (str): The host to bind to. Default "127.0.0.1".
+        port (int): The port to bind to. If 0, an unused port is chosen.
+
+    Returns:
+        server: an asyncio Server. The bound port is `server.sockets[0].getsockname()[1]`.
+    """
+    return await asyncio.start_server(_make_handler(service), host, port)
@@ -0,0 +1,244 @@
+"""Streaming corpus-level statistics of ConText output.
+
+ConTextStats updates a fixed set of counters and histograms as each Doc is processed, so monitoring
+doesn't require keeping Docs around. It can be attached to a ConTextComponent, added to a spaCy
+pipeline after ConText, or wrapped around a stream of processed Docs:
+
+    >>> stats = ConTextStats()
+    >>> context = ConTextComponent(nlp, stats=stats)
+    >>> for doc in nlp.pipe(texts): pass
+    >>> stats.negation_rate("PROBLEM")
+
+A ConTextStats attached to a ConTextComponent counts the modifiers of the full ConTextGraph before it is
+stored, so the counts are the same in lean and serializable mode. Docs which are only read after they were
+processed in lean or serializable mode have lost the modifiers which didn't produce an edge, so for these
+num_modifiers, modifier_counts and scope_length_hist only include the modifiers with edges.
+
+Collectors in different worker processes are combined by merging their snapshots:
+
+    >>> total = ConTextStats.from_snapshot(snapshots[0])
+    >>> for snapshot in snapshots[1:]: total.merge(snapshot)
+"""
+import threading
+from collections import Counter
+
+import numpy as np
+
+from .context_component import DEGRADED_KEY, _get_compact_graph
+
+NEGATED_CATEGORY = "NEGATED_EXISTENCE"
+
+
+class ConTextStats:
+    """Counters and histograms of the modifiers, targets and edges found by ConText."""
+
+    name = "context_stats"
+
+    def __init__(self, max_scope_length=64, max_edges=64):
+        """Create a new, empty ConTextStats.
+
+        Args:
+            max_scope_length (int): The number of bins in the histogram of modifier scope lengths in tokens.
+                Scopes of max_scope_length tokens or longer are counted in the last bin.
+            max_edges (int): The number of bins in the histogram of edges per document.
+                Documents with max_edges or more edges are counted in the last bin.
+        """
+        self.max_scope_length = max_scope_length
+        self.max_edges = max_edges
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Set all counters to zero."""
+        self.num_docs = 0
+        self.num_targets = 0
+        self.num_modifiers = 0
+        self.num_edges = 0
+        # category -> count
+        self.modifier_counts = Counter()
+        self.edge_counts = Counter()
+        # label -> count
+        self.target_counts = Counter()
+        # (label, category) -> number of targets modified at least once by the category
+        self.modified_target_counts = Counter()
+        self.scope_length_hist = np.zeros(self.max_scope_length + 1, dtype=np.int64)
+        self.edges_per_doc_hist = np.zeros(self.max_edges + 1, dtype=np.int64)
+        # The number of docs processed in a cheaper mode because they exceeded a WorkBudget,
+        # and the number of docs which exceeded each limit
+        self.num_degraded_docs = 0
+        self.degraded_counts = Counter()
+
+    def _iter_doc(self, doc, context_graph=None):
+        """Returns the lists of (label, start, end) targets, (category, scope_length) modifiers
+        and (target_idx, category) edges of a processed Doc, or of context_graph if it is not None.
+        """
+        if context_graph is None:
+            compact_graph = _get_compact_graph(doc)
+            if compact_graph is not None:
+                targets = list(compact_graph.targets)
+                modifiers = [
+                    (compact_graph.categories[category_id], scope_end - scope_start)
+                    for (_, _, category_id, _, scope_start, scope_end) in compact_graph.modifiers
+                ]
+                edges = [
+                    (target_idx, modifiers[modifier_idx][0])
+                    for (target_idx, modifier_idx) in compact_graph.edges
+                ]
+                return targets, modifiers, edges
+            context_graph = doc._.context_graph
+
+        if context_graph is None:
+            return [], [], []
+        targets = [
+            (target.start, target.end, target.label_) for target in context_graph.targets
+        ]
+        target_indices = {(start, end): i for (i, (start, end, _)) in enumerate(targets)}
+        modifiers = [
+            (modifier.category, modifier._scope_end - modifier._scope_start)
+            for modifier in context_graph.modifiers
+        ]
+        edges = [
+            (target_indices[(target.start, target.end)], modifier.category)
+            for (target, modifier) in context_graph.edges
+        ]
+        return targets, modifiers, edges
+
+    def update(self, doc, context_graph=None):
+        """Add the results of a Doc which has been processed by ConTextComponent.
+
+        Args:
+            doc: a spaCy Doc
+            context_graph (ConTextGraph or None): The full ConTextGraph of doc. ConTextComponent passes
+                this before the graph is compacted, so that the modifiers without edges are counted in
+                lean and serializable mode. If None, the results stored on doc are used.
+        """
+        targets, modifiers, edges = self._iter_doc(doc, context_graph)
+        modified = {(target_idx, category.upper()) for (target_idx, category) in edges}
+        degraded = doc.user_data.get(DEGRADED_KEY, ())
+        with self._lock:
+            self.num_docs += 1
+            if degraded:
+                self.num_degraded_docs += 1
+                self.degraded_counts.update(degraded)
+            self.num_targets += len(targets)
+            self.num_modifiers += len(modifiers)
+            self.num_edges += len(edges)
+            for (_, _, label) in targets:
+                self.target_counts[label] += 1
+            for (category, scope_length) in modifiers:
+                self.modifier_counts[category.upper()] += 1
+                self.scope_length_hist[
+                    min(max(scope_length, 0), self.max_scope_length)
+                ] += 1
+            for (_, category) in edges:
+                self.edge_counts[category.upper()] += 1
+            for (target_idx, category) in modified:
+                self.modified_target_counts[(targets[target_idx][2], category)] += 1
+            self.edges_per_doc_hist[min(len(edges), self.max_edges)] += 1
+
+    def __call__(self, doc):
+        """Update the statistics with a Doc so that ConTextStats can be added to a spaCy pipeline
+        after ConTextComponent.
+        """
+        self.update(doc)
+        return doc
+
+    def pipe(self, docs):
+        """Update the statistics with each Doc in a stream and yield the Docs unchanged."""
+        for doc in docs:
+            self.update(doc)
+            yield doc
+
+    def negation_rate(self, label):
+        """Returns the fraction of targets with a label which are modified by NEGATED_EXISTENCE."""
+        return self.modified_rate(label, NEGATED_CATEGORY)
+
+    def modified_rate(self, label, category):
+        """Returns the fraction of targets with a label which are modified by a category."""
+        num_targets = self.target_counts[label]
+        if num_targets == 0:
+            return 0.0
+        return self.modified_target_counts[(label, category.upper())] / num_targets
+
+    def snapshot(self):
+        """Returns a JSON-serializable dict of the current statistics, which can be sent between
+        processes and combined with `merge`.
+        """
+        with self._lock:
+            return {
+                "max_scope_length": self.max_scope_length,
+                "max_edges": self.max_edges,
+                "num_docs": self.num_docs,
+                "num_targets": self.num_targets,
+                "num_modifiers": self.num_modifiers,
+                "num_edges": self.num_edges,
+                "modifier_counts": dict(self.modifier_counts),
+                "edge_counts": dict(self.edge_counts),
+                "target_counts": dict(self.target_counts),
+                "modified_target_counts": [
+                    [label, category, num]
+                    for ((label, category), num) in sorted(
+                        self.modified_target_counts.items()
+                    )
+                ],
+                "scope_length_hist": self.scope_length_hist.tolist(),
+                "edges_per_doc_hist": self.edges_per_doc_hist.tolist(),
+                "num_degraded_docs": self.num_degraded_docs,
+                "degraded_counts": dict(self.degraded_counts),
+            }
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Create a ConTextStats from the output of `snapshot`."""
+        stats = cls(
+            max_scope_length=snapshot["max_scope_length"],
+            max_edges=snapshot["max_edges"],
+        )
+        stats.merge(snapshot)
+        return stats
+
+    def merge(self, other):
+        """Add the statistics of another ConTextStats or snapshot to this one.
+
+        Raises:
+            ValueError: if the histograms of other have a different number of bins.
+        """
+        if isinstance(other, ConTextStats):
+            other = other.snapshot()
+        if (
+            other["max_scope_length"] != self.max_scope_length
+            or other["max_edges"] != self.max_edges
+        ):
+            raise ValueError(
+                "Cannot merge ConTextStats with different histogram sizes: "
+                "({0}, {1}) and ({2}, {3})".format(
+                    self.max_scope_length,
+                    self.max_edges,
+                    other["max_scope_length"],
+                    other["max_edges"],
+                )
+            )
+        with self._lock:
+            self.num_docs += other["num_docs"]
+            self.num_targets += other["num_targets"]
+            self.num_modifiers += other["num_modifiers"]
+            self.num_edges += other["num_edges"]
+            self.modifier_counts.update(other["modifier_counts"])
+            self.edge_counts.update(other["edge_counts"])
+            self.target_counts.update(other["target_counts"])
+            for (label, category, num) in other["modified_target_counts"]:
+                self.modified_target_counts[(label, category)] += num
+            self.scope_length_hist += np.array(
+                other["scope_length_hist"], dtype=np.int64
+            )
+            self.edges_per_doc_hist += np.array(
+                other["edges_per_doc_hist"], dtype=np.int64
+            )
+            self.num_degraded_docs += other["num_degraded_docs"]
+            self.degraded_counts.update(other["degraded_counts"])
+        return self
+
+    def __repr__(self):
+        return "<ConTextStats> of {0} docs with {1} targets and {2} edges".format(
+            self.num_docs, self.num_targets, self.num_edges
+        )
@@ -4,7 +4,14 @@ class TagObject:
     """
 
     def __init__(
-        self, context_item, start, end, doc, _use_context_window=False
+        self,
+        context_item,
+        start,
+        end,
+        doc,
+        _use_context_window=False,
+        scope=None,
+        _max_scope=None,
     ):
         """Create a new TagObject from a document span.
 
@@ -12,6 +19,10 @@ class TagObject:
         start (int): The start token index.
         end (int): The end token index (non-inclusive).
         doc (Doc): The spaCy Doc which contains this span.
+        scope (tuple or None): An optional (start, end) tuple of token indices defining a
+            previously computed scope. If None, the scope is set using `set_scope`.
+        _max_scope (int or None): An optional upper bound on the max_scope of the ConTextItem,
+            used when ConTextComponent falls back to a cheaper mode. See cycontext.budget.
         """
         self.context_item = context_item
         self.start = start
@@ -22,10 +33,14 @@ class TagObject:
         self._num_targets = 0
 
         self._use_context_window = _use_context_window
+        self._max_scope = _max_scope
         self._scope_start = None
         self._scope_end = None
 
-        self.set_scope()
+        if scope is None:
+            self.set_scope()
+        else:
+            self._scope_start, self._scope_end = scope
 
     @property
     def span(self):
@@ -70,7 +85,12 @@ class TagObject:
     @property
     def max_scope(self):
         """Returns the associated maximum scope."""
-        return self.context_item.max_scope
+        max_scope = self.context_item.max_scope
+        if self._max_scope is not None and (
+            max_scope is None or max_scope > self._max_scope
+        ):
+            return self._max_scope
+        return max_scope
 
     def set_scope(self):
         """Applies the rule of the ConTextItem which generated
@@ -89,11 +109,11 @@ class TagObject:
         if self._use_context_window:
             # Up to the beginning of the doc
             full_scope_start = max(
-                (0, self.start - self.context_item.max_scope)
+                (0, self.start - self.max_scope)
             )
             # Up to the end of the doc
             full_scope_end = min(
-                (len(self.span.doc), self.end + self.context_item.max_scope)
+                (len(self.span.doc), self.end + self.max_scope)
             )
             full_scope_span = self.span.doc[full_scope_start:full_scope_end]
         # Otherwise, use the sentence
@@ -166,8 +186,13 @@ class TagObject:
         other (TagObject)
         Returns True if obj modfified the scope of self
         """
-        if self.span.sent != other.span.sent:
-            return False
+        try:
+            if self.span.sent != other.span.sent:
+                return False
+        except ValueError:
+            # Sentence boundaries are optional with use_context_window,
+            # in which case the Doc is treated as a single sentence
+            pass
         if self.rule.upper() == "TERMINATE":
             return False
         # Check if the other modifier is a type which can modify self
@@ -1,6 +1,11 @@
-from spacy import displacy
-
+import html
+import os
 import warnings
+from itertools import count
+
+from spacy import displacy
+from spacy.displacy.render import DependencyRenderer, EntityRenderer
+from spacy.displacy.templates import TPL_FIGURE, TPL_PAGE
 
 warnings.simplefilter('once', DeprecationWarning)
 warnings.warn("Cycontext visualizer is deprecated and will be removed. Please use medspacy.visualization instead.", RuntimeWarning)
@@ -31,6 +36,30 @@ def visualize_ent(doc, context=True, sections=True, jupyter=True, colors=None):
     if not hasattr(doc._, "sections"):
         sections = False
 
+    ents_data = _get_ents_data(doc, context, sections)
+    if len(ents_data) == 0:  # No data to display
+        viz_data = [{"text": doc.text, "ents": []}]
+        options = dict()
+    else:
+        # If colors aren't defined, generate color mappings for each entity and modifier label
+        # And set all section titles to a light gray
+        if colors is None:
+            colors = _add_colors({}, _create_color_generator(), ents_data)
+        ents_display_data, _ = zip(*ents_data)
+        viz_data = [{"text": doc.text, "ents": ents_display_data,}]
+
+        options = {
+            "colors": colors,
+        }
+    return displacy.render(
+        viz_data, style="ent", manual=True, options=options, jupyter=jupyter
+    )
+
+
+def _get_ents_data(doc, context, sections):
+    """Returns a list of (ent_data, ent_type) tuples for the targets, modifiers and section titles
+    of a doc sorted by their start character, where ent_type is "ent", "modifier" or "section".
+    """
     ents_data = []
 
     for target in doc.ents:
@@ -63,43 +92,25 @@ def visualize_ent(doc, context=True, sections=True, jupyter=True, colors=None):
                 "label": f"<< {title.upper()} >>",
             }
             ents_data.append((ent_data, "section"))
-    if len(ents_data) == 0:  # No data to display
-        viz_data = [{"text": doc.text, "ents": []}]
-        options = dict()
-    else:
-        ents_data = sorted(ents_data, key=lambda x: x[0]["start"])
+    return sorted(ents_data, key=lambda x: x[0]["start"])
 
-        # If colors aren't defined, generate color mappings for each entity and modifier label
-        # And set all section titles to a light gray
-        if colors is None:
-            labels = set()
-            section_titles = set()
-            for (ent_data, ent_type) in ents_data:
-                if ent_type in ("ent", "modifier"):
-                    labels.add(ent_data["label"])
-                elif ent_type == "section":
-                    section_titles.add(ent_data["label"])
-            colors = _create_color_mapping(labels)
-            for title in section_titles:
-                colors[title] = "#dee0e3"
-        ents_display_data, _ = zip(*ents_data)
-        viz_data = [{"text": doc.text, "ents": ents_display_data,}]
-
-        options = {
-            "colors": colors,
-        }
-    return displacy.render(
-        viz_data, style="ent", manual=True, options=options, jupyter=jupyter
-    )
 
+def _add_colors(colors, color_cycle, ents_data):
+    """Add a color for each new label in ents_data to colors. Entity and modifier labels take the next
+    color from color_cycle and section titles are set to a light gray.
 
-def _create_color_mapping(labels):
-    mapping = {}
-    color_cycle = _create_color_generator()
-    for label in labels:
-        if label not in mapping:
-            mapping[label] = next(color_cycle)
-    return mapping
+    Returns:
+        colors: the updated dict
+    """
+    for (ent_data, ent_type) in ents_data:
+        label = ent_data["label"]
+        if label in colors:
+            continue
+        if ent_type in ("ent", "modifier"):
+            colors[label] = next(color_cycle)
+        elif ent_type == "section":
+            colors[label] = "#dee0e3"
+    return colors
 
 
 def _create_color_generator():
@@ -121,51 +132,150 @@ def _create_color_generator():
     return cycle(colors)
 
 
-def visualize_dep(doc, jupyter=True):
-    """Create a dependency-style visualization for
-    targets and modifiers in doc."""
-    warnings.warn("Cycontext visualizer is deprecated and will be removed. Please use medspacy.visualization instead.", RuntimeWarning)
-    token_data = []
-    token_data_mapping = {}
-    for token in doc:
-        data = {"text": token.text, "tag": "", "index": token.i}
-        token_data.append(data)
-        token_data_mapping[token] = data
-
-    # Merge phrases
+def _get_dep_data(doc):
+    """Returns the words and arcs of a dependency-style visualization of doc, where each target
+    and modifier is merged into a single word. Overlapping spans are merged into one word.
+    """
     targets_and_modifiers = [*doc._.context_graph.targets]
     targets_and_modifiers += [mod.span for mod in doc._.context_graph.modifiers]
-    for span in targets_and_modifiers:
-        first_token = span[0]
-        data = token_data_mapping[first_token]
-        data["tag"] = span.label_
 
-        if len(span) == 1:
-            continue
-
-        idx = data["index"]
-        for other_token in span[1:]:
-            # Add the text to the display data for the first word and remove the subsequent token
-            data["text"] += " " + other_token.text
-            # Remove this token from the list of display data
-            token_data.pop(idx + 1)
+    # Mark the tokens which continue a span, and the tag of the first token of each span
+    continues = [False] * len(doc)
+    tags = {}
+    for span in targets_and_modifiers:
+        tags[span.start] = span.label_
+        for i in range(span.start + 1, span.end):
+            continues[i] = True
 
-        # Lower the index of the following tokens
-        for other_data in token_data[idx + 1 :]:
-            other_data["index"] -= len(span) - 1
+    # Merge the phrases in a single pass, keeping the index of the word which contains each token
+    token_data = []
+    word_indices = [0] * len(doc)
+    for token in doc:
+        if continues[token.i] and token_data:
+            token_data[-1]["text"] += " " + token.text
+        else:
+            token_data.append(
+                {"text": token.text, "tag": tags.get(token.i, ""), "index": len(token_data)}
+            )
+        word_indices[token.i] = len(token_data) - 1
 
     dep_data = {"words": token_data, "arcs": []}
     # Gather the edges between targets and modifiers
     for target, modifier in doc._.context_graph.edges:
-        target_data = token_data_mapping[target[0]]
-        modifier_data = token_data_mapping[modifier.span[0]]
+        target_index = word_indices[target.start]
+        modifier_index = word_indices[modifier.span.start]
         dep_data["arcs"].append(
             {
-                "start": min(target_data["index"], modifier_data["index"]),
-                "end": max(target_data["index"], modifier_data["index"]),
+                "start": min(target_index, modifier_index),
+                "end": max(target_index, modifier_index),
                 "label": modifier.category,
                 "dir": "right" if target > modifier.span else "left",
             }
         )
+    return dep_data
+
+
+def visualize_dep(doc, jupyter=True):
+    """Create a dependency-style visualization for
+    targets and modifiers in doc."""
+    warnings.warn("Cycontext visualizer is deprecated and will be removed. Please use medspacy.visualization instead.", RuntimeWarning)
+    dep_data = _get_dep_data(doc)
     displacy.render(dep_data, manual=True, jupyter=jupyter)
     return
+
+
+def render_html(
+    docs,
+    directory,
+    style="ent",
+    doc_ids=None,
+    docs_per_file=100,
+    context=True,
+    sections=True,
+    colors=None,
+    filename_template="context-{0:05d}.html",
+):
+    """Render many processed docs to static HTML files.
+    Docs are read from an iterable one at a time and each is written as soon as it is rendered,
+    so memory use does not grow with the number of docs. The renderer and color mapping are created
+    once and shared by all of the docs, so each label has the same color in every file.
+
+    Args:
+        docs: an iterable of Docs which have been processed by ConTextComponent.
+        directory (str): the directory to write the files to. It is created if it doesn't exist.
+        style (str): "ent" for a NER-style visualization, like `visualize_ent`,
+            or "dep" for a dependency-style visualization, like `visualize_dep`. Default "ent".
+        doc_ids: an optional iterable of ids with the same length as docs, which are shown as
+            the title of each doc. If None, docs are numbered from 0.
+        docs_per_file (int): the maximum number of docs in each file. Default 100.
+        context (bool): Whether to display modifiers in the "ent" style. Default True.
+        sections (bool): Whether to display section titles in the "ent" style. Default True.
+        colors (dict or None): An optional dictionary mapping labels to colors for the "ent" style.
+            If None, colors are assigned as new labels are found.
+        filename_template (str): the format string of the file names, which is passed the file number.
+
+    Returns:
+        filepaths: the list of files which were written
+
+    Raises:
+        ValueError: if style is not "ent" or "dep", or docs_per_file is less than 1.
+    """
+    if style not in ("ent", "dep"):
+        raise ValueError("style must be either 'ent' or 'dep', not {0}".format(style))
+    if docs_per_file < 1:
+        raise ValueError(
+            "docs_per_file must be an integer greater than 0, not {0}".format(
+                docs_per_file
+            )
+        )
+    os.makedirs(directory, exist_ok=True)
+    if doc_ids is None:
+        doc_ids = count()
+
+    if style == "ent":
+        color_cycle = _create_color_generator()
+        fixed_colors = colors is not None
+        colors = dict(colors) if fixed_colors else {}
+        renderer = EntityRenderer(options={"colors": colors})
+    else:
+        renderer = DependencyRenderer()
+    page_start, page_end = TPL_PAGE.split("{content}")
+    page_start = page_start.format(lang=renderer.lang, dir=renderer.direction)
+    page_end = page_end.format(lang=renderer.lang, dir=renderer.direction)
+
+    filepaths = []
+    f = None
+    try:
+        for (i, (doc, doc_id)) in enumerate(zip(docs, doc_ids)):
+            if i % docs_per_file == 0:
+                if f is not None:
+                    f.write(page_end)
+                    f.close()
+                filepath = os.path.join(
+                    directory, filename_template.format(len(filepaths))
+                )
+                f = open(filepath, "w", encoding="utf-8")
+                f.write(page_start)
+                filepaths.append(filepath)
+
+            if style == "ent":
+                doc_context = context and hasattr(doc._, "context_graph")
+                doc_sections = sections and hasattr(doc._, "sections")
+                ents_data = _get_ents_data(doc, doc_context, doc_sections)
+                if not fixed_colors:
+                    # Each label is given a color once, when it is first found
+                    num_colors = len(colors)
+                    _add_colors(colors, color_cycle, ents_data)
+                    for label in list(colors)[num_colors:]:
+                        renderer.colors[label.upper()] = colors[label]
+                parsed = [{"text": doc.text, "ents": [ent_data for (ent_data, _) in ents_data]}]
+            else:
+                parsed = [_get_dep_data(doc)]
+            markup = renderer.render(parsed, page=False, minify=False)
+            f.write("<h2>{0}</h2>\n".format(html.escape(str(doc_id))))
+            f.write(TPL_FIGURE.format(content=markup))
+    finally:
+        if f is not None:
+            f.write(page_end)
+            f.close()
+    return filepaths
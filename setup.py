@@ -30,6 +30,8 @@ setup(
     author_email="medspacy.dev@gmail.com",
     packages=["cycontext"],
     install_requires=["spacy<3.0.0", "jsonschema", "pyyaml"],
+    extras_require={"parquet": ["pyarrow"]},
+    entry_points={"console_scripts": ["cycontext=cycontext.cli:main"]},
     long_description=long_description,
     long_description_content_type="text/markdown",
     package_data={"cycontext": ["../kb/*"]},
@@ -0,0 +1,142 @@
+import time
+
+import spacy
+from spacy.tokens import Span
+
+from cycontext import ConTextComponent, ConTextItem
+from cycontext.analysis import analyze_rules, overlap_table, suppress_submatches
+
+nlp = spacy.load("en_core_web_sm")
+
+
+class TestAnalysis:
+    def test_literal_subsumed(self):
+        item_data = [
+            ConTextItem("history of", "HISTORICAL", rule="forward"),
+            ConTextItem("no history of", "NEGATED_EXISTENCE", rule="forward"),
+        ]
+        analysis = analyze_rules(item_data, nlp)
+        assert analysis.suppression_table == {1: frozenset([0])}
+        assert [tuple(overlap) for overlap in analysis.overlaps] == [("subsumed", 0, 1)]
+
+    def test_pattern_subsumed(self):
+        item_data = [
+            ConTextItem("history", "HISTORICAL", rule="forward"),
+            ConTextItem(
+                "no history of",
+                "NEGATED_EXISTENCE",
+                rule="forward",
+                pattern=[{"LOWER": "no"}, {"LOWER": {"IN": ["history", "signs"]}}, {"LOWER": "of", "OP": "?"}],
+            ),
+        ]
+        analysis = analyze_rules(item_data, nlp)
+        assert analysis.suppression_table == {1: frozenset([0])}
+
+    def test_not_subsumed(self):
+        item_data = [
+            ConTextItem("history of", "HISTORICAL", rule="forward"),
+            ConTextItem("no evidence of", "NEGATED_EXISTENCE", rule="forward"),
+        ]
+        analysis = analyze_rules(item_data, nlp)
+        assert analysis.suppression_table == {}
+        assert analysis.overlaps == []
+
+    def test_pseudo_shadowed(self):
+        item_data = [
+            ConTextItem("negative", "NEGATED_EXISTENCE", rule="backward"),
+            ConTextItem("negative attitude", "NEGATED_EXISTENCE", rule="pseudo"),
+        ]
+        analysis = analyze_rules(item_data, nlp)
+        assert [tuple(overlap) for overlap in analysis.filter("pseudo_shadowed")] == [
+            ("pseudo_shadowed", 0, 1)
+        ]
+
+    def test_duplicates(self):
+        item_data = [
+            ConTextItem("no", "NEGATED_EXISTENCE", rule="forward"),
+            ConTextItem("no", "NEGATED_EXISTENCE", rule="forward"),
+            ConTextItem("no", "POSSIBLE_EXISTENCE", rule="forward"),
+        ]
+        analysis = analyze_rules(item_data, nlp)
+        assert [tuple(overlap) for overlap in analysis.overlaps] == [
+            ("duplicate", 0, 1),
+            ("conflict", 0, 2),
+            ("conflict", 1, 2),
+        ]
+        assert "duplicate" in analysis.format_report()
+
+    def test_overlap_table(self):
+        item_data = [
+            ConTextItem("no evidence", "NEGATED_EXISTENCE"),
+            ConTextItem("evidence of", "NEGATED_EXISTENCE"),
+            ConTextItem("history of", "HISTORICAL"),
+            ConTextItem("family", "FAMILY"),
+        ]
+        table = overlap_table(item_data, nlp)
+        assert table == {0: {1}, 1: {0}, 2: set(), 3: set()}
+
+    def test_overlap_table_negated_token(self):
+        # A token with "OP": "!" still matches one token, so "y" can overlap the pattern
+        item_data = [
+            ConTextItem(
+                "no x pneumonia",
+                "NEGATED_EXISTENCE",
+                pattern=[{"LOWER": "no"}, {"LOWER": "x", "OP": "!"}, {"LOWER": "pneumonia"}],
+            ),
+            ConTextItem("y pneumonia history", "HISTORICAL"),
+        ]
+        table = overlap_table(item_data, nlp)
+        assert table == {0: {1}, 1: {0}}
+
+    def test_suppress_submatches(self):
+        table = {"long": frozenset(["short"])}
+        matches = [("long", 0, 3), ("short", 1, 3), ("other", 5, 6)]
+        assert suppress_submatches(matches, table) == [("long", 0, 3), ("other", 5, 6)]
+
+    def test_suppress_submatches_not_isolated(self):
+        # "long" may be pruned by "longer", so "short" must be kept
+        table = {"long": frozenset(["short"])}
+        matches = [("longer", 0, 5), ("long", 2, 6), ("short", 5, 6)]
+        assert suppress_submatches(matches, table) == matches
+
+    def test_suppress_submatches_scales_linearly(self):
+        table = {"long": frozenset(["short"])}
+
+        def elapsed(n):
+            matches = []
+            for i in range(n):
+                matches += [("long", 5 * i, 5 * i + 3), ("short", 5 * i + 1, 5 * i + 3)]
+            best = None
+            for _ in range(3):
+                start = time.perf_counter()
+                assert len(suppress_submatches(matches, table)) == n
+                duration = time.perf_counter() - start
+                best = duration if best is None else min(best, duration)
+            return best
+
+        # 8 times as many matches take about 8 times as long, and 64 times as long with a quadratic scan
+        assert elapsed(8000) < 20 * elapsed(1000)
+
+    def test_component_same_edges(self):
+        context = ConTextComponent(nlp)
+        doc = nlp("There is no history of pneumonia or free of fever.")
+        doc.ents = (Span(doc, 5, 6, label="PROBLEM"), Span(doc, 9, 10, label="PROBLEM"))
+        matches = context._rules.match(doc)
+        suppressed = context._rules.match(doc, suppress_subsumed=True)
+        assert len(suppressed) < len(matches)
+        context(doc)
+        for ent in doc.ents:
+            assert ent._.is_negated is True
+
+    def test_component_analyze_rules(self):
+        context = ConTextComponent(nlp, rules=None)
+        context.add([ConTextItem("no", "NEGATED_EXISTENCE"), ConTextItem("no", "NEGATED_EXISTENCE")])
+        analysis = context.analyze_rules()
+        assert [overlap.kind for overlap in analysis.overlaps] == ["duplicate"]
+
+    def test_suppress_submatches_groups(self):
+        # "short" is in a different group than "long", so it is kept
+        table = {"long": frozenset(["short"])}
+        matches = [("long", 0, 3), ("short", 1, 3)]
+        groups = {"long": "a", "short": "b"}
+        assert suppress_submatches(matches, table, groups.get) == matches
@@ -0,0 +1,89 @@
+import pytest
+import spacy
+from spacy.tokens import Span
+
+from cycontext import ConTextComponent
+from cycontext.budget import (
+    DEADLINE,
+    MAX_MODIFIERS,
+    MAX_SENTENCE_LENGTH,
+    MAX_TOKENS,
+    WorkBudget,
+    longest_sentence,
+)
+from cycontext.stats import ConTextStats
+
+nlp = spacy.load("en_core_web_sm")
+
+
+def make_doc(text):
+    doc = nlp(text)
+    doc.ents = [
+        Span(doc, token.i, token.i + 1, label=token.text.upper())
+        for token in doc
+        if token.lower_ in ("pneumonia", "chf")
+    ]
+    return doc
+
+
+class TestWorkBudget:
+    def test_init_fails_not_positive(self):
+        with pytest.raises(ValueError):
+            WorkBudget(max_tokens=0)
+        with pytest.raises(ValueError):
+            WorkBudget(deadline=-1.0)
+
+    def test_longest_sentence(self):
+        doc = nlp("There is no pneumonia. History of chf and no evidence of afib.")
+        assert longest_sentence(doc) == 9
+        assert longest_sentence(nlp.tokenizer("No pneumonia")) == 2
+
+    def test_check(self):
+        doc = nlp("There is no pneumonia. History of chf and no evidence of afib.")
+        assert WorkBudget().check(doc, 100, 100.0) == []
+        budget = WorkBudget(max_tokens=10, max_modifiers=2, max_sentence_length=5, deadline=1.0)
+        assert budget.check(doc, 3, 2.0) == [
+            MAX_TOKENS,
+            MAX_SENTENCE_LENGTH,
+            MAX_MODIFIERS,
+            DEADLINE,
+        ]
+        assert budget.check(doc, 3, 2.0, use_context_window=True) == [
+            MAX_TOKENS,
+            MAX_MODIFIERS,
+            DEADLINE,
+        ]
+
+    def test_not_degraded(self):
+        context = ConTextComponent(nlp, budget=WorkBudget(max_modifiers=10))
+        doc = context(make_doc("There is no evidence of pneumonia."))
+        assert doc._.context_degraded == ()
+        assert doc.ents[0]._.is_negated is True
+
+    def test_degraded(self):
+        context = ConTextComponent(nlp, budget=WorkBudget(max_modifiers=1))
+        doc = context(make_doc("There is no pneumonia and no history of chf."))
+        assert doc._.context_degraded == (MAX_MODIFIERS,)
+        assert doc.ents[0]._.is_negated is True
+        assert doc.ents[1]._.is_negated is True
+
+    def test_degraded_same_edges(self):
+        text = "There is no pneumonia but there is chf."
+        context = ConTextComponent(nlp)
+        degraded_context = ConTextComponent(nlp, budget=WorkBudget(max_tokens=1))
+        doc = context(make_doc(text))
+        degraded_doc = degraded_context(make_doc(text))
+        assert degraded_doc._.context_degraded == (MAX_TOKENS,)
+        assert [
+            (ent.text, [mod.category for mod in ent._.modifiers]) for ent in degraded_doc.ents
+        ] == [(ent.text, [mod.category for mod in ent._.modifiers]) for ent in doc.ents]
+
+    def test_stats(self):
+        context = ConTextComponent(nlp, budget=WorkBudget(max_modifiers=1))
+        stats = ConTextStats()
+        stats.update(context(make_doc("There is no pneumonia and no history of chf.")))
+        stats.update(context(make_doc("There is no pneumonia.")))
+        assert stats.num_degraded_docs == 1
+        assert stats.degraded_counts == {MAX_MODIFIERS: 1}
+        merged = ConTextStats.from_snapshot(stats.snapshot()).merge(stats)
+        assert merged.num_degraded_docs == 2
@@ -0,0 +1,131 @@
+import json
+import os
+
+import pytest
+import spacy
+from spacy.tokens import Span
+
+from cycontext import ConTextComponent, ConTextItem
+from cycontext.capture import (
+    SlowDocCapture,
+    load_capture,
+    replay,
+    rules_fingerprint,
+)
+
+nlp = spacy.load("en_core_web_sm")
+
+TEXT = "There is no evidence of pneumonia. History of chf."
+
+
+def make_doc(text=TEXT):
+    doc = nlp(text)
+    doc.ents = [
+        Span(doc, token.i, token.i + 1, label=token.text.upper())
+        for token in doc
+        if token.lower_ in ("pneumonia", "chf")
+    ]
+    return doc
+
+
+def edges(doc):
+    return [
+        (ent.text, ent.label_, [(mod.category, mod.start, mod.end) for mod in ent._.modifiers])
+        for ent in doc.ents
+    ]
+
+
+class TestSlowDocCapture:
+    def test_init_fails_not_positive(self, tmpdir):
+        with pytest.raises(ValueError):
+            SlowDocCapture(str(tmpdir), threshold=0)
+        with pytest.raises(ValueError):
+            SlowDocCapture(str(tmpdir), max_captures=0)
+
+    def test_not_captured_below_threshold(self, tmpdir):
+        capture = SlowDocCapture(str(tmpdir), threshold=60.0)
+        context = ConTextComponent(nlp, capture=capture)
+        context(make_doc())
+        assert capture.num_captured == 0
+        assert os.listdir(str(tmpdir)) == []
+
+    def test_capture(self, tmpdir):
+        capture = SlowDocCapture(str(tmpdir), threshold=1e-9)
+        context = ConTextComponent(nlp, capture=capture)
+        context(make_doc())
+        assert capture.num_captured == 1
+        (filename,) = os.listdir(str(tmpdir))
+        with open(os.path.join(str(tmpdir), filename)) as f:
+            data = json.load(f)
+        assert data["words"][:3] == ["There", "is", "no"]
+        assert data["targets"] == [[5, 6, "PNEUMONIA"], [9, 10, "CHF"]]
+        assert data["fingerprint"] == rules_fingerprint(context._rules)
+        assert set(data["timings"]) == {"match", "graph", "results", "total"}
+        assert data["config"]["use_context_window"] is False
+
+    def test_rate_limit(self, tmpdir):
+        capture = SlowDocCapture(str(tmpdir), threshold=1e-9, max_captures=2, interval=60.0)
+        context = ConTextComponent(nlp, capture=capture)
+        for _ in range(4):
+            context(make_doc())
+        assert capture.num_captured == 2
+        assert capture.num_dropped == 2
+        assert len(os.listdir(str(tmpdir))) == 2
+
+    def test_max_files(self, tmpdir):
+        capture = SlowDocCapture(str(tmpdir), threshold=1e-9, max_files=1)
+        context = ConTextComponent(nlp, capture=capture)
+        context(make_doc())
+        context(make_doc())
+        assert capture.num_captured == 1
+        assert capture.num_dropped == 1
+
+    def test_fingerprint(self):
+        context1 = ConTextComponent(nlp)
+        context2 = ConTextComponent(nlp)
+        assert rules_fingerprint(context1._rules) == rules_fingerprint(context2._rules)
+        context2.add([ConTextItem("denies", "NEGATED_EXISTENCE", rule="forward")])
+        assert rules_fingerprint(context1._rules) != rules_fingerprint(context2._rules)
+
+    def processed(self):
+        context = ConTextComponent(nlp)
+        doc = context(make_doc())
+        return doc, doc.ents, context._rules
+
+    def test_load_capture(self, tmpdir):
+        capture = SlowDocCapture(str(tmpdir), threshold=1e-9)
+        filepath = capture.observe(
+            *self.processed(), timings={"match": 0.0, "graph": 0.0, "results": 0.0, "total": 1.0}
+        )
+        doc = make_doc()
+        captured = load_capture(filepath, nlp)
+        assert captured.doc.text == doc.text
+        assert [token.is_sent_start for token in captured.doc] == [
+            token.is_sent_start for token in doc
+        ]
+        assert [(ent.start, ent.end, ent.label_) for ent in captured.doc.ents] == [
+            (ent.start, ent.end, ent.label_) for ent in doc.ents
+        ]
+        assert captured.timings["total"] == 1.0
+
+    def test_replay(self, tmpdir):
+        capture = SlowDocCapture(str(tmpdir), threshold=1e-9)
+        context = ConTextComponent(nlp, capture=capture)
+        doc = context(make_doc())
+        (filename,) = os.listdir(str(tmpdir))
+        replayed, stats = replay(os.path.join(str(tmpdir), filename), ConTextComponent(nlp))
+        assert edges(replayed) == edges(doc)
+        assert stats.total_calls > 0
+
+    def test_replay_different_rules_fails(self, tmpdir):
+        capture = SlowDocCapture(str(tmpdir), threshold=1e-9)
+        ConTextComponent(nlp, capture=capture)(make_doc())
+        (filename,) = os.listdir(str(tmpdir))
+        context = ConTextComponent(nlp, rules=None)
+        with pytest.raises(ValueError):
+            replay(os.path.join(str(tmpdir), filename), context)
+        (replayed, stats) = replay(
+            os.path.join(str(tmpdir), filename), context, profile=False, check_rules=False
+        )
+        assert stats is None
+        assert edges(replayed) == [("pneumonia", "PNEUMONIA", []), ("chf", "CHF", [])]
@@ -0,0 +1,145 @@
+import gc
+import json
+import tempfile
+from os import path
+
+import pytest
+
+from cycontext import cli
+from cycontext.cli import main, prefork_pool, read_records, run
+from cycontext.stats import ConTextStats
+
+tmpdirname = tempfile.TemporaryDirectory()
+
+PIPELINE_KWARGS = {"model": None}
+
+
+def _frozen_in_worker(_):
+    return cli._context is not None and cli._context.frozen
+
+
+def write_jsonl(records, filename="input.jsonl"):
+    filepath = path.join(tmpdirname.name, filename)
+    with open(filepath, "w") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+    return filepath
+
+
+class TestCLI:
+    def test_read_records_jsonl(self):
+        lines = [
+            json.dumps({"id": "a", "text": "No pneumonia.", "ents": [[3, 12, "PROBLEM"]]}),
+            "",
+            json.dumps({"text": "History of afib."}),
+        ]
+        records = list(read_records(lines, "jsonl"))
+        assert records == [
+            {"id": "a", "text": "No pneumonia.", "ents": [[3, 12, "PROBLEM"]]},
+            {"id": 1, "text": "History of afib.", "ents": None},
+        ]
+
+    def test_read_records_text(self):
+        records = list(read_records(["No pneumonia.\n", "History of afib.\n"], "text"))
+        assert [record["text"] for record in records] == ["No pneumonia.", "History of afib."]
+        assert [record["id"] for record in records] == [0, 1]
+
+    def test_read_records_bad_format(self):
+        with pytest.raises(ValueError):
+            list(read_records(["text"], "csv"))
+
+    def test_run(self):
+        records = [
+            {"id": "a", "text": "There is no evidence of pneumonia.", "ents": [[24, 33, "PROBLEM"]]},
+            {"id": "b", "text": "History of afib.", "ents": [[11, 15, "PROBLEM"]]},
+        ]
+        results = list(run(records, PIPELINE_KWARGS, batch_size=1))
+        assert [result["id"] for result in results] == ["a", "b"]
+        ent = results[0]["ents"][0]
+        assert (ent["start"], ent["end"], ent["label"]) == (24, 33, "PROBLEM")
+        assert ent["is_negated"] is True
+        assert ent["modifiers"][0]["category"] == "NEGATED_EXISTENCE"
+        assert ent["modifiers"][0]["text"] == "no evidence of"
+        assert results[1]["ents"][0]["is_historical"] is True
+
+    def test_run_workers_keeps_order(self):
+        records = [
+            {"id": i, "text": "There is no evidence of pneumonia.", "ents": [[24, 33, "PROBLEM"]]}
+            for i in range(10)
+        ]
+        results = list(run(records, PIPELINE_KWARGS, batch_size=3, workers=2))
+        assert [result["id"] for result in results] == list(range(10))
+        assert all(result["ents"][0]["is_negated"] for result in results)
+
+    def test_run_workers_stats(self):
+        records = [
+            {"id": i, "text": "There is no evidence of pneumonia.", "ents": [[24, 33, "PROBLEM"]]}
+            for i in range(10)
+        ]
+        stats = ConTextStats()
+        list(run(records, PIPELINE_KWARGS, batch_size=3, workers=2, stats=stats))
+        assert stats.num_docs == 10
+        assert stats.negation_rate("PROBLEM") == 1.0
+
+    def test_run_prefork(self):
+        records = [
+            {"id": i, "text": "There is no evidence of pneumonia.", "ents": [[24, 33, "PROBLEM"]]}
+            for i in range(10)
+        ]
+        expected = list(run(records, PIPELINE_KWARGS, batch_size=3))
+        stats = ConTextStats()
+        results = list(
+            run(records, PIPELINE_KWARGS, batch_size=3, workers=2, stats=stats, prefork=True)
+        )
+        assert results == expected
+        assert stats.num_docs == 10
+
+    def test_prefork_pool_shares_pipeline(self):
+        # The workers are not initialized, so they can only use the pipeline built in this process
+        with prefork_pool(2, PIPELINE_KWARGS) as pool:
+            assert pool.map(_frozen_in_worker, range(4)) == [True] * 4
+        assert gc.get_freeze_count() == 0
+
+    def test_run_bad_batch_size(self):
+        with pytest.raises(ValueError):
+            list(run([], PIPELINE_KWARGS, batch_size=0))
+
+    def test_main(self):
+        input_filepath = write_jsonl(
+            [{"id": "a", "text": "There is no evidence of pneumonia.", "ents": [[24, 33, "PROBLEM"]]}]
+        )
+        output_filepath = path.join(tmpdirname.name, "output.jsonl")
+        main([input_filepath, "-o", output_filepath, "--max-scope", "2"])
+        with open(output_filepath) as f:
+            results = [json.loads(line) for line in f]
+        assert len(results) == 1
+        assert results[0]["ents"][0]["is_negated"] is True
+
+    def test_main_context_window(self):
+        text = "There is no evidence of pneumonia but there is no chf."
+        input_filepath = write_jsonl(
+            [{"id": "a", "text": text, "ents": [[24, 33, "PROBLEM"], [50, 53, "PROBLEM"]]}],
+            "input_window.jsonl",
+        )
+        output_filepath = path.join(tmpdirname.name, "output_window.jsonl")
+        main([input_filepath, "-o", output_filepath, "--use-context-window", "--max-scope", "5"])
+        with open(output_filepath) as f:
+            results = [json.loads(line) for line in f]
+        ents = results[0]["ents"]
+        assert [ent["is_negated"] for ent in ents] == [True, True]
+        assert [len(ent["modifiers"]) for ent in ents] == [1, 1]
+
+    def test_main_rules(self):
+        input_filepath = write_jsonl(
+            [{"id": "a", "text": "There is no evidence of pneumonia.", "ents": [[24, 33, "PROBLEM"]]}]
+        )
+        rules_filepath = path.join(tmpdirname.name, "rules.json")
+        with open(rules_filepath, "w") as f:
+            json.dump({"item_data": [{"literal": "evidence of", "category": "DEFINITE_EXISTENCE", "rule": "FORWARD"}]}, f)
+        output_filepath = path.join(tmpdirname.name, "output_rules.jsonl")
+        main([input_filepath, "-o", output_filepath, "--rules", rules_filepath])
+        with open(output_filepath) as f:
+            results = [json.loads(line) for line in f]
+        ent = results[0]["ents"][0]
+        assert ent["is_negated"] is False
+        assert ent["modifiers"][0]["category"] == "DEFINITE_EXISTENCE"
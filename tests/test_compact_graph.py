@@ -0,0 +1,153 @@
+import spacy
+import srsly
+from spacy.tokens import Span, Doc, DocBin
+
+from cycontext import ConTextComponent
+from cycontext import ConTextItem
+from cycontext.compact_graph import CompactConTextGraph
+from cycontext.context_graph import ConTextGraph
+from cycontext.tag_object import TagObject
+
+nlp = spacy.load("en_core_web_sm")
+
+
+class TestCompactConTextGraph:
+    def process(self, lean=True):
+        item_data = [
+            ConTextItem(
+                "no evidence of",
+                "NEGATED_EXISTENCE",
+                rule="forward",
+                terminated_by={"HISTORICAL"},
+            ),
+            ConTextItem("but", "TERMINATE", rule="TERMINATE"),
+            ConTextItem("history of", "HISTORICAL", rule="forward"),
+        ]
+        context = ConTextComponent(nlp, rules="other", rule_list=item_data, lean=lean)
+        doc = nlp("There is no evidence of pneumonia but there is chf.")
+        doc.ents = (Span(doc, 5, 6, "CONDITION"), Span(doc, 9, 10, "CONDITION"))
+        context(doc)
+        return doc, context
+
+    def test_stores_compact_graph(self):
+        doc, _ = self.process()
+        assert isinstance(
+            doc.user_data[("._.", "context_graph", None, None)], CompactConTextGraph
+        )
+
+    def test_only_keeps_modifiers_with_edges(self):
+        doc, _ = self.process()
+        compact_graph = doc.user_data[("._.", "context_graph", None, None)]
+        assert len(compact_graph.modifiers) == 1
+        assert compact_graph.edges == ((0, 0),)
+
+    def test_modifier_tuple(self):
+        doc, context = self.process()
+        compact_graph = doc.user_data[("._.", "context_graph", None, None)]
+        start, end, category_id, rule_idx, scope_start, scope_end = compact_graph.modifiers[0]
+        assert (start, end) == (2, 5)
+        assert compact_graph.categories[category_id] == "NEGATED_EXISTENCE"
+        assert compact_graph.rules[rule_idx] is context.item_data[0]
+        assert (scope_start, scope_end) == (5, 6)
+
+    def test_rebuilds_graph(self):
+        doc, _ = self.process()
+        graph = doc._.context_graph
+        assert isinstance(graph, ConTextGraph)
+        assert len(graph.edges) == 1
+        target, modifier = graph.edges[0]
+        assert target == doc.ents[0]
+        assert isinstance(modifier, TagObject)
+        assert modifier.span == doc[2:5]
+        assert modifier.scope == doc[5:6]
+
+    def test_rebuilds_span_modifiers(self):
+        doc, _ = self.process()
+        modifiers = doc.ents[0]._.modifiers
+        assert len(modifiers) == 1
+        assert modifiers[0].category == "NEGATED_EXISTENCE"
+        assert doc.ents[1]._.modifiers == ()
+
+    def test_same_edges_as_full_graph(self):
+        lean_doc, _ = self.process(lean=True)
+        full_doc, _ = self.process(lean=False)
+        lean_edges = [
+            (target.start, target.end, modifier.start, modifier.end, modifier.category)
+            for (target, modifier) in lean_doc._.context_graph.edges
+        ]
+        full_edges = [
+            (target.start, target.end, modifier.start, modifier.end, modifier.category)
+            for (target, modifier) in full_doc._.context_graph.edges
+        ]
+        assert lean_edges == full_edges
+
+    def test_attributes_set(self):
+        doc, _ = self.process()
+        assert doc.ents[0]._.is_negated is True
+        assert doc.ents[1]._.is_negated is False
+
+    def test_to_dict_msgpack(self):
+        doc, _ = self.process()
+        compact_graph = doc.user_data[("._.", "context_graph", None, None)]
+        data = compact_graph.to_dict()
+        assert srsly.msgpack_loads(srsly.msgpack_dumps(data)) == data
+
+    def test_to_dict_only_used_rules(self):
+        doc, _ = self.process()
+        data = doc.user_data[("._.", "context_graph", None, None)].to_dict()
+        assert len(data["rules"]) == 1
+        assert data["rules"][0]["literal"] == "no evidence of"
+        assert data["modifiers"][0][3] == 0
+
+    def test_from_dict(self):
+        doc, _ = self.process()
+        compact_graph = doc.user_data[("._.", "context_graph", None, None)]
+        data = srsly.msgpack_loads(srsly.msgpack_dumps(compact_graph.to_dict()), use_list=False)
+        restored = CompactConTextGraph.from_dict(data)
+        assert restored.targets == compact_graph.targets
+        assert restored.modifiers == compact_graph.modifiers
+        assert restored.edges == compact_graph.edges
+        assert restored.rules[0].category == "NEGATED_EXISTENCE"
+        assert restored.rules[0].terminated_by == {"HISTORICAL"}
+        assert restored.rules[0].to_dict() == compact_graph.rules[0].to_dict()
+
+
+class TestSerialization:
+    def process(self):
+        context = ConTextComponent(nlp, serializable=True)
+        doc = nlp("There is no evidence of pneumonia but there is chf.")
+        doc.ents = (Span(doc, 5, 6, "CONDITION"), Span(doc, 9, 10, "CONDITION"))
+        context(doc)
+        return doc
+
+    def test_stores_dict(self):
+        doc = self.process()
+        assert isinstance(doc.user_data[("._.", "context_graph", None, None)], dict)
+
+    def test_to_bytes(self):
+        doc = self.process()
+        new_doc = Doc(nlp.vocab).from_bytes(doc.to_bytes())
+        assert len(new_doc._.context_graph.edges) == 1
+        assert len(new_doc.ents[0]._.modifiers) == 1
+        assert new_doc.ents[0]._.modifiers[0].span == new_doc[2:5]
+        assert new_doc.ents[0]._.is_negated is True
+        assert new_doc.ents[1]._.is_negated is False
+
+    def test_rules_parsed_once(self):
+        doc = self.process()
+        new_doc = Doc(nlp.vocab).from_bytes(doc.to_bytes())
+        (_, modifier) = new_doc._.context_graph.edges[0]
+        assert new_doc.ents[0]._.modifiers[0].context_item is modifier.context_item
+        assert isinstance(new_doc.user_data[("._.", "context_graph", None, None)], dict)
+
+    def test_doc_bin(self):
+        doc = self.process()
+        doc_bin = DocBin(attrs=["ENT_IOB", "ENT_TYPE"], store_user_data=True)
+        doc_bin.add(doc)
+        doc_bin = DocBin(store_user_data=True).from_bytes(doc_bin.to_bytes())
+        (new_doc,) = doc_bin.get_docs(nlp.vocab)
+        target, modifier = new_doc._.context_graph.edges[0]
+        assert (target.start, target.end, target.label_) == (5, 6, "CONDITION")
+        assert modifier.category == "NEGATED_EXISTENCE"
+        assert modifier.scope == new_doc[5:6]
+        assert new_doc.ents[0]._.is_negated is True
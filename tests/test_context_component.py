@@ -1,8 +1,9 @@
 import spacy
-from spacy.tokens import Span
+from spacy.tokens import Doc, Span
 
 from cycontext import ConTextComponent
 from cycontext import ConTextItem
+from cycontext.context_component import LAZY_KEY, MODIFIER_CACHE_KEY, resolve
 
 import pytest
 
@@ -332,3 +333,496 @@ class TestConTextComponent:
         exception_info.match(
             "If 'use_context_window' is True, 'max_scope' must be an integer greater 1, not None"
         )
+
+    def test_lean_does_not_store_tag_objects(self):
+        context = ConTextComponent(nlp, rules=None, lean=True)
+        context.add([ConTextItem("no evidence of", "NEGATED_EXISTENCE", rule="forward")])
+        doc = nlp("There is no evidence of pneumonia.")
+        doc.ents = (doc[-2:-1],)
+        context(doc)
+
+        assert ("._.", "modifiers", doc.ents[0].start_char, doc.ents[0].end_char) not in doc.user_data
+        assert len(doc.ents[0]._.modifiers) == 1
+        assert doc.ents[0]._.is_negated is True
+
+    def test_freeze(self):
+        context = ConTextComponent(nlp, rules=None)
+        item = ConTextItem("no evidence of", "NEGATED_EXISTENCE", rule="forward")
+        context.add([item])
+        context.freeze()
+        assert context.frozen
+        assert context.item_data[0].frozen
+        assert isinstance(context.item_data, tuple)
+        with pytest.raises(RuntimeError):
+            context.add([ConTextItem("history of", "HISTORICAL")])
+        with pytest.raises(AttributeError):
+            context.item_data[0].max_scope = 5
+        # The item which was added is not frozen
+        assert not item.frozen
+        item.max_scope = 5
+
+    def test_reuse_items_after_freeze(self):
+        item = ConTextItem("no evidence of", "NEGATED_EXISTENCE", rule="forward")
+        context = ConTextComponent(nlp, rules=None)
+        context.add([item])
+        context.freeze()
+        other = ConTextComponent(nlp, rules=None, max_scope=2)
+        other.add([item])
+        other.add(context.item_data)
+        assert [other_item.max_scope for other_item in other.item_data] == [2, 2]
+        assert context.item_data[0].max_scope is None
+        context.swap_rules(context.item_data)
+        assert context.item_data[0].frozen
+        doc = nlp("There is no evidence of pneumonia.")
+        doc.ents = (doc[-2:-1],)
+        context(doc)
+        assert doc.ents[0]._.is_negated is True
+
+    def test_pipe_threads_partition_rules(self):
+        context = ConTextComponent(nlp, partition_rules=True)
+        context.freeze()
+        texts = ["There is no evidence of pneumonia.", "History of pneumonia.", "There is pneumonia."] * 20
+
+        def make_docs():
+            for (i, text) in enumerate(texts):
+                doc = nlp(text)
+                doc.ents = (Span(doc, len(doc) - 2, len(doc) - 1, "LABEL_{0}".format(i % 7)),)
+                yield doc
+
+        threaded = list(context.pipe(make_docs(), batch_size=2, n_threads=4))
+        sequential = list(ConTextComponent(nlp).pipe(make_docs()))
+        assert [
+            (doc.ents[0]._.is_negated, doc.ents[0]._.is_historical) for doc in threaded
+        ] == [
+            (doc.ents[0]._.is_negated, doc.ents[0]._.is_historical) for doc in sequential
+        ]
+
+    def test_frozen_still_processes(self):
+        context = ConTextComponent(nlp, rules=None, allowed_types={"PROBLEM"})
+        context.add([ConTextItem("no evidence of", "NEGATED_EXISTENCE", rule="forward")])
+        context.freeze()
+        doc = nlp("There is no evidence of pneumonia.")
+        doc.ents = (Span(doc, 5, 6, "PROBLEM"),)
+        context(doc)
+        assert doc.ents[0]._.is_negated is True
+
+    def test_pipe_threads_requires_frozen(self):
+        context = ConTextComponent(nlp)
+        with pytest.raises(RuntimeError):
+            list(context.pipe([nlp("There is no evidence of pneumonia.")], n_threads=2))
+
+    def test_pipe_threads(self):
+        context = ConTextComponent(nlp)
+        context.freeze()
+        texts = ["There is no evidence of pneumonia.", "History of pneumonia.", "There is pneumonia."] * 10
+
+        def make_docs():
+            for text in texts:
+                doc = nlp(text)
+                doc.ents = (doc[-2:-1],)
+                yield doc
+
+        threaded = list(context.pipe(make_docs(), batch_size=4, n_threads=3))
+        sequential = list(context.pipe(make_docs()))
+        assert [doc.text for doc in threaded] == texts
+        assert [
+            (doc.ents[0]._.is_negated, doc.ents[0]._.is_historical) for doc in threaded
+        ] == [
+            (doc.ents[0]._.is_negated, doc.ents[0]._.is_historical) for doc in sequential
+        ]
+
+    def test_add_returns_rule_ids(self):
+        context = ConTextComponent(nlp, rules=None)
+        rule_ids = context.add(
+            [ConTextItem("no evidence of", "NEGATED_EXISTENCE"), ConTextItem("history of", "HISTORICAL")]
+        )
+        assert rule_ids == [0, 1]
+        assert context.rule_ids == [0, 1]
+
+    def test_remove_rule(self):
+        context = ConTextComponent(nlp, rules=None)
+        (rule_id,) = context.add([ConTextItem("no evidence of", "NEGATED_EXISTENCE", rule="forward")])
+        context.remove(rule_id)
+        assert not context.item_data
+        doc = nlp("There is no evidence of pneumonia.")
+        doc.ents = (doc[-2:-1],)
+        context(doc)
+        assert doc.ents[0]._.is_negated is False
+
+    def test_replace_rule(self):
+        context = ConTextComponent(nlp, rules=None, max_scope=5)
+        (rule_id,) = context.add([ConTextItem("no evidence of", "NEGATED_EXISTENCE", rule="forward")])
+        item = ConTextItem("history of", "HISTORICAL", rule="forward")
+        context.replace(rule_id, item)
+        assert item.max_scope == 5
+        doc = nlp("History of pneumonia.")
+        doc.ents = (doc[-2:-1],)
+        context(doc)
+        assert doc.ents[0]._.is_historical is True
+
+    def test_swap_rules(self):
+        context = ConTextComponent(nlp, rules=None)
+        context.add([ConTextItem("no evidence of", "NEGATED_EXISTENCE", rule="forward")])
+        context.freeze()
+        old_phrase_matcher = context.phrase_matcher
+        version = context.swap_rules([ConTextItem("history of", "HISTORICAL", rule="forward")])
+        assert version == context.rules_version == 1
+        assert context.phrase_matcher is not old_phrase_matcher
+        assert context.frozen
+        assert context.item_data[0].frozen
+        doc = nlp("No evidence of pneumonia.")
+        doc.ents = (doc[-2:-1],)
+        context(doc)
+        assert doc.ents[0]._.is_negated is False
+
+    def test_remove_frozen_fails(self):
+        context = ConTextComponent(nlp)
+        context.freeze()
+        with pytest.raises(RuntimeError):
+            context.remove(context.rule_ids[0])
+
+    def test_chunk_size_same_edges(self):
+        texts = [
+            "No evidence of pneumonia. History of afib. Possible cough, but no fever.",
+            "There is no evidence of CHF, but there is pneumonia. Mother has a history of diabetes.",
+        ]
+
+        def get_results(context):
+            results = []
+            for text in texts:
+                doc = nlp(" ".join([text] * 5))
+                doc.ents = [
+                    Span(doc, token.i, token.i + 1, label="PROBLEM")
+                    for token in doc
+                    if token.lower_ in ("pneumonia", "afib", "cough", "fever", "chf", "diabetes")
+                ]
+                context(doc)
+                results.append(
+                    [
+                        (target.start, modifier.start, modifier.end, modifier.category, modifier.scope.start, modifier.scope.end)
+                        for (target, modifier) in doc._.context_graph.edges
+                    ]
+                )
+            return results
+
+        expected = get_results(ConTextComponent(nlp))
+        for chunk_size in (1, 5, 20):
+            assert get_results(ConTextComponent(nlp, chunk_size=chunk_size)) == expected
+
+    def test_chunk_size_context_window(self):
+        text = " ".join(["No evidence of pneumonia. History of afib."] * 5)
+        results = []
+        for context in (
+            ConTextComponent(nlp, use_context_window=True, max_scope=3),
+            ConTextComponent(nlp, use_context_window=True, max_scope=3, chunk_size=4),
+        ):
+            doc = nlp(text)
+            doc.ents = [
+                Span(doc, token.i, token.i + 1, label="PROBLEM")
+                for token in doc
+                if token.lower_ in ("pneumonia", "afib")
+            ]
+            context(doc)
+            results.append([(ent._.is_negated, ent._.is_historical) for ent in doc.ents])
+        assert results[0] == results[1]
+        assert results[0][0] == (True, False)
+
+    def test_chunk_regions(self):
+        context = ConTextComponent(nlp, chunk_size=5)
+        doc = nlp("No evidence of pneumonia. History of afib. No cough.")
+        matches = context._rules.match(doc, suppress_subsumed=True)
+        regions = context._chunk_regions(doc, doc.ents, matches, context._rules)
+        assert len(regions) > 1
+        assert regions[0][0] == 0
+        assert regions[-1][1] == len(doc)
+        for ((_, core_end, _, _), (next_start, _, _, _)) in zip(regions, regions[1:]):
+            assert core_end == next_start
+
+    def test_chunk_size_bad_value(self):
+        with pytest.raises(ValueError):
+            ConTextComponent(nlp, chunk_size=0)
+
+    def test_lazy(self):
+        context = ConTextComponent(nlp, lazy=True)
+        doc = nlp("There is no evidence of pneumonia.")
+        doc.ents = (Span(doc, 5, 6, label="PROBLEM"),)
+        context(doc)
+        assert LAZY_KEY in doc.user_data
+        assert doc.ents[0]._.is_negated is True
+        assert LAZY_KEY not in doc.user_data
+        assert len(doc._.context_graph.edges) == 1
+
+    def test_lazy_context_graph(self):
+        context = ConTextComponent(nlp, lazy=True)
+        doc = nlp("There is no evidence of pneumonia.")
+        doc.ents = (Span(doc, 5, 6, label="PROBLEM"),)
+        context(doc)
+        assert len(doc._.context_graph.edges) == 1
+        assert doc.ents[0]._.modifiers[0].category == "NEGATED_EXISTENCE"
+
+    def test_lazy_resolve(self):
+        context = ConTextComponent(nlp, lazy=True, serializable=True)
+        doc = nlp("History of pneumonia.")
+        doc.ents = (Span(doc, 2, 3, label="PROBLEM"),)
+        context(doc)
+        resolve(doc)
+        assert LAZY_KEY not in doc.user_data
+        doc2 = Doc(nlp.vocab).from_bytes(doc.to_bytes())
+        assert doc2.ents[0]._.is_historical is True
+
+    def test_lazy_uses_rules_at_call(self):
+        context = ConTextComponent(nlp, rules=None, lazy=True)
+        context.add([ConTextItem("no evidence of", "NEGATED_EXISTENCE", rule="forward")])
+        doc = nlp("There is no evidence of pneumonia.")
+        doc.ents = (Span(doc, 5, 6, label="PROBLEM"),)
+        context(doc)
+        context.swap_rules([ConTextItem("history of", "HISTORICAL", rule="forward")])
+        assert doc.ents[0]._.is_negated is True
+
+    def test_partition_rules_skips_irrelevant(self):
+        context = ConTextComponent(nlp, rules=None, partition_rules=True)
+        context.add(
+            [
+                ConTextItem("no evidence of", "NEGATED_EXISTENCE", rule="forward", allowed_types={"PROBLEM"}),
+                ConTextItem("history of", "HISTORICAL", rule="forward", allowed_types={"TREATMENT"}),
+            ]
+        )
+        doc = nlp("No evidence of pneumonia. History of surgery.")
+        doc.ents = (Span(doc, 3, 4, label="PROBLEM"),)
+        context(doc)
+        assert doc.ents[0]._.is_negated is True
+        assert [modifier.category for modifier in doc._.context_graph.modifiers] == ["NEGATED_EXISTENCE"]
+
+    def test_partition_rules_keeps_terminate(self):
+        context = ConTextComponent(nlp, rules=None, partition_rules=True)
+        context.add(
+            [
+                ConTextItem("no evidence of", "NEGATED_EXISTENCE", rule="forward", allowed_types={"PROBLEM"}),
+                ConTextItem("but", "CONJ", rule="terminate", allowed_types={"TREATMENT"}),
+            ]
+        )
+        doc = nlp("No evidence of CHF but pneumonia.")
+        doc.ents = (Span(doc, 3, 4, label="PROBLEM"), Span(doc, 5, 6, label="PROBLEM"))
+        context(doc)
+        assert doc.ents[0]._.is_negated is True
+        assert doc.ents[1]._.is_negated is False
+
+    def test_partition_rules_negated_token(self):
+        item_data = [
+            ConTextItem(
+                "no x pneumonia",
+                "NEGATED_EXISTENCE",
+                pattern=[{"LOWER": "no"}, {"LOWER": "x", "OP": "!"}, {"LOWER": "pneumonia"}],
+                allowed_types={"OTHER"},
+            ),
+            ConTextItem("y pneumonia history", "HISTORICAL", allowed_types={"PROBLEM"}),
+        ]
+        edges = []
+        for partition_rules in (False, True):
+            context = ConTextComponent(nlp, rules=None, partition_rules=partition_rules)
+            context.add(item_data)
+            doc = nlp("no y pneumonia history of chf")
+            doc.ents = (Span(doc, 5, 6, label="PROBLEM"),)
+            context(doc)
+            edges.append(
+                [(target.text, modifier.category) for (target, modifier) in doc._.context_graph.edges]
+            )
+        # The pattern prunes the overlapping literal, so neither mode has an edge
+        assert edges == [[], []]
+
+    def test_partition_rules_no_targets(self):
+        context = ConTextComponent(nlp, partition_rules=True)
+        doc = nlp("No evidence of pneumonia.")
+        context(doc)
+        graph = doc._.context_graph
+        assert len(graph.targets) == 0
+        assert graph.modifiers == []
+        assert graph.edges == []
+
+    def test_rule_sets(self):
+        history_rules = [ConTextItem("history of", "HISTORICAL", rule="FORWARD")]
+        context = ConTextComponent(nlp, rule_sets={"history": history_rules})
+        assert context.rule_sets == ["history"]
+        doc = nlp("There is no history of pneumonia.")
+        doc.ents = (Span(doc, 5, 6, label="PROBLEM"),)
+        context(doc)
+        # The main rules are pruned without the rules of the other rule set
+        assert [modifier.category for (_, modifier) in doc._.context_graph.edges] == [
+            "NEGATED_EXISTENCE"
+        ]
+        graphs = doc._.context_graphs
+        assert list(graphs) == ["history"]
+        assert [modifier.category for (_, modifier) in graphs["history"].edges] == [
+            "HISTORICAL"
+        ]
+        # Only the main rules set the assertion attributes
+        assert doc.ents[0]._.is_negated is True
+        assert doc.ents[0]._.is_historical is False
+        assert [modifier.category for modifier in doc.ents[0]._.modifiers] == [
+            "NEGATED_EXISTENCE"
+        ]
+
+    def test_rule_sets_same_edges(self):
+        texts = [
+            "There is no evidence of pneumonia.",
+            "History of pneumonia, possible cough.",
+            "Family history of afib and no fever.",
+        ]
+        history_rules = [
+            ConTextItem("history of", "HISTORICAL", rule="FORWARD"),
+            ConTextItem("family history of", "FAMILY", rule="FORWARD"),
+        ]
+        combined = ConTextComponent(nlp, lean=True)
+        combined.add_rule_set("history", history_rules)
+        separate = ConTextComponent(nlp, rules="other", rule_list=list(history_rules))
+
+        def make_doc(text):
+            doc = nlp(text)
+            doc.ents = [
+                Span(doc, token.i, token.i + 1, label="PROBLEM")
+                for token in doc
+                if token.lower_ in ("pneumonia", "cough", "afib", "fever")
+            ]
+            return doc
+
+        for text in texts:
+            doc = combined(make_doc(text))
+            other = separate(make_doc(text))
+            assert sorted(
+                (target.start, modifier.start, modifier.category)
+                for (target, modifier) in doc._.context_graphs["history"].edges
+            ) == sorted(
+                (target.start, modifier.start, modifier.category)
+                for (target, modifier) in other._.context_graph.edges
+            )
+
+    def test_rule_sets_swap_rules(self):
+        context = ConTextComponent(nlp, rules=None)
+        context.add_rule_set("history", [ConTextItem("history of", "HISTORICAL", rule="FORWARD")])
+        context.swap_rules([ConTextItem("no", "NEGATED_EXISTENCE", rule="FORWARD")])
+        assert context.rule_sets == ["history"]
+        assert len(context.item_data) == 2
+
+    def test_add_rule_set_bad_name(self):
+        context = ConTextComponent(nlp, rules=None)
+        with pytest.raises(ValueError):
+            context.add_rule_set("", [ConTextItem("no", "NEGATED_EXISTENCE")])
+
+    def test_no_rule_sets(self):
+        context = ConTextComponent(nlp)
+        doc = context(nlp("No evidence of pneumonia."))
+        assert doc._.context_graphs is None
+
+    def test_prefilter_same_edges(self):
+        texts = [
+            "There is no evidence of pneumonia.",
+            "The patient was seen today for pneumonia.",
+            "History of afib. BP 120/80 HR 72 RR 16 SpO2 98% Temp 98.6 WBC 7.2 Hgb 13.1 Plt 250.",
+        ]
+        context = ConTextComponent(nlp)
+        prefiltered = ConTextComponent(nlp, prefilter=True)
+        assert prefiltered.prefilter is True
+
+        def make_doc(text):
+            doc = nlp(text)
+            doc.ents = [
+                Span(doc, token.i, token.i + 1, label="PROBLEM")
+                for token in doc
+                if token.lower_ in ("pneumonia", "afib")
+            ]
+            return doc
+
+        for text in texts:
+            doc = context(make_doc(text))
+            other = prefiltered(make_doc(text))
+            assert [
+                (target.start, modifier.start, modifier.category)
+                for (target, modifier) in doc._.context_graph.edges
+            ] == [
+                (target.start, modifier.start, modifier.category)
+                for (target, modifier) in other._.context_graph.edges
+            ]
+
+
+    def test_update(self):
+        context = ConTextComponent(nlp)
+
+        def make_doc(text):
+            doc = nlp(text)
+            doc.ents = [
+                Span(doc, token.i, token.i + 1, label="PROBLEM")
+                for token in doc
+                if token.lower_ in ("pneumonia", "afib", "cough")
+            ]
+            return doc
+
+        prev_doc = context(make_doc("There is evidence of pneumonia. History of afib. Possible cough."))
+        # Replace "evidence" with "no evidence"
+        doc = context.update(
+            make_doc("There is no evidence of pneumonia. History of afib. Possible cough."),
+            prev_doc,
+            2,
+            3,
+            4,
+        )
+        expected = context(
+            make_doc("There is no evidence of pneumonia. History of afib. Possible cough.")
+        )
+        assert [
+            (target.start, modifier.start, modifier.category)
+            for (target, modifier) in doc._.context_graph.edges
+        ] == [
+            (target.start, modifier.start, modifier.category)
+            for (target, modifier) in expected._.context_graph.edges
+        ]
+        assert doc.ents[0]._.is_negated is True
+        assert doc.ents[1]._.is_historical is True
+        assert prev_doc.ents[0]._.is_negated is False
+
+    def test_update_bad_range(self):
+        context = ConTextComponent(nlp)
+        prev_doc = context(nlp("There is no evidence of pneumonia."))
+        with pytest.raises(ValueError):
+            context.update(nlp("There is evidence of pneumonia."), prev_doc, 2, 3, 3)
+
+    def test_rerun_clears_stale_attributes(self):
+        context = ConTextComponent(nlp)
+        doc = nlp("There is no evidence of pneumonia or afib.")
+        doc.ents = [Span(doc, 5, 6, "PROBLEM")]
+        context(doc)
+        assert doc.ents[0]._.is_negated is True
+        doc.ents = [Span(doc, 7, 8, "PROBLEM")]
+        context(doc)
+        old_target = Span(doc, 5, 6, "PROBLEM")
+        assert old_target._.is_negated is False
+        assert old_target._.modifiers == ()
+        assert len(doc.ents[0]._.modifiers) == 1
+
+    def test_cache_modifiers(self):
+        context = ConTextComponent(nlp, cache_modifiers=True)
+        doc = nlp("There is no evidence of pneumonia. History of afib.")
+        doc.ents = [Span(doc, 5, 6, "PROBLEM")]
+        context(doc)
+        cached = doc.user_data[MODIFIER_CACHE_KEY]
+        doc.ents = [Span(doc, 5, 6, "PROBLEM"), Span(doc, 9, 10, "PROBLEM")]
+        context(doc)
+        # The modifiers were not matched again
+        assert doc.user_data[MODIFIER_CACHE_KEY] is cached
+        assert doc.ents[0]._.is_negated is True
+        assert doc.ents[1]._.is_historical is True
+        assert len(doc.ents[0]._.modifiers) == 1
+
+    def test_cache_modifiers_rules_changed(self):
+        context = ConTextComponent(nlp, rules=None, cache_modifiers=True)
+        context.add([ConTextItem("no evidence of", "NEGATED_EXISTENCE", rule="FORWARD")])
+        doc = nlp("There is no evidence of pneumonia. History of afib.")
+        doc.ents = [Span(doc, 5, 6, "PROBLEM"), Span(doc, 9, 10, "PROBLEM")]
+        context(doc)
+        assert doc.ents[1]._.is_historical is False
+        context.add([ConTextItem("history of", "HISTORICAL", rule="FORWARD")])
+        context(doc)
+        assert doc.ents[1]._.is_historical is True
+
+    def test_cache_modifiers_serializable(self):
+        with pytest.raises(ValueError):
+            ConTextComponent(nlp, cache_modifiers=True, serializable=True)
@@ -55,6 +55,23 @@ class TestConTextGraph:
         graph.update_scopes()
         assert graph.modifiers[0].scope == doc[5:6]
 
+    def test_update_scopes_deadline(self):
+        doc, graph = self.context_graph()
+        graph.targets = [doc[5:6]]  # "pneumonia"
+        graph.apply_modifiers()
+        assert graph.update_scopes(deadline=0) is False
+
+    def test_apply_modifiers_index_targets(self):
+        doc, graph = self.context_graph()
+        graph.targets = [doc[5:6], doc[10:11]]  # "pneumonia", "chf"
+        graph.apply_modifiers()
+        indexed_doc, indexed_graph = self.context_graph()
+        indexed_graph.targets = [indexed_doc[5:6], indexed_doc[10:11]]
+        indexed_graph.apply_modifiers(index_targets=True)
+        assert [(target.start, modifier.start) for (target, modifier) in indexed_graph.edges] == [
+            (target.start, modifier.start) for (target, modifier) in graph.edges
+        ]
+
     def test_remove_modifiers_overlap_target(self):
         """Test that a modifier which overlaps with a target is removed when set to True."""
         doc = nlp("The patient has heart failure.")
@@ -103,6 +103,27 @@ class TestItemData:
         item = ConTextItem("no evidence of", "NEGATED_EXISTENCE", "FORWARD", terminated_by={"POSITIVE_EXISTENCE"})
         assert item.terminated_by == {"POSITIVE_EXISTENCE"}
 
+    def test_freeze(self):
+        item = ConTextItem(
+            "no evidence of", "NEGATED_EXISTENCE", allowed_types={"problem"}, terminated_by={"positive_existence"}
+        )
+        item.freeze()
+        assert item.frozen
+        assert item.allowed_types == frozenset({"PROBLEM"})
+        assert item.terminated_by == frozenset({"POSITIVE_EXISTENCE"})
+        with pytest.raises(AttributeError):
+            item.category = "OTHER"
+
+    def test_copy_frozen(self):
+        item = ConTextItem("no evidence of", "NEGATED_EXISTENCE", allowed_types={"problem"})
+        item.freeze()
+        item_copy = item.copy()
+        assert not item_copy.frozen
+        item_copy.allowed_types.add("TREATMENT")
+        item_copy.terminated_by.add("HISTORICAL")
+        assert item.allowed_types == frozenset({"PROBLEM"})
+        assert item.terminated_by == frozenset()
+
 
 @pytest.fixture
 def from_json_file():
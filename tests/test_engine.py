@@ -0,0 +1,144 @@
+import pytest
+import spacy
+from spacy.tokens import Span
+
+from cycontext import ConTextComponent
+from cycontext import ConTextItem
+from cycontext.engine import ConTextEngine, ENGINE_EDGE_COLUMNS
+
+nlp = spacy.load("en_core_web_sm")
+
+
+def edge_tuples(edges):
+    return list(
+        zip(*(edges[name].tolist() for name in ENGINE_EDGE_COLUMNS))
+    )
+
+
+class TestConTextEngine:
+    def test_init(self):
+        assert ConTextEngine([ConTextItem("no evidence of", "NEGATED_EXISTENCE")])
+
+    def test_call(self):
+        engine = ConTextEngine(
+            [ConTextItem("no evidence of", "NEGATED_EXISTENCE", rule="forward")]
+        )
+        tokens = ["there", "is", "no", "evidence", "of", "pneumonia", "."]
+        sent_starts = [True, False, False, False, False, False, False]
+        edges = engine(tokens, sent_starts, [(5, 6, "PROBLEM")])
+        assert set(edges.keys()) == set(ENGINE_EDGE_COLUMNS)
+        assert edge_tuples(edges) == [(0, 2, 5, 0, 0, 5, 7)]
+
+    def test_no_edges(self):
+        engine = ConTextEngine([ConTextItem("no evidence of", "NEGATED_EXISTENCE")])
+        edges = engine(["there", "is", "pneumonia"], None, [(2, 3, "PROBLEM")])
+        assert all(len(array) == 0 for array in edges.values())
+
+    def test_token_ids(self):
+        strings = ["there", "is", "no", "evidence", "of", "pneumonia"]
+        engine = ConTextEngine(
+            [ConTextItem("no evidence of", "NEGATED_EXISTENCE", rule="forward")],
+            strings=strings,
+        )
+        edges = engine([0, 1, 2, 3, 4, 5], None, [(5, 6, "PROBLEM")])
+        assert edges["modifier_start"].tolist() == [2]
+
+    def test_token_ids_without_strings_fails(self):
+        engine = ConTextEngine([ConTextItem("no evidence of", "NEGATED_EXISTENCE")])
+        with pytest.raises(ValueError):
+            engine([0, 1, 2], None, [])
+
+    def test_pattern(self):
+        item = ConTextItem(
+            "no evidence of",
+            "NEGATED_EXISTENCE",
+            rule="forward",
+            pattern=[
+                {"LOWER": {"IN": ["no", "without"]}},
+                {"LOWER": "evidence", "OP": "?"},
+                {"LOWER": "of"},
+            ],
+        )
+        engine = ConTextEngine([item], prune=False)
+        edges = engine(["without", "of", "chf"], None, [(2, 3, "PROBLEM")])
+        assert edges["modifier_end"].tolist() == [2]
+
+    def test_unsupported_pattern_attribute(self):
+        item = ConTextItem(
+            "is negative",
+            "NEGATED_EXISTENCE",
+            pattern=[{"LEMMA": "be"}, {"LOWER": "negative"}],
+        )
+        with pytest.raises(ValueError):
+            ConTextEngine([item])
+
+    def test_callbacks_not_supported(self):
+        item = ConTextItem(
+            "no", "NEGATED_EXISTENCE", on_modifies=lambda target, modifier, span: True
+        )
+        with pytest.raises(ValueError):
+            ConTextEngine([item])
+
+    def test_does_not_modify_items(self):
+        item = ConTextItem("no", "NEGATED_EXISTENCE")
+        ConTextEngine([item], allowed_types={"PROBLEM"}, max_scope=2)
+        assert item.allowed_types is None
+        assert item.max_scope is None
+
+    def test_termination(self):
+        engine = ConTextEngine(
+            [
+                ConTextItem("no evidence of", "NEGATED_EXISTENCE", rule="forward"),
+                ConTextItem("but", "TERMINATE", rule="TERMINATE"),
+            ]
+        )
+        tokens = "there is no evidence of pneumonia but there is chf .".split()
+        edges = engine(tokens, None, [(5, 6, "PROBLEM"), (9, 10, "PROBLEM")])
+        assert edges["target"].tolist() == [0]
+
+    @pytest.mark.parametrize(
+        "kwargs",
+        [
+            {},
+            {"max_scope": 2},
+            {"max_targets": 1},
+            {"use_context_window": True, "max_scope": 3},
+            {"remove_overlapping_modifiers": True},
+            {"allowed_types": {"PROBLEM"}},
+        ],
+    )
+    def test_same_edges_as_component(self, kwargs):
+        context = ConTextComponent(nlp, **kwargs)
+        engine = ConTextEngine.from_component(context)
+        texts = [
+            "There is no evidence of pneumonia or chf but there is copd.",
+            "History of afib, possible mass vs cyst. Mother has diabetes.",
+            "Negative for flu, rule out covid.",
+        ]
+        for text in texts:
+            doc = nlp(text)
+            doc.ents = [
+                Span(doc, token.i, token.i + 1, "PROBLEM" if token.i % 2 else "TREATMENT")
+                for token in doc
+                if token.lower_ in ("pneumonia", "chf", "copd", "afib", "mass", "cyst", "diabetes", "flu", "covid")
+            ]
+            targets = [(ent.start, ent.end, ent.label_) for ent in doc.ents]
+            edges = engine(
+                [token.lower_ for token in doc],
+                [token.is_sent_start for token in doc],
+                targets,
+            )
+            context(doc)
+            expected = [
+                (
+                    targets.index((target.start, target.end, target.label_)),
+                    modifier.start,
+                    modifier.end,
+                    engine.categories.index(modifier.category),
+                    context.item_data.index(modifier.context_item),
+                    modifier._scope_start,
+                    modifier._scope_end,
+                )
+                for (target, modifier) in doc._.context_graph.edges
+            ]
+            assert edge_tuples(edges) == expected
@@ -0,0 +1,90 @@
+import tempfile
+from os import path
+
+import numpy as np
+import pytest
+import spacy
+from spacy.tokens import Span
+
+from cycontext import ConTextComponent
+from cycontext import ConTextItem
+from cycontext.export import (
+    EDGE_COLUMNS,
+    edges_to_arrays,
+    iter_edge_batches,
+    write_parquet,
+)
+
+nlp = spacy.load("en_core_web_sm")
+
+tmpdirname = tempfile.TemporaryDirectory()
+
+
+class TestExport:
+    def process(self, lean=False):
+        item_data = [
+            ConTextItem("no evidence of", "NEGATED_EXISTENCE", rule="forward"),
+            ConTextItem("history of", "HISTORICAL", rule="forward"),
+        ]
+        context = ConTextComponent(nlp, rules="other", rule_list=item_data, lean=lean)
+        docs = []
+        for text in [
+            "There is no evidence of pneumonia or chf.",
+            "There is pneumonia.",
+            "History of afib.",
+        ]:
+            doc = nlp(text)
+            docs.append(doc)
+        docs[0].ents = (Span(docs[0], 5, 6, "CONDITION"), Span(docs[0], 7, 8, "CONDITION"))
+        docs[1].ents = (Span(docs[1], 2, 3, "CONDITION"),)
+        docs[2].ents = (Span(docs[2], 2, 3, "CONDITION"),)
+        return [context(doc) for doc in docs]
+
+    def test_columns(self):
+        columns = edges_to_arrays(self.process())
+        assert tuple(columns.keys()) == EDGE_COLUMNS
+        for array in columns.values():
+            assert isinstance(array, np.ndarray)
+            assert len(array) == 3
+
+    def test_values(self):
+        docs = self.process()
+        columns = edges_to_arrays(docs, doc_ids=["a", "b", "c"])
+        assert list(columns["doc_id"]) == ["a", "a", "c"]
+        assert list(columns["category"]) == ["NEGATED_EXISTENCE", "NEGATED_EXISTENCE", "HISTORICAL"]
+        assert list(columns["rule"]) == ["FORWARD", "FORWARD", "FORWARD"]
+        assert columns["target_start_char"][0] == docs[0][5].idx
+        assert columns["modifier_start_char"][0] == docs[0][2].idx
+        assert columns["modifier_end_char"][0] == docs[0][2:5].end_char
+        assert columns["scope_start_char"][0] == docs[0][5].idx
+        assert columns["scope_end_char"][0] == docs[0][5:9].end_char
+        assert columns["target_start_char"].dtype == np.int64
+
+    def test_lean_same_as_full(self):
+        full = edges_to_arrays(self.process(lean=False))
+        lean = edges_to_arrays(self.process(lean=True))
+        for name in EDGE_COLUMNS:
+            assert list(full[name]) == list(lean[name])
+
+    def test_empty(self):
+        columns = edges_to_arrays([])
+        assert all(len(array) == 0 for array in columns.values())
+
+    def test_batches(self):
+        batches = list(iter_edge_batches(self.process(), batch_size=2))
+        assert [len(batch["doc_id"]) for batch in batches] == [2, 1]
+
+    def test_bad_batch_size(self):
+        with pytest.raises(ValueError):
+            list(iter_edge_batches(self.process(), batch_size=0))
+
+    def test_write_parquet(self):
+        pq = pytest.importorskip("pyarrow.parquet")
+        filepath = path.join(tmpdirname.name, "edges.parquet")
+        num_rows = write_parquet(self.process(), filepath, row_group_size=2)
+        assert num_rows == 3
+        parquet_file = pq.ParquetFile(filepath)
+        assert parquet_file.num_row_groups == 2
+        table = parquet_file.read()
+        assert table.column_names == list(EDGE_COLUMNS)
+        assert table.column("category").to_pylist()[-1] == "HISTORICAL"
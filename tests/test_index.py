@@ -0,0 +1,109 @@
+import tempfile
+
+import pytest
+import spacy
+from spacy.tokens import Span
+
+from cycontext import ConTextComponent
+from cycontext.index import AssertionIndex, Term, normalize_text
+
+nlp = spacy.load("en_core_web_sm")
+context = ConTextComponent(nlp)
+
+TEXTS = [
+    "There is no evidence of pneumonia.",
+    "History of pneumonia.",
+    "There is no history of pneumonia.",
+    "Patient has pneumonia and no CHF.",
+]
+
+
+def make_docs(texts):
+    docs = []
+    for text in texts:
+        doc = nlp(text)
+        doc.ents = [
+            Span(doc, token.i, token.i + 1, label=token.text.upper())
+            for token in doc
+            if token.lower_ in ("pneumonia", "chf")
+        ]
+        docs.append(context(doc))
+    return docs
+
+
+class TestAssertionIndex:
+    def test_term(self):
+        with tempfile.TemporaryDirectory() as directory:
+            index = AssertionIndex(directory)
+            index.add(make_docs(TEXTS))
+            assert index.search(Term("PNEUMONIA", "NEGATED_EXISTENCE"), level="doc") == [0, 2]
+            assert index.search(Term("PNEUMONIA", "negated_existence")) == [(0, 24, 33), (2, 23, 32)]
+            assert index.search(Term("PNEUMONIA"), level="doc") == [0, 1, 2, 3]
+
+    def test_boolean_query(self):
+        with tempfile.TemporaryDirectory() as directory:
+            index = AssertionIndex(directory)
+            index.add(make_docs(TEXTS))
+            query = Term("PNEUMONIA", "NEGATED_EXISTENCE") & ~Term("PNEUMONIA", "HISTORICAL")
+            assert index.search(query, level="doc") == [0, 2]
+            query = Term("PNEUMONIA") - Term("PNEUMONIA", "NEGATED_EXISTENCE")
+            assert index.search(query, level="doc") == [1, 3]
+            query = Term("CHF", "NEGATED_EXISTENCE") | Term("PNEUMONIA", "HISTORICAL")
+            assert index.search(query, level="doc") == [1, 3]
+
+    def test_mention_level(self):
+        with tempfile.TemporaryDirectory() as directory:
+            index = AssertionIndex(directory)
+            index.add(make_docs(TEXTS))
+            query = Term("PNEUMONIA") & Term("CHF", "NEGATED_EXISTENCE")
+            assert index.search(query, level="doc") == [3]
+            assert index.search(query, level="mention") == []
+
+    def test_text_field(self):
+        with tempfile.TemporaryDirectory() as directory:
+            index = AssertionIndex(directory)
+            index.add(make_docs(TEXTS))
+            assert index.search(Term("Pneumonia ", "HISTORICAL", field="text"), level="doc") == [1]
+
+    def test_incremental_add(self):
+        with tempfile.TemporaryDirectory() as directory:
+            index = AssertionIndex(directory)
+            index.add(make_docs(TEXTS[:2]))
+            assert index.search(Term("PNEUMONIA", "NEGATED_EXISTENCE"), level="doc") == [0]
+            index.add(make_docs(TEXTS[2:]))
+            assert index.segments == ["segment-000000.idx", "segment-000001.idx"]
+            assert index.search(Term("PNEUMONIA", "NEGATED_EXISTENCE"), level="doc") == [0, 2]
+
+            # Reopen the index from disk
+            reopened = AssertionIndex(directory)
+            assert len(reopened) == 4
+            assert reopened.search(Term("PNEUMONIA", "NEGATED_EXISTENCE"), level="doc") == [0, 2]
+
+    def test_postings_mapped(self):
+        with tempfile.TemporaryDirectory() as directory:
+            index = AssertionIndex(directory)
+            index.add(make_docs(TEXTS), doc_ids=["a", "b", "c", "d"])
+            assert index.postings("label", "PNEUMONIA", "HISTORICAL") == [("b", 11, 20)]
+            assert index.postings("label", "FEVER") == []
+            (segment,) = index._segments
+            # The posting lists are read from the mapped file and are not owned by the arrays
+            assert not segment.arrays[0].flags.owndata
+            index.close()
+            assert index.search(Term("PNEUMONIA", "HISTORICAL"), level="doc") == ["b"]
+            index.close()
+
+    def test_doc_ids(self):
+        with tempfile.TemporaryDirectory() as directory:
+            index = AssertionIndex(directory)
+            index.add(make_docs(TEXTS[:2]), doc_ids=["a", "b"])
+            assert index.search(Term("PNEUMONIA", "HISTORICAL"), level="doc") == ["b"]
+            assert index.search(~Term("PNEUMONIA", "HISTORICAL"), level="doc") == ["a"]
+
+    def test_bad_level(self):
+        with tempfile.TemporaryDirectory() as directory:
+            index = AssertionIndex(directory)
+            with pytest.raises(ValueError):
+                index.search(Term("PNEUMONIA"), level="sentence")
+
+    def test_normalize_text(self):
+        assert normalize_text(" Congestive  Heart\nFailure ") == "congestive heart failure"
@@ -0,0 +1,208 @@
+import pytest
+import spacy
+from spacy.attrs import FLAG19, FLAG63
+from spacy.errors import MatchPatternError
+
+from cycontext import ConTextItem
+from cycontext.rule_set import (
+    ConTextRuleSet,
+    build_trigger_filter,
+    compile_regex_predicates,
+    get_regex_flag,
+)
+
+nlp = spacy.load("en_core_web_sm")
+
+
+class TestConTextRuleSet:
+    def create_rule_set(self):
+        rule_set = ConTextRuleSet(nlp)
+        item_data = [
+            ConTextItem("no evidence of", "NEGATED_EXISTENCE", rule="forward"),
+            ConTextItem("history of", "HISTORICAL", rule="forward"),
+            ConTextItem(
+                "possible", "POSSIBLE_EXISTENCE", pattern=[{"LOWER": {"IN": ["possible", "probable"]}}]
+            ),
+        ]
+        rule_ids = rule_set.add(item_data)
+        return rule_set, item_data, rule_ids
+
+    def test_add(self):
+        rule_set, item_data, rule_ids = self.create_rule_set()
+        assert rule_ids == [0, 1, 2]
+        assert rule_set.item_data == item_data
+        assert rule_set.categories == {"NEGATED_EXISTENCE", "HISTORICAL", "POSSIBLE_EXISTENCE"}
+        assert len(rule_set) == 3
+
+    def test_match(self):
+        rule_set, item_data, _ = self.create_rule_set()
+        matches = rule_set.match(nlp("No evidence of pneumonia, possible history of afib."))
+        assert [(item.category, start, end) for (item, start, end) in matches] == [
+            ("NEGATED_EXISTENCE", 0, 3),
+            ("POSSIBLE_EXISTENCE", 5, 6),
+            ("HISTORICAL", 6, 8),
+        ]
+
+    def test_remove(self):
+        rule_set, item_data, rule_ids = self.create_rule_set()
+        old_item_data = rule_set.item_data
+        assert rule_set.remove(rule_ids[0]) is item_data[0]
+        assert rule_set.rule_ids == [1, 2]
+        assert rule_set.item_data == item_data[1:]
+        assert rule_set.rule_indices[id(item_data[1])] == 0
+        assert "NEGATED_EXISTENCE" not in rule_set.categories
+        assert rule_set.match(nlp("no evidence of pneumonia")) == []
+        # Earlier references to the list of ConTextItems are not changed
+        assert old_item_data == item_data
+
+    def test_remove_pattern(self):
+        rule_set, _, rule_ids = self.create_rule_set()
+        rule_set.remove(rule_ids[2])
+        assert rule_set.match(nlp("possible pneumonia")) == []
+
+    def test_remove_missing(self):
+        rule_set, _, _ = self.create_rule_set()
+        with pytest.raises(KeyError):
+            rule_set.remove(10)
+
+    def test_reuses_rule_ids(self):
+        rule_set, _, rule_ids = self.create_rule_set()
+        rule_set.remove(rule_ids[1])
+        assert rule_set.add([ConTextItem("denies", "NEGATED_EXISTENCE")]) == [1]
+        assert rule_set.add([ConTextItem("family history of", "FAMILY")]) == [3]
+
+    def test_replace(self):
+        rule_set, item_data, rule_ids = self.create_rule_set()
+        new_item = ConTextItem("no signs of", "NEGATED_EXISTENCE", rule="forward")
+        assert rule_set.replace(rule_ids[0], new_item) is item_data[0]
+        assert rule_set.get(rule_ids[0]) is new_item
+        assert rule_set.rule_ids == rule_ids
+        matches = rule_set.match(nlp("no evidence of pneumonia, no signs of chf"))
+        assert [(item, start, end) for (item, start, end) in matches] == [(new_item, 5, 8)]
+
+    def test_freeze(self):
+        rule_set, item_data, rule_ids = self.create_rule_set()
+        rule_set.freeze()
+        assert isinstance(rule_set.item_data, tuple)
+        assert all(item.frozen for item in rule_set.item_data)
+        assert not any(item.frozen for item in item_data)
+        doc = nlp("There is no evidence of pneumonia.")
+        assert all(item in rule_set.item_data for (item, _, _) in rule_set.match(doc))
+        with pytest.raises(RuntimeError):
+            rule_set.add([ConTextItem("denies", "NEGATED_EXISTENCE")])
+        with pytest.raises(RuntimeError):
+            rule_set.remove(rule_ids[0])
+
+    def test_match_labels(self):
+        rule_set = ConTextRuleSet(nlp)
+        rule_set.add(
+            [
+                ConTextItem("no evidence of", "NEGATED_EXISTENCE", allowed_types={"PROBLEM"}),
+                ConTextItem("history of", "HISTORICAL", allowed_types={"TREATMENT"}),
+                ConTextItem("possible", "POSSIBLE_EXISTENCE", excluded_types={"TREATMENT"}),
+            ]
+        )
+        doc = nlp("No evidence of pneumonia, possible history of surgery.")
+        categories = lambda labels: [
+            item.category for (item, _, _) in rule_set.match(doc, labels=frozenset(labels))
+        ]
+        assert categories(["PROBLEM"]) == ["NEGATED_EXISTENCE", "POSSIBLE_EXISTENCE"]
+        assert categories(["TREATMENT"]) == ["HISTORICAL"]
+        assert categories([]) == []
+        assert len(rule_set.match(doc)) == 3
+
+    def test_compile_regex_predicates(self):
+        pattern = [{"LOWER": {"REGEX": "^re-?demonstrat"}}, {"LOWER": "of", "OP": "?"}]
+        compiled = compile_regex_predicates(pattern, nlp.vocab)
+        (flag_id,) = compiled[0].keys()
+        assert isinstance(flag_id, int)
+        assert compiled[1] == {"LOWER": "of", "OP": "?"}
+        # The same flag is reused
+        assert compile_regex_predicates(pattern, nlp.vocab) == compiled
+        assert nlp.vocab["Redemonstrated"].check_flag(flag_id) is True
+        assert nlp.vocab["demonstrated"].check_flag(flag_id) is False
+
+    def test_regex_flag_ids(self):
+        vocab = spacy.blank("en").vocab
+        reserved = set(vocab.lex_attr_getters)
+        flag_id = get_regex_flag(vocab, "LOWER", "^x")
+        assert FLAG19 <= flag_id <= FLAG63
+        assert flag_id not in reserved
+        assert get_regex_flag(vocab, "LOWER", "^y") == flag_id + 1
+        assert vocab["xylophone"].check_flag(flag_id) is True
+
+    def test_regex_flag_ids_exhausted(self):
+        vocab = spacy.blank("en").vocab
+        for i in range(FLAG63 - FLAG19 + 1):
+            get_regex_flag(vocab, "LOWER", "^{0}x".format(i))
+        with pytest.raises(ValueError):
+            get_regex_flag(vocab, "LOWER", "^y")
+        pattern = [{"LOWER": {"REGEX": "^y"}}]
+        with pytest.warns(RuntimeWarning):
+            assert compile_regex_predicates(pattern, vocab) == pattern
+
+    def test_regex_flag_new_lexemes(self):
+        rule_set = ConTextRuleSet(nlp)
+        rule_set.add(
+            [ConTextItem("redemonstrated", "HISTORICAL", pattern=[{"LOWER": {"REGEX": "^re-?demonstrat"}}])]
+        )
+        doc = nlp("Redemonstratedxyz opacity, redemonstrating infiltrate.")
+        assert [(start, end) for (_, start, end) in rule_set.match(doc)] == [(0, 1), (3, 4)]
+
+    def test_invalid_pattern(self):
+        rule_set = ConTextRuleSet(nlp)
+        with pytest.raises(MatchPatternError):
+            rule_set.add([ConTextItem("x", "NEGATED_EXISTENCE", pattern=[{"LOWERX": "x"}])])
+
+    def test_rule_sets_suppress_separately(self):
+        rules = ConTextRuleSet(nlp)
+        rules.add([ConTextItem("no history of", "NEGATED_EXISTENCE", rule="FORWARD")])
+        rules.add([ConTextItem("history of", "HISTORICAL", rule="FORWARD")], rule_set="history")
+        assert rules.rule_set_names == [None, "history"]
+        assert rules.rule_set_list == ["history"]
+        assert rules.suppression_table == {}
+        doc = nlp("There is no history of pneumonia.")
+        matches = rules.match(doc, suppress_subsumed=True)
+        assert [(item.category, start, end) for (item, start, end) in matches] == [
+            ("NEGATED_EXISTENCE", 2, 5),
+            ("HISTORICAL", 3, 5),
+        ]
+
+    def test_trigger_filter_windows(self):
+        rule_set, _, _ = self.create_rule_set()
+        trigger_filter = rule_set.trigger_filter
+        assert trigger_filter.complete is True
+        assert trigger_filter.max_length == 3
+        doc = nlp("The patient was seen today. No evidence of pneumonia.")
+        # "evidence" is the trigger of "no evidence of"
+        assert trigger_filter.windows(doc) == [(5, 10)]
+        assert trigger_filter.windows(nlp("The patient was seen today.")) == []
+
+    def test_trigger_filter_incomplete(self):
+        item_data = [ConTextItem("adjective", "POSSIBLE_EXISTENCE", pattern=[{"POS": "ADJ"}])]
+        trigger_filter = build_trigger_filter(item_data, nlp)
+        assert trigger_filter.complete is False
+        assert trigger_filter.windows(nlp("The patient was seen today.")) is None
+
+    def test_trigger_filter_unbounded(self):
+        item_data = [
+            ConTextItem(
+                "history of", "HISTORICAL", pattern=[{"LOWER": "history"}, {"LOWER": "of", "OP": "+"}]
+            )
+        ]
+        trigger_filter = build_trigger_filter(item_data, nlp)
+        assert trigger_filter.max_length is None
+        doc = nlp("The patient has a history of afib.")
+        assert trigger_filter.windows(doc) == [(0, len(doc))]
+
+    def test_match_prefilter(self):
+        rule_set, _, _ = self.create_rule_set()
+        texts = [
+            "No evidence of pneumonia, possible history of afib.",
+            "BP 120/80 HR 72 RR 16 SpO2 98% Temp 98.6 WBC 7.2 Hgb 13.1 Plt 250. Probable pneumonia.",
+            "The patient was seen today.",
+        ]
+        for text in texts:
+            doc = nlp(text)
+            assert rule_set.match(doc, prefilter=True) == rule_set.match(doc)
+        assert rule_set.match(nlp("The patient was seen today."), prefilter=True) == []
@@ -0,0 +1,187 @@
+import tempfile
+import warnings
+from os import path
+
+import pytest
+import spacy
+from spacy.tokens import Span
+
+from cycontext import ConTextComponent, ConTextItem
+from cycontext.compact_graph import CompactConTextGraph
+from cycontext.context_component import _get_compact_graph
+from cycontext.rule_store import MappedRuleSet, write_rule_store
+
+nlp = spacy.load("en_core_web_sm")
+
+tmpdirname = tempfile.TemporaryDirectory()
+
+TEXTS = [
+    "There is no evidence of pneumonia.",
+    "History of pneumonia, no history of CHF.",
+    "Patient has pneumonia and no CHF.",
+    "Family history of pneumonia, but pneumonia is ruled out.",
+]
+
+
+def make_doc(text):
+    doc = nlp(text)
+    doc.ents = [
+        Span(doc, token.i, token.i + 1, label=token.text.upper())
+        for token in doc
+        if token.lower_ in ("pneumonia", "chf")
+    ]
+    return doc
+
+
+def edges(doc):
+    return sorted(
+        (target.start, modifier.start, modifier.end, modifier.category)
+        for (target, modifier) in doc._.context_graph.edges
+    )
+
+
+class TestRuleStore:
+    def test_same_edges(self):
+        filepath = path.join(tmpdirname.name, "default.ctx")
+        context = ConTextComponent(nlp)
+        context.export_rules(filepath)
+        mapped = ConTextComponent(nlp, rules=None)
+        assert mapped.load_rule_store(filepath) == 0
+        assert mapped.frozen
+        assert len(mapped.item_data) == len(context.item_data)
+        for text in TEXTS:
+            assert edges(context(make_doc(text))) == edges(mapped(make_doc(text)))
+
+    def test_patterns(self):
+        filepath = path.join(tmpdirname.name, "patterns.ctx")
+        item_data = [
+            ConTextItem("no", "NEGATED_EXISTENCE", rule="FORWARD"),
+            ConTextItem(
+                "r/o",
+                "NEGATED_EXISTENCE",
+                rule="BACKWARD",
+                pattern=[{"LOWER": {"REGEX": "^rul(ed|es)$"}}, {"LOWER": "out"}],
+            ),
+        ]
+        context = ConTextComponent(nlp, rules=None)
+        context.add(item_data)
+        context.export_rules(filepath)
+        mapped = ConTextComponent(nlp, rules=None)
+        mapped.load_rule_store(filepath)
+        doc = mapped(make_doc("Pneumonia is ruled out, no CHF."))
+        assert edges(doc) == [(0, 2, 4, "NEGATED_EXISTENCE"), (6, 5, 6, "NEGATED_EXISTENCE")]
+
+    def test_item_fields(self):
+        filepath = path.join(tmpdirname.name, "fields.ctx")
+        item = ConTextItem(
+            "positive for",
+            "POSITIVE_EXISTENCE",
+            rule="FORWARD",
+            allowed_types={"PROBLEM"},
+            max_scope=3,
+            terminated_by={"NEGATED_EXISTENCE"},
+            metadata={"source": "test"},
+        )
+        context = ConTextComponent(nlp, rules=None)
+        context.add([item])
+        context.export_rules(filepath)
+        rules = MappedRuleSet(nlp, filepath)
+        loaded = rules.item_data[0]
+        assert loaded.literal == "positive for"
+        assert loaded.allowed_types == {"PROBLEM"}
+        assert loaded.max_scope == 3
+        assert loaded.terminated_by == {"NEGATED_EXISTENCE"}
+        assert loaded.metadata == {"source": "test"}
+        # ConTextItems are created once and reused
+        assert rules.item_data[0] is loaded
+        rules.close()
+
+    def test_suppress_subsumed(self):
+        filepath = path.join(tmpdirname.name, "suppress.ctx")
+        context = ConTextComponent(nlp, rules=None)
+        context.add(
+            [
+                ConTextItem("no history of", "NEGATED_EXISTENCE", rule="FORWARD"),
+                ConTextItem("history of", "HISTORICAL", rule="FORWARD"),
+            ]
+        )
+        write_rule_store(context, filepath)
+        rules = MappedRuleSet(nlp, filepath)
+        doc = nlp("There is no history of pneumonia.")
+        all_matches = [(start, end) for (_, start, end) in rules.match(doc)]
+        suppressed = [
+            (start, end) for (_, start, end) in rules.match(doc, suppress_subsumed=True)
+        ]
+        assert (2, 5) in suppressed
+        assert (3, 5) in all_matches
+        assert (3, 5) not in suppressed
+
+    def test_lean(self):
+        filepath = path.join(tmpdirname.name, "lean.ctx")
+        ConTextComponent(nlp).export_rules(filepath)
+        context = ConTextComponent(nlp, rules=None, lean=True)
+        context.load_rule_store(filepath)
+        doc = context(make_doc("There is no evidence of pneumonia."))
+        assert isinstance(_get_compact_graph(doc), CompactConTextGraph)
+        assert len(doc._.context_graph.edges) == 1
+
+    def test_on_match_fails(self):
+        filepath = path.join(tmpdirname.name, "callback.ctx")
+        context = ConTextComponent(nlp, rules=None)
+        context.add(
+            [ConTextItem("no", "NEGATED_EXISTENCE", on_match=lambda *args: None)]
+        )
+        with pytest.raises(ValueError):
+            context.export_rules(filepath)
+
+    def test_not_a_rule_store(self):
+        filepath = path.join(tmpdirname.name, "rules.json")
+        with open(filepath, "w") as f:
+            f.write('{"item_data": []}')
+        with pytest.raises(ValueError):
+            MappedRuleSet(nlp, filepath)
+
+    def test_cannot_add(self):
+        filepath = path.join(tmpdirname.name, "frozen.ctx")
+        ConTextComponent(nlp).export_rules(filepath)
+        context = ConTextComponent(nlp, rules=None)
+        context.load_rule_store(filepath)
+        with pytest.raises(RuntimeError):
+            context.add([ConTextItem("no", "NEGATED_EXISTENCE")])
+
+    def test_rule_sets(self):
+        filepath = path.join(tmpdirname.name, "rule_sets.ctx")
+        context = ConTextComponent(nlp)
+        context.add_rule_set(
+            "history", [ConTextItem("history of", "HISTORICAL", rule="FORWARD")]
+        )
+        context.export_rules(filepath)
+        mapped = ConTextComponent(nlp, rules=None)
+        mapped.load_rule_store(filepath)
+        assert mapped.rule_sets == ["history"]
+        doc = mapped(make_doc("There is no history of pneumonia."))
+        assert edges(doc) == [(5, 2, 5, "NEGATED_EXISTENCE")]
+        assert [
+            modifier.category for (_, modifier) in doc._.context_graphs["history"].edges
+        ] == ["HISTORICAL"]
+
+    def test_partition_rules_prefilter_warn(self):
+        filepath = path.join(tmpdirname.name, "partition.ctx")
+        context = ConTextComponent(nlp)
+        context.export_rules(filepath)
+        mapped = ConTextComponent(nlp, rules=None, partition_rules=True, prefilter=True)
+        with pytest.warns(RuntimeWarning, match="partition_rules or prefilter"):
+            mapped.load_rule_store(filepath)
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            for text in TEXTS:
+                assert edges(context(make_doc(text))) == edges(mapped(make_doc(text)))
+
+    def test_match_labels_warns(self):
+        filepath = path.join(tmpdirname.name, "labels.ctx")
+        ConTextComponent(nlp).export_rules(filepath)
+        mapped = MappedRuleSet(nlp, filepath)
+        doc = make_doc(TEXTS[0])
+        with pytest.warns(RuntimeWarning):
+            matches = mapped.match(doc, labels=frozenset(["CHF"]))
+        assert matches == mapped.match(doc)
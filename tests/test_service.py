@@ -0,0 +1,202 @@
+import asyncio
+import json
+import threading
+
+import pytest
+import spacy
+
+from cycontext import ConTextComponent
+from cycontext.service import ConTextService, check_record, start_http_server
+
+nlp = spacy.load("en_core_web_sm")
+context = ConTextComponent(nlp)
+
+TEXT = "There is no evidence of pneumonia."
+ENTS = [[24, 33, "PROBLEM"]]
+
+
+class FailingContext:
+    """Delegates to context, but raises for Docs which contain the word "fail"."""
+
+    def __call__(self, doc):
+        if any(token.lower_ == "fail" for token in doc):
+            raise RuntimeError("Failed")
+        return context(doc)
+
+    def __getattr__(self, name):
+        return getattr(context, name)
+
+
+async def http_request(port, method, target, data=None):
+    """A stand-in HTTP client which sends a single request to localhost."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = b"" if data is None else json.dumps(data).encode("utf-8")
+    writer.write(
+        "{0} {1} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {2}\r\n\r\n".format(
+            method, target, len(body)
+        ).encode("latin-1")
+        + body
+    )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    header, _, body = response.partition(b"\r\n\r\n")
+    status = int(header.split(b" ")[1])
+    return status, json.loads(body.decode("utf-8"))
+
+
+class TestConTextService:
+    def test_bad_batch_size(self):
+        with pytest.raises(ValueError):
+            ConTextService(nlp, context, max_batch_size=0)
+
+    def test_process(self):
+        async def run():
+            async with ConTextService(nlp, context) as service:
+                return await service.process(TEXT, ents=ENTS, doc_id="a")
+
+        result = asyncio.run(run())
+        assert result["id"] == "a"
+        assert result["ents"][0]["is_negated"] is True
+
+    def test_not_started(self):
+        async def run():
+            service = ConTextService(nlp, context)
+            await service.process(TEXT)
+
+        with pytest.raises(RuntimeError):
+            asyncio.run(run())
+
+    def test_check_record(self):
+        check_record(TEXT, ENTS)
+        for ents in ([[3, 6]], [[24, 60, "PROBLEM"]], [[6, 3, "PROBLEM"]], [["a", 6, "PROBLEM"]], "ents"):
+            with pytest.raises(ValueError):
+                check_record(TEXT, ents)
+        with pytest.raises(ValueError):
+            check_record(None)
+
+    def test_process_bad_record(self):
+        async def run():
+            async with ConTextService(nlp, context) as service:
+                await service.process("Short.", ents=[[3, 6]])
+
+        with pytest.raises(ValueError):
+            asyncio.run(run())
+
+    def test_error_only_reaches_own_request(self):
+        async def run():
+            async with ConTextService(
+                nlp, FailingContext(), max_batch_size=4, max_wait_ms=50
+            ) as service:
+                results = await asyncio.gather(
+                    service.process(TEXT, ents=ENTS, doc_id=1),
+                    service.process("This will fail.", doc_id=2),
+                    service.process(TEXT, ents=ENTS, doc_id=3),
+                    return_exceptions=True,
+                )
+                return results, service.metrics
+
+        results, metrics = asyncio.run(run())
+        assert results[0]["id"] == 1
+        assert isinstance(results[1], RuntimeError)
+        assert results[2]["id"] == 3
+        assert metrics["errors"] == 1
+        assert metrics["batches"] == 1
+
+    def test_micro_batches(self):
+        async def run():
+            async with ConTextService(nlp, context, max_batch_size=4, max_wait_ms=50) as service:
+                results = await asyncio.gather(
+                    *[service.process(TEXT, ents=ENTS, doc_id=i) for i in range(8)]
+                )
+                return results, service.metrics
+
+        results, metrics = asyncio.run(run())
+        assert [result["id"] for result in results] == list(range(8))
+        assert metrics["documents"] == 8
+        assert metrics["batches"] == 2
+        assert metrics["mean_batch_size"] == 4
+        assert metrics["requests"] == 8
+
+    def test_backpressure(self):
+        class BlockingContext:
+            """Delegates to context after an event is set, to keep a batch in progress."""
+
+            def __init__(self):
+                self.event = threading.Event()
+
+            def __call__(self, doc):
+                self.event.wait(5)
+                return context(doc)
+
+            def __getattr__(self, name):
+                return getattr(context, name)
+
+        async def run():
+            blocking_context = BlockingContext()
+            async with ConTextService(
+                nlp, blocking_context, max_batch_size=1, max_wait_ms=0, max_queue_size=1
+            ) as service:
+                first = asyncio.ensure_future(service.process(TEXT, doc_id=1))
+                await asyncio.sleep(0.05)
+                second = asyncio.ensure_future(service.process(TEXT, doc_id=2))
+                await asyncio.sleep(0.05)
+                with pytest.raises(asyncio.QueueFull):
+                    await service.process(TEXT, block=False)
+                metrics = service.metrics
+                blocking_context.event.set()
+                results = await asyncio.gather(first, second)
+                return metrics, results
+
+        metrics, results = asyncio.run(run())
+        assert metrics["queue_depth"] == 1
+        assert metrics["rejected"] == 1
+        assert [result["id"] for result in results] == [1, 2]
+
+    def test_http(self):
+        async def run():
+            async with ConTextService(nlp, context) as service:
+                server = await start_http_server(service)
+                port = server.sockets[0].getsockname()[1]
+                responses = await asyncio.gather(
+                    http_request(port, "POST", "/process", {"text": TEXT, "ents": ENTS, "id": 1}),
+                    http_request(port, "POST", "/process", {"text": TEXT, "id": 2}),
+                )
+                metrics = await http_request(port, "GET", "/metrics")
+                bad_request = await http_request(port, "POST", "/process", {"id": 3})
+                not_found = await http_request(port, "GET", "/other")
+                server.close()
+                await server.wait_closed()
+                return responses, metrics, bad_request, not_found
+
+        responses, metrics, bad_request, not_found = asyncio.run(run())
+        (status1, result1), (status2, result2) = responses
+        assert status1 == status2 == 200
+        assert result1["id"] == 1
+        assert result1["ents"][0]["is_negated"] is True
+        assert result2["id"] == 2
+        assert metrics[0] == 200
+        assert metrics[1]["documents"] == 2
+        assert bad_request[0] == 400
+        assert not_found[0] == 404
+
+    def test_http_errors(self):
+        async def run():
+            async with ConTextService(nlp, FailingContext()) as service:
+                server = await start_http_server(service)
+                port = server.sockets[0].getsockname()[1]
+                responses = await asyncio.gather(
+                    http_request(port, "POST", "/process", {"text": "Short.", "ents": [[3, 6]]}),
+                    http_request(port, "POST", "/process", {"text": "This will fail."}),
+                    http_request(port, "POST", "/process", {"text": TEXT, "ents": ENTS}),
+                )
+                server.close()
+                await server.wait_closed()
+                return responses
+
+        (bad_ents, failed, ok) = asyncio.run(asyncio.wait_for(run(), 10))
+        assert bad_ents[0] == 400
+        assert "[start_char, end_char, label]" in bad_ents[1]["error"]
+        assert failed[0] == 500
+        assert failed[1]["error"] == "RuntimeError: Failed"
+        assert ok[0] == 200
@@ -0,0 +1,103 @@
+import json
+
+import pytest
+import spacy
+from spacy.tokens import Span
+
+from cycontext import ConTextComponent
+from cycontext.stats import ConTextStats
+
+nlp = spacy.load("en_core_web_sm")
+
+TEXTS = [
+    "There is no evidence of pneumonia.",
+    "History of pneumonia.",
+    "Patient has pneumonia and no CHF.",
+]
+
+
+def make_doc(text, context):
+    doc = nlp(text)
+    doc.ents = [
+        Span(doc, token.i, token.i + 1, label=token.text.upper())
+        for token in doc
+        if token.lower_ in ("pneumonia", "chf")
+    ]
+    return context(doc)
+
+
+class TestConTextStats:
+    def test_update(self):
+        stats = ConTextStats()
+        context = ConTextComponent(nlp)
+        for text in TEXTS:
+            stats.update(make_doc(text, context))
+        assert stats.num_docs == 3
+        assert stats.target_counts == {"PNEUMONIA": 3, "CHF": 1}
+        assert stats.negation_rate("PNEUMONIA") == pytest.approx(1 / 3)
+        assert stats.negation_rate("CHF") == 1.0
+        assert stats.modified_rate("PNEUMONIA", "historical") == pytest.approx(1 / 3)
+        assert stats.edge_counts == {"NEGATED_EXISTENCE": 2, "HISTORICAL": 1}
+        assert stats.edges_per_doc_hist[:3].tolist() == [0, 3, 0]
+        assert stats.scope_length_hist.sum() == stats.num_modifiers
+
+    def test_component_stats(self):
+        stats = ConTextStats()
+        context = ConTextComponent(nlp, stats=stats)
+        for text in TEXTS:
+            make_doc(text, context)
+        assert stats.num_docs == 3
+        assert stats.num_edges == 3
+
+    def test_lean_same_edges(self):
+        stats = ConTextStats()
+        lean_stats = ConTextStats()
+        context = ConTextComponent(nlp)
+        lean_context = ConTextComponent(nlp, lean=True)
+        for text in TEXTS:
+            stats.update(make_doc(text, context))
+            lean_stats.update(make_doc(text, lean_context))
+        assert lean_stats.edge_counts == stats.edge_counts
+        assert lean_stats.modified_target_counts == stats.modified_target_counts
+
+    def test_lean_same_modifiers(self):
+        stats = ConTextStats()
+        lean_stats = ConTextStats()
+        serializable_stats = ConTextStats()
+        context = ConTextComponent(nlp, stats=stats)
+        lean_context = ConTextComponent(nlp, lean=True, stats=lean_stats)
+        serializable_context = ConTextComponent(nlp, serializable=True, stats=serializable_stats)
+        texts = TEXTS + ["No history of fever but there is pneumonia."]
+        for text in texts:
+            make_doc(text, context)
+            make_doc(text, lean_context)
+            make_doc(text, serializable_context)
+        assert stats.num_modifiers > stats.num_edges
+        for other in (lean_stats, serializable_stats):
+            assert other.num_modifiers == stats.num_modifiers
+            assert other.modifier_counts == stats.modifier_counts
+            assert (other.scope_length_hist == stats.scope_length_hist).all()
+            assert other.snapshot() == stats.snapshot()
+
+    def test_pipe(self):
+        stats = ConTextStats()
+        context = ConTextComponent(nlp)
+        docs = list(stats.pipe(make_doc(text, context) for text in TEXTS))
+        assert len(docs) == stats.num_docs == 3
+
+    def test_snapshot_merge(self):
+        context = ConTextComponent(nlp)
+        stats1 = ConTextStats()
+        stats2 = ConTextStats()
+        total = ConTextStats()
+        for (i, text) in enumerate(TEXTS):
+            doc = make_doc(text, context)
+            (stats1 if i % 2 else stats2).update(doc)
+            total.update(doc)
+        snapshot = json.loads(json.dumps(stats1.snapshot()))
+        merged = ConTextStats.from_snapshot(snapshot).merge(stats2)
+        assert merged.snapshot() == total.snapshot()
+
+    def test_merge_different_sizes_fails(self):
+        with pytest.raises(ValueError):
+            ConTextStats(max_edges=10).merge(ConTextStats(max_edges=20))
@@ -215,6 +215,16 @@ class TestTagObject:
         tag_object = TagObject(item, 0, 3, doc, _use_context_window=True)
         assert tag_object.scope == doc[3:5]
 
+    def test_limit_scope_context_window_no_sentences(self):
+        """Test that limiting the scope treats a Doc without sentence boundaries as a single sentence."""
+        doc = nlp.tokenizer("family history of breast cancer but no diabetes. She has afib.")
+        item = ConTextItem("family history of", "FAMILY_HISTORY", rule="FORWARD", max_scope=5)
+        item2 = ConTextItem("but", "TERMINATE", rule="TERMINATE", max_scope=5)
+        tag_object = TagObject(item, 0, 3, doc, _use_context_window=True)
+        tag_object2 = TagObject(item2, 5, 6, doc, _use_context_window=True)
+        assert tag_object.limit_scope(tag_object2)
+        assert tag_object.scope == doc[3:5]
+
     def test_update_scope(self):
         doc, item, tag_object = self.create_objects()
         tag_object.update_scope(doc[3:5])
@@ -0,0 +1,81 @@
+import tempfile
+from os import path
+
+import pytest
+import spacy
+from spacy.tokens import Span
+
+from cycontext import ConTextComponent
+from cycontext.viz import _get_dep_data, render_html
+
+nlp = spacy.load("en_core_web_sm")
+context = ConTextComponent(nlp)
+
+tmpdirname = tempfile.TemporaryDirectory()
+
+
+def make_doc(text):
+    doc = nlp(text)
+    doc.ents = [
+        Span(doc, token.i, token.i + 1, label="PROBLEM")
+        for token in doc
+        if token.lower_ in ("pneumonia", "chf")
+    ]
+    return context(doc)
+
+
+class TestViz:
+    def test_dep_data_merges_spans(self):
+        doc = make_doc("There is no evidence of pneumonia or chf.")
+        dep_data = _get_dep_data(doc)
+        assert [word["text"] for word in dep_data["words"]] == [
+            "There",
+            "is",
+            "no evidence of",
+            "pneumonia",
+            "or",
+            "chf",
+            ".",
+        ]
+        assert [word["index"] for word in dep_data["words"]] == list(range(7))
+        assert dep_data["words"][3]["tag"] == "PROBLEM"
+        arcs = sorted((arc["start"], arc["end"]) for arc in dep_data["arcs"])
+        assert arcs == [(2, 3), (2, 5)]
+
+    def test_render_html(self):
+        directory = path.join(tmpdirname.name, "ent")
+        texts = ["There is no evidence of pneumonia.", "History of chf."] * 3
+        docs = (make_doc(text) for text in texts)
+        filepaths = render_html(docs, directory, doc_ids=["a", "b", "c", "d", "e", "f"], docs_per_file=4)
+        assert [path.basename(filepath) for filepath in filepaths] == [
+            "context-00000.html",
+            "context-00001.html",
+        ]
+        with open(filepaths[0]) as f:
+            html = f.read()
+        assert html.count("<h2>") == 4
+        assert "<h2>a</h2>" in html
+        assert "NEGATED_EXISTENCE" in html
+        assert html.rstrip().endswith("</html>")
+        with open(filepaths[1]) as f:
+            assert f.read().count("<h2>") == 2
+
+    def test_render_html_same_colors(self):
+        directory = path.join(tmpdirname.name, "colors")
+        docs = [make_doc("There is no evidence of pneumonia.")] * 2
+        filepaths = render_html(docs, directory, docs_per_file=1)
+        htmls = []
+        for filepath in filepaths:
+            with open(filepath) as f:
+                htmls.append(f.read().replace("<h2>0</h2>", "<h2>1</h2>"))
+        assert htmls[0] == htmls[1]
+
+    def test_render_html_dep(self):
+        directory = path.join(tmpdirname.name, "dep")
+        filepaths = render_html([make_doc("No pneumonia.")], directory, style="dep")
+        with open(filepaths[0]) as f:
+            assert "<svg" in f.read()
+
+    def test_render_html_bad_style(self):
+        with pytest.raises(ValueError):
+            render_html([], tmpdirname.name, style="tree")